@@ -8,16 +8,101 @@ For comparison, here's what a straightforward implementation looks like:
         result = output()
         result = platform.PLATFORM.GL.glGetDoublev( pname, byref(result) )
         return Numeric.array( result )
+
+Scalar queries of implementation limits (GL_MAX_*, GL_MAJOR_VERSION, etc.)
+cannot change during the lifetime of a context, so glGetBooleanv,
+glGetDoublev, glGetFloatv and glGetIntegerv remember their values per
+context (see immutablePnames) and only ask the driver the first time.
 """
 from OpenGL.GL.VERSION import GL_1_1 as _simple
-import ctypes
+from OpenGL.raw.GL import _glgets
+from OpenGL import contextdata, error, lazywrapper as _lazy
+import ctypes, sys
 GLenum = ctypes.c_uint
 GLsize = GLsizei = ctypes.c_int
 
 __all__ = (
     'glGetString',
+    'glGetBooleanv',
+    'glGetDoublev',
+    'glGetFloatv',
+    'glGetIntegerv',
 )
 
 glGetString = _simple.glGetString
 glGetString.restype = ctypes.c_char_p
 glGetString.__doc__ = """glGetString( constant ) -> Current string value"""
+
+IMMUTABLE_KEY = 'OpenGL.GL.glget.immutable'
+# in addition to every scalar GL_MAX_* query
+IMMUTABLE_NAMES = frozenset([
+    'GL_MAJOR_VERSION',
+    'GL_MINOR_VERSION',
+    'GL_CONTEXT_FLAGS',
+    'GL_CONTEXT_PROFILE_MASK',
+    'GL_NUM_EXTENSIONS',
+    'GL_NUM_COMPRESSED_TEXTURE_FORMATS',
+    'GL_NUM_PROGRAM_BINARY_FORMATS',
+    'GL_NUM_SHADER_BINARY_FORMATS',
+    'GL_SUBPIXEL_BITS',
+    'GL_MIN_MAP_BUFFER_ALIGNMENT',
+    'GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT',
+])
+_immutable = None
+
+def immutablePnames():
+    """Get the set of (integer) pnames whose scalar values are cached
+
+    Collected on first use from the loaded OpenGL.raw.GL modules, any
+    GL_MAX_* or IMMUTABLE_NAMES constant with a glGet size of (1,)
+    """
+    global _immutable
+    if _immutable is None:
+        sizes = _glgets._glget_size_mapping
+        result = set()
+        for name,module in list(sys.modules.items()):
+            if module is None or not name.startswith( 'OpenGL.raw.GL.' ):
+                continue
+            for attr,value in list(vars( module ).items()):
+                if not (attr.startswith( 'GL_MAX_' ) or attr in IMMUTABLE_NAMES):
+                    continue
+                if isinstance( value, int ) and sizes.get( value ) == (1,):
+                    result.add( int(value) )
+        _immutable = frozenset( result )
+    return _immutable
+
+def _cachedGet( baseOperation, kind, pname, data ):
+    """Call baseOperation( pname, data ) caching immutable scalar results"""
+    if data is not None or pname not in immutablePnames():
+        return baseOperation( pname, data )
+    try:
+        cache = contextdata.getValue( IMMUTABLE_KEY )
+    except error.Error:
+        # no current context
+        return baseOperation( pname, data )
+    if cache is None:
+        cache = {}
+        contextdata.setValue( IMMUTABLE_KEY, cache )
+    key = (kind,int(pname))
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = baseOperation( pname, data )
+        return result
+
+@_lazy.lazy( _simple.glGetBooleanv )
+def glGetBooleanv( baseOperation, pname, data=None ):
+    """glGetBooleanv( pname, data=None ) -> value(s) of pname"""
+    return _cachedGet( baseOperation, 'b', pname, data )
+@_lazy.lazy( _simple.glGetDoublev )
+def glGetDoublev( baseOperation, pname, data=None ):
+    """glGetDoublev( pname, data=None ) -> value(s) of pname"""
+    return _cachedGet( baseOperation, 'd', pname, data )
+@_lazy.lazy( _simple.glGetFloatv )
+def glGetFloatv( baseOperation, pname, data=None ):
+    """glGetFloatv( pname, data=None ) -> value(s) of pname"""
+    return _cachedGet( baseOperation, 'f', pname, data )
+@_lazy.lazy( _simple.glGetIntegerv )
+def glGetIntegerv( baseOperation, pname, data=None ):
+    """glGetIntegerv( pname, data=None ) -> value(s) of pname"""
+    return _cachedGet( baseOperation, 'i', pname, data )
@@ -0,0 +1,369 @@
+"""CPU-side ray picking as a replacement for selection-buffer picking
+
+Legacy selection mode (glSelectBuffer/glRenderMode( GL_SELECT )) requires
+re-rendering the scene with a pick matrix, and on modern drivers is
+frequently software-emulated and slow.  This module performs the same
+operation without touching the GL at all: the window coordinate is
+unprojected (the same math as gluUnProject) into a ray, which is tested
+against a bounding-volume hierarchy of axis-aligned boxes describing the
+pickable objects.
+
+Results are returned as OpenGL.GL.selection.GLSelectRecord instances, so
+code written against glRenderMode( GL_RENDER ) results can consume them
+unchanged.  near and far are window-space depths (0.0-1.0) of the points
+where the ray enters and leaves each box.
+
+Usage:
+
+    bvh = BVH( [
+        ( name, (minX,minY,minZ), (maxX,maxY,maxZ) ),
+        ...
+    ] )
+    for record in pick( x, viewport[3]-y, bvh ):
+        print( record.near, record.names )
+
+Note that window coordinates use the GL convention (origin at the
+bottom-left), GLUT mouse coordinates need their y value flipped.
+"""
+from OpenGL.GL.selection import GLSelectRecord
+
+__all__ = (
+    'BVH',
+    'unProject',
+    'rayFromWindow',
+    'pick',
+)
+
+LEAF_SIZE = 4
+HUGE = 1e30
+
+def _flatten( matrix ):
+    """Produce a 16-float column-major sequence from a GL matrix
+
+    Accepts the 4x4 arrays returned by glGetDoublev/glGetFloatv as
+    well as flat 16-element sequences.
+    """
+    try:
+        return [ float(matrix[i][j]) for i in range(4) for j in range(4) ]
+    except TypeError:
+        return [ float(v) for v in matrix ]
+
+def _multiply( a, b ):
+    """Multiply two column-major 4x4 matrices (a*b)"""
+    return [
+        a[r]*b[c*4] + a[4+r]*b[c*4+1] + a[8+r]*b[c*4+2] + a[12+r]*b[c*4+3]
+        for c in range(4) for r in range(4)
+    ]
+
+def _invert( m ):
+    """Invert a column-major 4x4 matrix (same algorithm as GLU's)
+
+    raises ValueError if the matrix is singular
+    """
+    inv = [0.0]*16
+    inv[0] = (m[5]*m[10]*m[15] - m[5]*m[11]*m[14] - m[9]*m[6]*m[15]
+        + m[9]*m[7]*m[14] + m[13]*m[6]*m[11] - m[13]*m[7]*m[10])
+    inv[4] = (-m[4]*m[10]*m[15] + m[4]*m[11]*m[14] + m[8]*m[6]*m[15]
+        - m[8]*m[7]*m[14] - m[12]*m[6]*m[11] + m[12]*m[7]*m[10])
+    inv[8] = (m[4]*m[9]*m[15] - m[4]*m[11]*m[13] - m[8]*m[5]*m[15]
+        + m[8]*m[7]*m[13] + m[12]*m[5]*m[11] - m[12]*m[7]*m[9])
+    inv[12] = (-m[4]*m[9]*m[14] + m[4]*m[10]*m[13] + m[8]*m[5]*m[14]
+        - m[8]*m[6]*m[13] - m[12]*m[5]*m[10] + m[12]*m[6]*m[9])
+    inv[1] = (-m[1]*m[10]*m[15] + m[1]*m[11]*m[14] + m[9]*m[2]*m[15]
+        - m[9]*m[3]*m[14] - m[13]*m[2]*m[11] + m[13]*m[3]*m[10])
+    inv[5] = (m[0]*m[10]*m[15] - m[0]*m[11]*m[14] - m[8]*m[2]*m[15]
+        + m[8]*m[3]*m[14] + m[12]*m[2]*m[11] - m[12]*m[3]*m[10])
+    inv[9] = (-m[0]*m[9]*m[15] + m[0]*m[11]*m[13] + m[8]*m[1]*m[15]
+        - m[8]*m[3]*m[13] - m[12]*m[1]*m[11] + m[12]*m[3]*m[9])
+    inv[13] = (m[0]*m[9]*m[14] - m[0]*m[10]*m[13] - m[8]*m[1]*m[14]
+        + m[8]*m[2]*m[13] + m[12]*m[1]*m[10] - m[12]*m[2]*m[9])
+    inv[2] = (m[1]*m[6]*m[15] - m[1]*m[7]*m[14] - m[5]*m[2]*m[15]
+        + m[5]*m[3]*m[14] + m[13]*m[2]*m[7] - m[13]*m[3]*m[6])
+    inv[6] = (-m[0]*m[6]*m[15] + m[0]*m[7]*m[14] + m[4]*m[2]*m[15]
+        - m[4]*m[3]*m[14] - m[12]*m[2]*m[7] + m[12]*m[3]*m[6])
+    inv[10] = (m[0]*m[5]*m[15] - m[0]*m[7]*m[13] - m[4]*m[1]*m[15]
+        + m[4]*m[3]*m[13] + m[12]*m[1]*m[7] - m[12]*m[3]*m[5])
+    inv[14] = (-m[0]*m[5]*m[14] + m[0]*m[6]*m[13] + m[4]*m[1]*m[14]
+        - m[4]*m[2]*m[13] - m[12]*m[1]*m[6] + m[12]*m[2]*m[5])
+    inv[3] = (-m[1]*m[6]*m[11] + m[1]*m[7]*m[10] + m[5]*m[2]*m[11]
+        - m[5]*m[3]*m[10] - m[9]*m[2]*m[7] + m[9]*m[3]*m[6])
+    inv[7] = (m[0]*m[6]*m[11] - m[0]*m[7]*m[10] - m[4]*m[2]*m[11]
+        + m[4]*m[3]*m[10] + m[8]*m[2]*m[7] - m[8]*m[3]*m[6])
+    inv[11] = (-m[0]*m[5]*m[11] + m[0]*m[7]*m[9] + m[4]*m[1]*m[11]
+        - m[4]*m[3]*m[9] - m[8]*m[1]*m[7] + m[8]*m[3]*m[5])
+    inv[15] = (m[0]*m[5]*m[10] - m[0]*m[6]*m[9] - m[4]*m[1]*m[10]
+        + m[4]*m[2]*m[9] + m[8]*m[1]*m[6] - m[8]*m[2]*m[5])
+    det = m[0]*inv[0] + m[1]*inv[4] + m[2]*inv[8] + m[3]*inv[12]
+    if det == 0.0:
+        raise ValueError( """Singular matrix, cannot invert""" )
+    det = 1.0/det
+    return [ v*det for v in inv ]
+
+def _matrices( model, proj, view ):
+    """Fill in model/projection/viewport from the GL if not provided"""
+    if model is None or proj is None or view is None:
+        from OpenGL import GL
+        if model is None:
+            model = GL.glGetDoublev( GL.GL_MODELVIEW_MATRIX )
+        if proj is None:
+            proj = GL.glGetDoublev( GL.GL_PROJECTION_MATRIX )
+        if view is None:
+            view = GL.glGetIntegerv( GL.GL_VIEWPORT )
+    return _flatten( model ), _flatten( proj ), [ float(v) for v in view ]
+
+def _unProjectWith( inverse, winX, winY, winZ, view ):
+    """Unproject using a pre-computed inverse(proj*model) matrix"""
+    x = (winX - view[0]) / view[2] * 2.0 - 1.0
+    y = (winY - view[1]) / view[3] * 2.0 - 1.0
+    z = winZ * 2.0 - 1.0
+    m = inverse
+    w = m[3]*x + m[7]*y + m[11]*z + m[15]
+    if w == 0.0:
+        raise ValueError( """Projection failed!""" )
+    return (
+        (m[0]*x + m[4]*y + m[8]*z + m[12]) / w,
+        (m[1]*x + m[5]*y + m[9]*z + m[13]) / w,
+        (m[2]*x + m[6]*y + m[10]*z + m[14]) / w,
+    )
+
+def unProject( winX, winY, winZ, model=None, proj=None, view=None ):
+    """Pure-Python equivalent of gluUnProject
+
+    Automatically fills in the model, projection and viewing matrices
+    from the GL if not provided (which is the only GL interaction).
+
+    returns (objX,objY,objZ) floats
+    raises ValueError if the projection is degenerate
+    """
+    model, proj, view = _matrices( model, proj, view )
+    inverse = _invert( _multiply( proj, model ) )
+    return _unProjectWith( inverse, winX, winY, winZ, view )
+
+def rayFromWindow( winX, winY, model=None, proj=None, view=None ):
+    """Produce a pick-ray for the given window coordinate
+
+    returns (origin,direction) where origin lies on the near plane and
+    origin+direction lies on the far plane, so parameters along the ray
+    in the range 0.0-1.0 cover the visible depth range
+    """
+    model, proj, view = _matrices( model, proj, view )
+    inverse = _invert( _multiply( proj, model ) )
+    origin = _unProjectWith( inverse, winX, winY, 0.0, view )
+    end = _unProjectWith( inverse, winX, winY, 1.0, view )
+    return origin, tuple([ end[i]-origin[i] for i in range(3) ])
+
+class BVH( object ):
+    """Bounding-volume hierarchy over axis-aligned bounding boxes
+
+    The tree is stored in flat lists (6 bound values per node, child and
+    item-range indices) to keep traversal cheap in pure Python.  Nodes are
+    allocated in pre-order, so every child has a larger index than its
+    parent, which lets refit() run as a single reverse pass.
+
+    items -- sequence of (name, lower, upper) where lower and upper are
+        3-element box corners.  name may be any value, or a sequence of
+        values to produce a multi-level name stack in the pick records.
+    """
+    def __init__( self, items=() ):
+        self.names = []
+        self.boxes = []
+        for name, lower, upper in items:
+            self.names.append( name )
+            self.boxes.append( (
+                float(lower[0]), float(lower[1]), float(lower[2]),
+                float(upper[0]), float(upper[1]), float(upper[2]),
+            ) )
+        self.build()
+
+    def __len__( self ):
+        return len(self.names)
+
+    def build( self ):
+        """(Re)build the hierarchy from the current boxes"""
+        boxes = self.boxes
+        self.order = order = list(range(len(boxes)))
+        self.bounds = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.count = []
+        if not boxes:
+            return
+        centers = [
+            ((b[0]+b[3])*.5, (b[1]+b[4])*.5, (b[2]+b[5])*.5)
+            for b in boxes
+        ]
+        stack = [ (self._allocate(), 0, len(order)) ]
+        while stack:
+            node, start, end = stack.pop()
+            self._setBounds( node, start, end )
+            if end - start <= LEAF_SIZE:
+                self.start[node] = start
+                self.count[node] = end - start
+                continue
+            # split at the median along the longest centroid axis...
+            subset = order[start:end]
+            extents = [
+                max( centers[i][axis] for i in subset ) - min( centers[i][axis] for i in subset )
+                for axis in range(3)
+            ]
+            axis = extents.index( max(extents) )
+            subset.sort( key=lambda i: centers[i][axis] )
+            order[start:end] = subset
+            middle = (start + end)//2
+            left = self._allocate()
+            right = self._allocate()
+            self.left[node] = left
+            self.right[node] = right
+            stack.append( (right, middle, end) )
+            stack.append( (left, start, middle) )
+
+    def _allocate( self ):
+        node = len(self.left)
+        self.bounds.extend( (0.0,)*6 )
+        self.left.append( -1 )
+        self.right.append( -1 )
+        self.start.append( 0 )
+        self.count.append( 0 )
+        return node
+
+    def _setBounds( self, node, start, end ):
+        boxes = self.boxes
+        subset = [ boxes[i] for i in self.order[start:end] ]
+        self.bounds[node*6:node*6+6] = [
+            min( b[k] for b in subset ) for k in range(3)
+        ] + [
+            max( b[k] for b in subset ) for k in range(3,6)
+        ]
+
+    def update( self, index, lower, upper ):
+        """Change the box of item index, call refit() afterward"""
+        self.boxes[index] = (
+            float(lower[0]), float(lower[1]), float(lower[2]),
+            float(upper[0]), float(upper[1]), float(upper[2]),
+        )
+
+    def refit( self ):
+        """Recompute node bounds after update() without rebuilding
+
+        Much cheaper than build() for moving objects, though the tree
+        quality degrades if objects move far from their original positions.
+        """
+        bounds = self.bounds
+        for node in range(len(self.left)-1, -1, -1):
+            left = self.left[node]
+            if left < 0:
+                start = self.start[node]
+                self._setBounds( node, start, start+self.count[node] )
+            else:
+                l, r = left*6, self.right[node]*6
+                bounds[node*6:node*6+6] = [
+                    min( bounds[l+k], bounds[r+k] ) for k in range(3)
+                ] + [
+                    max( bounds[l+k], bounds[r+k] ) for k in range(3,6)
+                ]
+
+    def intersect( self, origin, direction, tMin=0.0, tMax=1.0 ):
+        """Find all items hit by the ray origin + t*direction, tMin <= t <= tMax
+
+        returns list of (tNear, tFar, index) sorted by tNear
+        """
+        if not self.left:
+            return []
+        ox, oy, oz = origin
+        # axis-parallel rays get a huge (rather than infinite) inverse so
+        # that a zero-width slab offset never produces NaN
+        ix, iy, iz = [ 1.0/d if d else HUGE for d in direction ]
+        bounds = self.bounds
+        boxes = self.boxes
+        order = self.order
+        leftNodes = self.left
+        rightNodes = self.right
+        starts = self.start
+        counts = self.count
+        results = []
+
+        def slab( b, base ):
+            """Ray/box slab test, returns (near,far) or None"""
+            t1 = (b[base]-ox)*ix
+            t2 = (b[base+3]-ox)*ix
+            if t1 > t2: t1, t2 = t2, t1
+            near, far = t1, t2
+            t1 = (b[base+1]-oy)*iy
+            t2 = (b[base+4]-oy)*iy
+            if t1 > t2: t1, t2 = t2, t1
+            if t1 > near: near = t1
+            if t2 < far: far = t2
+            t1 = (b[base+2]-oz)*iz
+            t2 = (b[base+5]-oz)*iz
+            if t1 > t2: t1, t2 = t2, t1
+            if t1 > near: near = t1
+            if t2 < far: far = t2
+            if near > far or far < tMin or near > tMax:
+                return None
+            return near, far
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if slab( bounds, node*6 ) is None:
+                continue
+            left = leftNodes[node]
+            if left >= 0:
+                stack.append( rightNodes[node] )
+                stack.append( left )
+                continue
+            start = starts[node]
+            for index in order[start:start+counts[node]]:
+                hit = slab( boxes[index], 0 )
+                if hit is not None:
+                    results.append( (max(hit[0],tMin), min(hit[1],tMax), index) )
+        results.sort()
+        return results
+
+def _depth( matrix, point ):
+    """Window-space depth (0.0-1.0) of point under combined matrix"""
+    m = matrix
+    x, y, z = point
+    clipZ = m[2]*x + m[6]*y + m[10]*z + m[14]
+    clipW = m[3]*x + m[7]*y + m[11]*z + m[15]
+    if clipW == 0.0:
+        return 0.0
+    return min( 1.0, max( 0.0, (clipZ/clipW)*0.5 + 0.5 ) )
+
+def pick( winX, winY, bvh, model=None, proj=None, view=None ):
+    """Pick the items under the given window coordinate
+
+    winX, winY -- window coordinates (origin at bottom-left)
+    bvh -- BVH instance, or a sequence of BVH instances (for instance
+        a static one for the world and a small one for moving objects)
+    model, proj, view -- matrices as for gluUnProject, read from the GL
+        if not provided
+
+    returns list of GLSelectRecord sorted nearest-first, as
+    glRenderMode( GL_RENDER ) would after a GL_SELECT pass
+    """
+    model, proj, view = _matrices( model, proj, view )
+    combined = _multiply( proj, model )
+    inverse = _invert( combined )
+    origin = _unProjectWith( inverse, winX, winY, 0.0, view )
+    end = _unProjectWith( inverse, winX, winY, 1.0, view )
+    direction = [ end[i]-origin[i] for i in range(3) ]
+    if isinstance( bvh, BVH ):
+        bvh = [bvh]
+    divisor = GLSelectRecord.DISTANCE_DIVISOR
+    records = []
+    for tree in bvh:
+        for near, far, index in tree.intersect( origin, direction ):
+            nearDepth = _depth( combined, [origin[i]+direction[i]*near for i in range(3)] )
+            farDepth = _depth( combined, [origin[i]+direction[i]*far for i in range(3)] )
+            name = tree.names[index]
+            if isinstance( name, (list,tuple) ):
+                names = list(name)
+            else:
+                names = [name]
+            records.append( GLSelectRecord(
+                int(nearDepth*divisor), int(farDepth*divisor), names,
+            ))
+    records.sort( key=lambda record: record.near )
+    return records
@@ -0,0 +1,224 @@
+"""Cached VBO meshes standing in for the GLUT/GLU solid primitives
+
+glutSolidSphere, glutSolidCone, gluCylinder and friends tessellate their
+shape on the CPU and submit it in immediate mode on every call.  The
+functions here take the same arguments but build a unit-sized mesh once
+per tessellation level (per context), store it in vertex/index buffer
+objects and draw it with a single glDrawElements scaled to the requested
+size, so call sites can switch mechanically:
+
+    glutSolidSphere( radius, 32, 32 )      -> solidSphere( radius, 32, 32 )
+    glutSolidCube( size )                  -> solidCube( size )
+    glutSolidCone( base, height, 16, 4 )   -> solidCone( base, height, 16, 4 )
+    glutSolidCylinder( r, height, 16, 4 )  -> solidCylinder( r, height, 16, 4 )
+    gluSphere( quadric, radius, 16, 16 )   -> sphere( quadric, radius, 16, 16 )
+    gluCylinder( quadric, b, t, h, 16, 1 ) -> cylinder( quadric, b, t, h, 16, 1 )
+
+The shapes use the GLUT/GLU orientation (spheres centred on the origin,
+cones and cylinders running from z=0 along +z) and carry outward normals
+(quadric normal/orientation settings are ignored).  Sizes are applied
+with glScalef, so enable GL_NORMALIZE (or GL_RESCALE_NORMAL for uniform
+scales) when drawing lit primitives at sizes other than 1.0.
+
+Meshes are created on first use in the current context and live as long
+as the context does; getMeshCache().clear() releases them earlier.
+"""
+import math
+from OpenGL import GL, contextdata
+from OpenGL.arrays import vbo, GLfloatArray, GLuintArray
+
+__all__ = (
+    'Mesh',
+    'MeshCache',
+    'getMeshCache',
+    'solidSphere',
+    'solidCube',
+    'solidCone',
+    'solidCylinder',
+    'sphere',
+    'cylinder',
+)
+
+CONTEXT_KEY = 'OpenGL.GL.primitives'
+
+class Mesh( object ):
+    """Indexed GL_N3F_V3F triangle mesh held in buffer objects"""
+    submitted = 0  # vertices drawn by all meshes so far, for frame statistics
+    def __init__( self, vertices, indices ):
+        """vertices -- flat normal/vertex floats, indices -- triangle vertex indices"""
+        self.vertices = vbo.VBO( GLfloatArray.asArray( vertices ))
+        self.indices = vbo.VBO(
+            GLuintArray.asArray( indices ), target=GL.GL_ELEMENT_ARRAY_BUFFER,
+        )
+        self.count = len(indices)
+    def draw( self, x=1.0, y=1.0, z=1.0 ):
+        """Draw the mesh scaled by (x,y,z)"""
+        GL.glPushMatrix()
+        GL.glScalef( x, y, z )
+        self.vertices.bind()
+        self.indices.bind()
+        try:
+            GL.glInterleavedArrays( GL.GL_N3F_V3F, 0, self.vertices )
+            GL.glDrawElements( GL.GL_TRIANGLES, self.count, GL.GL_UNSIGNED_INT, self.indices )
+            Mesh.submitted += self.count
+            GL.glDisableClientState( GL.GL_NORMAL_ARRAY )
+            GL.glDisableClientState( GL.GL_VERTEX_ARRAY )
+        finally:
+            self.indices.unbind()
+            self.vertices.unbind()
+            GL.glPopMatrix()
+    def delete( self ):
+        self.vertices.delete()
+        self.indices.delete()
+
+def _ring( vertices, indices, rings, slices, point ):
+    """Append a (rings+1) x (slices+1) grid, point(ring,slice) -> (normal,vertex)
+
+    Triangles face outward when rings run from +z towards -z and slices go
+    counter-clockwise around the z axis.
+    """
+    start = len(vertices) // 6
+    for ring in range( rings + 1 ):
+        for slice in range( slices + 1 ):
+            normal, vertex = point( ring, slice )
+            vertices.extend( normal )
+            vertices.extend( vertex )
+    row = slices + 1
+    for ring in range( rings ):
+        for slice in range( slices ):
+            a = start + ring * row + slice
+            b = a + row
+            indices.extend( (a, b, a + 1, a + 1, b, b + 1) )
+
+def _disk( vertices, indices, slices, z, normalZ ):
+    """Append a unit disk at height z facing normalZ (+1 or -1)"""
+    centre = len(vertices) // 6
+    vertices.extend( (0.0, 0.0, normalZ, 0.0, 0.0, z) )
+    for slice in range( slices + 1 ):
+        angle = 2 * math.pi * slice / slices
+        vertices.extend( (0.0, 0.0, normalZ, math.cos( angle ), math.sin( angle ), z) )
+    for slice in range( slices ):
+        a, b = centre + 1 + slice, centre + 2 + slice
+        indices.extend( (centre, a, b) if normalZ > 0 else (centre, b, a) )
+
+def sphereMesh( slices, stacks ):
+    """Unit sphere, stacks run from the +z to the -z pole"""
+    vertices, indices = [], []
+    def point( stack, slice ):
+        phi = math.pi * stack / stacks
+        theta = 2 * math.pi * slice / slices
+        normal = (
+            math.sin( phi ) * math.cos( theta ),
+            math.sin( phi ) * math.sin( theta ),
+            math.cos( phi ),
+        )
+        return normal, normal
+    _ring( vertices, indices, stacks, slices, point )
+    return Mesh( vertices, indices )
+
+def cylinderMesh( base, top, slices, stacks, caps=False ):
+    """Cylinder/cone of height 1 from radius base at z=0 to radius top at z=1"""
+    vertices, indices = [], []
+    # slope of the side, used to tilt the normals of cones
+    length = math.sqrt( 1.0 + (base - top) ** 2 )
+    normalZ = (base - top) / length
+    def point( stack, slice ):
+        # stacks run down from the top ring so the shared winding faces outward
+        z = 1.0 - float(stack) / stacks
+        theta = 2 * math.pi * slice / slices
+        radius = base + (top - base) * z
+        cos, sin = math.cos( theta ), math.sin( theta )
+        return (cos / length, sin / length, normalZ), (radius * cos, radius * sin, z)
+    _ring( vertices, indices, stacks, slices, point )
+    if caps:
+        if base > 0:
+            _disk( vertices, indices, slices, 0.0, -1.0 )
+        if top > 0:
+            # scale the cap to the top radius
+            start = len(vertices) // 6
+            _disk( vertices, indices, slices, 1.0, 1.0 )
+            for index in range( start, len(vertices) // 6 ):
+                vertices[index * 6 + 3] *= top
+                vertices[index * 6 + 4] *= top
+    return Mesh( vertices, indices )
+
+CUBE_FACES = (
+    ((0, 0, 1), ((-1, -1, 1), (1, -1, 1), (1, 1, 1), (-1, 1, 1))),
+    ((0, 0, -1), ((1, -1, -1), (-1, -1, -1), (-1, 1, -1), (1, 1, -1))),
+    ((0, 1, 0), ((-1, 1, 1), (1, 1, 1), (1, 1, -1), (-1, 1, -1))),
+    ((0, -1, 0), ((-1, -1, -1), (1, -1, -1), (1, -1, 1), (-1, -1, 1))),
+    ((1, 0, 0), ((1, -1, 1), (1, -1, -1), (1, 1, -1), (1, 1, 1))),
+    ((-1, 0, 0), ((-1, -1, -1), (-1, -1, 1), (-1, 1, 1), (-1, 1, -1))),
+)
+
+def cubeMesh():
+    """Cube of edge length 1 centred on the origin"""
+    vertices, indices = [], []
+    for normal, corners in CUBE_FACES:
+        start = len(vertices) // 6
+        for corner in corners:
+            vertices.extend( normal )
+            vertices.extend( [ c * 0.5 for c in corner ] )
+        indices.extend( (start, start + 1, start + 2, start, start + 2, start + 3) )
+    return Mesh( vertices, indices )
+
+class MeshCache( object ):
+    """Unit meshes for a single context keyed by shape and tessellation"""
+    def __init__( self ):
+        self.meshes = {}
+    def get( self, key, factory, *args ):
+        """Get the mesh for key, creating it with factory(*args) on first use"""
+        mesh = self.meshes.get( key )
+        if mesh is None:
+            mesh = self.meshes[key] = factory( *args )
+        return mesh
+    def clear( self ):
+        """Delete all the meshes' buffers (requires the context to be current)"""
+        for mesh in self.meshes.values():
+            mesh.delete()
+        self.meshes.clear()
+
+def getMeshCache( context=None ):
+    """Get the MeshCache for the given (default current) context"""
+    cache = contextdata.getValue( CONTEXT_KEY, context=context )
+    if cache is None:
+        cache = MeshCache()
+        contextdata.setValue( CONTEXT_KEY, cache, context=context )
+    return cache
+
+def solidSphere( radius, slices, stacks ):
+    """glutSolidSphere replacement"""
+    getMeshCache().get( ('sphere', slices, stacks), sphereMesh, slices, stacks ).draw(
+        radius, radius, radius,
+    )
+
+def solidCube( size ):
+    """glutSolidCube replacement"""
+    getMeshCache().get( 'cube', cubeMesh ).draw( size, size, size )
+
+def solidCone( base, height, slices, stacks ):
+    """glutSolidCone replacement (including the base disk)"""
+    getMeshCache().get(
+        ('cone', slices, stacks), cylinderMesh, 1.0, 0.0, slices, stacks, True,
+    ).draw( base, base, height )
+
+def solidCylinder( radius, height, slices, stacks ):
+    """glutSolidCylinder replacement (including both end caps)"""
+    getMeshCache().get(
+        ('cylinder', slices, stacks), cylinderMesh, 1.0, 1.0, slices, stacks, True,
+    ).draw( radius, radius, height )
+
+def sphere( quadric, radius, slices, stacks ):
+    """gluSphere replacement, quadric is accepted for compatibility and ignored"""
+    solidSphere( radius, slices, stacks )
+
+def cylinder( quadric, base, top, height, slices, stacks ):
+    """gluCylinder replacement (no caps), quadric is accepted and ignored"""
+    scale = max( base, top )
+    if scale <= 0:
+        return
+    # the taper ratio is part of the mesh, the overall radius is a scale
+    base, top = round( base / scale, 6 ), round( top / scale, 6 )
+    getMeshCache().get(
+        ('tube', base, top, slices, stacks), cylinderMesh, base, top, slices, stacks,
+    ).draw( scale, scale, height )
@@ -0,0 +1,314 @@
+"""Pooled offscreen render targets and post-processing passes
+
+Rendering to a texture needs a framebuffer object plus a colour texture
+and usually a depth renderbuffer, all of which are comparatively
+expensive to create.  RenderTargetPool hands out RenderTarget objects
+built from recycled framebuffers and attachments, which are reused
+whenever a released attachment of the same size and format is available:
+
+    pool = getRenderTargetPool()
+    pool.reshape( width, height )           # from the window's reshape()
+    scene = pool.target( 'scene', 0.75 )    # 75% of the window, kept
+    scene.bind()
+    ... render ...
+    chain.run( scene, width, height )       # post-process into the window
+
+Named targets (target()) are sized relative to the size passed to
+reshape() and are re-created when either changes; temporary targets
+(acquire()/release()) have explicit sizes and are returned to the pool
+as soon as the caller is done with them.
+
+PostProcessChain runs a list of PostPass full-screen passes, each
+reading the previous pass' colour texture, ping-ponging between pooled
+temporary targets and drawing the last pass into the window (framebuffer
+0).  A pass is either a plain (bilinear filtered) copy or a GLSL program
+reading the 'source' sampler with optional 'texelSize' (1/width,
+1/height of the source) uniform.
+
+The pool is stored per-context using OpenGL.contextdata.
+"""
+from OpenGL import GL, contextdata
+from OpenGL.GL import framebufferobjects as fbos
+
+__all__ = (
+    'RenderTarget',
+    'RenderTargetPool',
+    'getRenderTargetPool',
+    'PostPass',
+    'PostProcessChain',
+    'PASS_VERTEX_SHADER',
+    'SHARPEN_SHADER',
+)
+
+CONTEXT_KEY = 'OpenGL.GL.rendertargets'
+
+PASS_VERTEX_SHADER = '''#version 120
+void main() {
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+    gl_Position = gl_Vertex;
+}
+'''
+SHARPEN_SHADER = '''#version 120
+// unsharp mask, restores some of the detail lost when upscaling
+uniform sampler2D source;
+uniform vec2 texelSize;
+uniform float strength;
+void main() {
+    vec2 uv = gl_TexCoord[0].st;
+    vec4 centre = texture2D( source, uv );
+    vec4 blur = (
+        texture2D( source, uv + vec2( texelSize.x, 0.0 )) +
+        texture2D( source, uv - vec2( texelSize.x, 0.0 )) +
+        texture2D( source, uv + vec2( 0.0, texelSize.y )) +
+        texture2D( source, uv - vec2( 0.0, texelSize.y ))
+    ) * 0.25;
+    gl_FragColor = clamp( centre + (centre - blur) * strength, 0.0, 1.0 );
+}
+'''
+
+class RenderTarget( object ):
+    """Framebuffer object with a colour texture and optional depth renderbuffer
+
+    Don't create these directly, get them from RenderTargetPool.acquire()
+    or RenderTargetPool.target().
+    """
+    def __init__( self, framebuffer, width, height, colorFormat, depthFormat, texture, depth ):
+        self.framebuffer = framebuffer
+        self.width = width
+        self.height = height
+        self.colorFormat = colorFormat
+        self.depthFormat = depthFormat
+        self.texture = texture
+        self.depth = depth
+    def bind( self ):
+        """Render into this target (binds the framebuffer and sets the viewport)"""
+        fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, self.framebuffer )
+        GL.glViewport( 0, 0, self.width, self.height )
+
+class RenderTargetPool( object ):
+    """Recycles framebuffers, colour textures and depth renderbuffers
+
+    Free attachments are kept in lists keyed by (width,height,format),
+    stats counts how many objects have been created ('created') and how
+    many requests were served from the pool ('reused').
+    """
+    def __init__( self ):
+        self.framebuffers = []
+        self.textures = {}
+        self.renderbuffers = {}
+        self.named = {}
+        self.width = self.height = 0
+        self.stats = {'created': 0, 'reused': 0}
+    def _take( self, free, key ):
+        items = free.get( key )
+        if items:
+            self.stats['reused'] += 1
+            return items.pop()
+        self.stats['created'] += 1
+        return None
+    def _texture( self, width, height, colorFormat ):
+        texture = self._take( self.textures, (width,height,colorFormat) )
+        if texture is None:
+            texture = GL.glGenTextures( 1 )
+            GL.glBindTexture( GL.GL_TEXTURE_2D, texture )
+            GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR )
+            GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR )
+            GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE )
+            GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE )
+            GL.glTexImage2D(
+                GL.GL_TEXTURE_2D, 0, colorFormat, width, height, 0,
+                GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None,
+            )
+            GL.glBindTexture( GL.GL_TEXTURE_2D, 0 )
+        return texture
+    def _renderbuffer( self, width, height, depthFormat ):
+        renderbuffer = self._take( self.renderbuffers, (width,height,depthFormat) )
+        if renderbuffer is None:
+            renderbuffer = fbos.glGenRenderbuffers( 1 )
+            fbos.glBindRenderbuffer( fbos.GL_RENDERBUFFER, renderbuffer )
+            fbos.glRenderbufferStorage( fbos.GL_RENDERBUFFER, depthFormat, width, height )
+            fbos.glBindRenderbuffer( fbos.GL_RENDERBUFFER, 0 )
+        return renderbuffer
+    def acquire( self, width, height, colorFormat=GL.GL_RGBA8, depthFormat=GL.GL_DEPTH_COMPONENT24 ):
+        """Get a complete RenderTarget of the given size and formats
+
+        depthFormat -- renderbuffer format for a depth attachment, None
+            for a colour-only target (e.g. post-processing)
+
+        Leaves the default framebuffer (0) bound, raises GLError if the
+        implementation rejects the combination of formats.
+        """
+        width, height = max( 1, int(width) ), max( 1, int(height) )
+        texture = self._texture( width, height, colorFormat )
+        depth = None
+        if depthFormat is not None:
+            depth = self._renderbuffer( width, height, depthFormat )
+        if self.framebuffers:
+            framebuffer = self.framebuffers.pop()
+        else:
+            framebuffer = fbos.glGenFramebuffers( 1 )
+        fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, framebuffer )
+        fbos.glFramebufferTexture2D(
+            fbos.GL_FRAMEBUFFER, fbos.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, texture, 0,
+        )
+        fbos.glFramebufferRenderbuffer(
+            fbos.GL_FRAMEBUFFER, fbos.GL_DEPTH_ATTACHMENT, fbos.GL_RENDERBUFFER, depth or 0,
+        )
+        try:
+            fbos.checkFramebufferStatus()
+        finally:
+            fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, 0 )
+        return RenderTarget( framebuffer, width, height, colorFormat, depthFormat, texture, depth )
+    def release( self, target ):
+        """Return target's framebuffer and attachments to the pool"""
+        key = (target.width,target.height)
+        self.textures.setdefault( key + (target.colorFormat,), [] ).append( target.texture )
+        if target.depth is not None:
+            self.renderbuffers.setdefault( key + (target.depthFormat,), [] ).append( target.depth )
+        self.framebuffers.append( target.framebuffer )
+    def reshape( self, width, height ):
+        """Set the (window) size named targets are relative to
+
+        Free objects sized for the previous window are deleted, they are
+        unlikely to be needed again.
+        """
+        if (width,height) != (self.width,self.height):
+            self.trim()
+        self.width, self.height = width, height
+    def target( self, name, scale=1.0, colorFormat=GL.GL_RGBA8, depthFormat=GL.GL_DEPTH_COMPONENT24 ):
+        """Get the persistent target name sized scale * the reshape() size
+
+        The target is re-created (recycling the previous one) when the
+        size or formats no longer match.
+        """
+        width = max( 1, int( self.width * scale + 0.5 ))
+        height = max( 1, int( self.height * scale + 0.5 ))
+        target = self.named.get( name )
+        if target is not None:
+            if (target.width,target.height,target.colorFormat,target.depthFormat) == (
+                width,height,colorFormat,depthFormat
+            ):
+                return target
+            self.release( target )
+        target = self.named[name] = self.acquire( width, height, colorFormat, depthFormat )
+        return target
+    def trim( self ):
+        """Delete the free (pooled but currently unused) objects"""
+        textures = [ t for items in self.textures.values() for t in items ]
+        renderbuffers = [ r for items in self.renderbuffers.values() for r in items ]
+        if textures:
+            GL.glDeleteTextures( textures )
+        if renderbuffers:
+            fbos.glDeleteRenderbuffers( len(renderbuffers), renderbuffers )
+        if self.framebuffers:
+            fbos.glDeleteFramebuffers( len(self.framebuffers), self.framebuffers )
+        self.textures.clear()
+        self.renderbuffers.clear()
+        del self.framebuffers[:]
+    def clear( self ):
+        """Release the named targets and delete everything"""
+        for target in self.named.values():
+            self.release( target )
+        self.named.clear()
+        self.trim()
+
+def getRenderTargetPool( context=None ):
+    """Get the RenderTargetPool for the given (default current) context"""
+    pool = contextdata.getValue( CONTEXT_KEY, context=context )
+    if pool is None:
+        pool = RenderTargetPool()
+        contextdata.setValue( CONTEXT_KEY, pool, context=context )
+    return pool
+
+class PostPass( object ):
+    """A full-screen pass of a PostProcessChain
+
+    program -- GLSL program (e.g. from compileProgram( PASS_VERTEX_SHADER
+        and a fragment shader )), None for a plain bilinear copy
+    uniforms -- {name: float or tuple of floats} set on the program
+        before drawing, 'source' and 'texelSize' are set automatically
+    scale -- size of the pass' output relative to the chain's output,
+        ignored for the last pass, which always draws into the window
+    """
+    def __init__( self, program=None, uniforms=None, scale=1.0, enabled=True ):
+        self.program = program
+        self.uniforms = dict( uniforms or {} )
+        self.scale = scale
+        self.enabled = enabled
+        self.locations = {}
+    def _location( self, name ):
+        location = self.locations.get( name )
+        if location is None:
+            location = self.locations[name] = GL.glGetUniformLocation( self.program, name )
+        return location
+    def apply( self, source ):
+        """Draw source (a RenderTarget) over the current viewport"""
+        GL.glBindTexture( GL.GL_TEXTURE_2D, source.texture )
+        if self.program is not None:
+            GL.glUseProgram( self.program )
+            GL.glUniform1i( self._location( 'source' ), 0 )
+            GL.glUniform2f( self._location( 'texelSize' ), 1.0 / source.width, 1.0 / source.height )
+            for name, value in self.uniforms.items():
+                if isinstance( value, (tuple,list) ):
+                    getattr( GL, 'glUniform%df'%( len(value), ))( self._location( name ), *value )
+                else:
+                    GL.glUniform1f( self._location( name ), value )
+        GL.glBegin( GL.GL_QUADS )
+        GL.glTexCoord2f( 0, 0 ); GL.glVertex2f( -1, -1 )
+        GL.glTexCoord2f( 1, 0 ); GL.glVertex2f( 1, -1 )
+        GL.glTexCoord2f( 1, 1 ); GL.glVertex2f( 1, 1 )
+        GL.glTexCoord2f( 0, 1 ); GL.glVertex2f( -1, 1 )
+        GL.glEnd()
+        if self.program is not None:
+            GL.glUseProgram( 0 )
+
+class PostProcessChain( object ):
+    """Ordered full-screen passes from an offscreen target to the window"""
+    COPY = PostPass()
+    def __init__( self, pool, passes=() ):
+        self.pool = pool
+        self.passes = list( passes )
+    def run( self, source, width, height ):
+        """Run the enabled passes on source, drawing the result into the window
+
+        width, height -- window size, the last pass' viewport
+
+        With no enabled passes source is simply copied (scaled) into the
+        window.  Leaves framebuffer 0 bound with a full-window viewport;
+        the matrices and other state are restored.
+        """
+        passes = [ p for p in self.passes if p.enabled ] or [ self.COPY ]
+        GL.glPushAttrib(
+            GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT | GL.GL_DEPTH_BUFFER_BIT |
+            GL.GL_CURRENT_BIT | GL.GL_TRANSFORM_BIT
+        )
+        GL.glDisable( GL.GL_DEPTH_TEST )
+        GL.glDisable( GL.GL_BLEND )
+        GL.glDisable( GL.GL_LIGHTING )
+        GL.glDisable( GL.GL_CULL_FACE )
+        GL.glEnable( GL.GL_TEXTURE_2D )
+        GL.glDepthMask( GL.GL_FALSE )
+        for mode in (GL.GL_PROJECTION, GL.GL_MODELVIEW):
+            GL.glMatrixMode( mode )
+            GL.glPushMatrix()
+            GL.glLoadIdentity()
+        GL.glColor4f( 1.0, 1.0, 1.0, 1.0 )
+        current = source
+        try:
+            for index, step in enumerate( passes ):
+                if index == len(passes) - 1:
+                    output = None
+                    fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, 0 )
+                    GL.glViewport( 0, 0, width, height )
+                else:
+                    output = self.pool.acquire( width * step.scale, height * step.scale, depthFormat=None )
+                    output.bind()
+                step.apply( current )
+                if current is not source:
+                    self.pool.release( current )
+                current = output
+        finally:
+            for mode in (GL.GL_PROJECTION, GL.GL_MODELVIEW):
+                GL.glMatrixMode( mode )
+                GL.glPopMatrix()
+            GL.glPopAttrib()
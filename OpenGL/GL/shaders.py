@@ -7,10 +7,16 @@ shader rendering.
 
 There are also two utility methods compileProgram and compileShader
 which make it easy to create demos which are shader-using.
+
+Linked programs are cached (see ProgramCache): identical compileProgram
+calls within a context share a single program, and cachedProgram can
+persist program binaries to disk (PYOPENGL_SHADER_CACHE environment
+variable) to avoid compiling from source on later runs.
 """
-import logging
+import logging, os, struct, hashlib, ctypes, weakref
+from collections import namedtuple
 log = logging.getLogger( __name__ )
-from OpenGL import GL
+from OpenGL import GL, contextdata, error
 from OpenGL.GL.ARB import (
     shader_objects, fragment_shader, vertex_shader, vertex_program,
     geometry_shader4, separate_shader_objects, get_program_binary,
@@ -27,6 +33,11 @@ __all__ = [
     'glGetShaderiv',
     'compileProgram',
     'compileShader',
+    'cachedProgram',
+    'deleteProgram',
+    'ProgramCache',
+    'ActiveVariable',
+    'UniformBlock',
     'GL_VALIDATE_STATUS',
     'GL_LINK_STATUS',
     'ShaderCompilationError', 
@@ -86,15 +97,184 @@ GL_LINK_STATUS = GL.GL_LINK_STATUS
 GL_FALSE = GL.GL_FALSE
 GL_TRUE = GL.GL_TRUE
 
+ActiveVariable = namedtuple( 'ActiveVariable', ('name','location','type','size') )
+ActiveVariable.__doc__ = """Active uniform/attribute description from program introspection"""
+BlockMember = namedtuple( 'BlockMember', ('name','type','size','offset','arrayStride','matrixStride') )
+
+# uniform type: (columns, rows, kind), kind is one of 'f','i','ui'; any
+# type not listed here (samplers, images) is set as a single int
+_UNIFORM_TYPES = {
+    GL.GL_FLOAT: (1,1,'f'),
+    GL.GL_FLOAT_VEC2: (1,2,'f'),
+    GL.GL_FLOAT_VEC3: (1,3,'f'),
+    GL.GL_FLOAT_VEC4: (1,4,'f'),
+    GL.GL_INT: (1,1,'i'),
+    GL.GL_INT_VEC2: (1,2,'i'),
+    GL.GL_INT_VEC3: (1,3,'i'),
+    GL.GL_INT_VEC4: (1,4,'i'),
+    GL.GL_BOOL: (1,1,'i'),
+    GL.GL_BOOL_VEC2: (1,2,'i'),
+    GL.GL_BOOL_VEC3: (1,3,'i'),
+    GL.GL_BOOL_VEC4: (1,4,'i'),
+    GL.GL_UNSIGNED_INT: (1,1,'ui'),
+    GL.GL_UNSIGNED_INT_VEC2: (1,2,'ui'),
+    GL.GL_UNSIGNED_INT_VEC3: (1,3,'ui'),
+    GL.GL_UNSIGNED_INT_VEC4: (1,4,'ui'),
+    GL.GL_FLOAT_MAT2: (2,2,'f'),
+    GL.GL_FLOAT_MAT3: (3,3,'f'),
+    GL.GL_FLOAT_MAT4: (4,4,'f'),
+    GL.GL_FLOAT_MAT2x3: (2,3,'f'),
+    GL.GL_FLOAT_MAT2x4: (2,4,'f'),
+    GL.GL_FLOAT_MAT3x2: (3,2,'f'),
+    GL.GL_FLOAT_MAT3x4: (3,4,'f'),
+    GL.GL_FLOAT_MAT4x2: (4,2,'f'),
+    GL.GL_FLOAT_MAT4x3: (4,3,'f'),
+}
+_STRUCT_CODES = {'f':'f','i':'i','ui':'I'}
+
+def _uniformSetter( type ):
+    """Produce (setter, components) for the given uniform type
+
+    setter( location, values ) where values is a flat tuple holding
+    one or more elements' worth of components
+    """
+    columns, rows, kind = _UNIFORM_TYPES.get( type, (1,1,'i') )
+    components = columns * rows
+    if columns > 1:
+        suffix = '%d'%(columns,) if columns == rows else '%dx%d'%(columns,rows)
+        function = getattr( GL, 'glUniformMatrix%sfv'%(suffix,) )
+        def setter( location, values ):
+            function( location, len(values)//components, GL_FALSE, values )
+        return setter, components
+    single = getattr( GL, 'glUniform%d%s'%(rows,kind) )
+    vector = getattr( GL, 'glUniform%d%sv'%(rows,kind) )
+    def setter( location, values ):
+        if len(values) == components:
+            single( location, *values )
+        else:
+            vector( location, len(values)//components, values )
+    return setter, components
+
+def _flattenValues( values ):
+    """Flatten setUniform arguments (scalars, sequences, nested matrices)"""
+    result = []
+    for value in values:
+        if isinstance( value, (int,float,bytes,unicode) ):
+            result.append( value )
+        elif hasattr( value, '__len__' ) or hasattr( value, '__iter__' ):
+            result.extend( _flattenValues( value ) )
+        else:
+            result.append( value )
+    return tuple( result )
+
+class UniformBlock( object ):
+    """Client-side staging buffer for a uniform block
+
+    Member values are packed (using the offsets/strides the driver reports)
+    into a local buffer by set(), and upload() transfers everything which
+    changed since the last upload with a single glBufferSubData call,
+    rather than one glUniform* call per value.
+
+    Usage:
+
+        block = program.uniformBlocks['Lighting']
+        block.bind( 0 )
+        block.set( 'sunDirection', (0,1,0) )
+        block.set( 'sunColor', (1,1,.9,1) )
+        block.upload()
+    """
+    def __init__( self, program, name, index, size, members ):
+        self.program = program
+        self.name = name
+        self.index = index
+        self.size = size
+        self.members = members
+        self.data = ctypes.create_string_buffer( size )
+        self.buffer = None
+        self.dirty = (0, size)
+
+    def set( self, name, *values ):
+        """Pack values for member name into the staging buffer
+
+        returns False if the member is unknown or already has this value
+        """
+        member = self.members.get( name )
+        if member is None:
+            return False
+        columns, rows, kind = _UNIFORM_TYPES.get( member.type, (1,1,'i') )
+        code = '<%d%s'%( rows, _STRUCT_CODES[kind] )
+        values = _flattenValues( values )
+        width = struct.calcsize( code )
+        changed = False
+        low, high = self.size, 0
+        element = 0
+        for start in range( 0, len(values), rows ):
+            column = element % columns
+            item = element // columns
+            offset = member.offset + item*member.arrayStride + column*member.matrixStride
+            packed = struct.pack( code, *values[start:start+rows] )
+            if self.data.raw[offset:offset+width] != packed:
+                ctypes.memmove( ctypes.addressof( self.data ) + offset, packed, width )
+                low, high = min( low, offset ), max( high, offset+width )
+                changed = True
+            element += 1
+        if changed:
+            if self.dirty is None:
+                self.dirty = (low, high)
+            else:
+                self.dirty = (min( low, self.dirty[0] ), max( high, self.dirty[1] ))
+        return changed
+
+    def upload( self ):
+        """Transfer the changed range of the staging buffer to the GL
+
+        returns number of bytes transferred
+        """
+        if self.buffer is None:
+            self.buffer = GL.glGenBuffers( 1 )
+            GL.glBindBuffer( GL.GL_UNIFORM_BUFFER, self.buffer )
+            GL.glBufferData( GL.GL_UNIFORM_BUFFER, self.size, self.data, GL.GL_DYNAMIC_DRAW )
+            self.dirty = None
+            return self.size
+        if self.dirty is None:
+            return 0
+        low, high = self.dirty
+        GL.glBindBuffer( GL.GL_UNIFORM_BUFFER, self.buffer )
+        GL.glBufferSubData(
+            GL.GL_UNIFORM_BUFFER, low, high-low,
+            (ctypes.c_char*(high-low)).from_buffer( self.data, low ),
+        )
+        self.dirty = None
+        return high-low
+
+    def bind( self, binding ):
+        """Bind the block to the given uniform-buffer binding point"""
+        if self.buffer is None:
+            self.upload()
+        GL.glUniformBlockBinding( self.program, self.index, binding )
+        GL.glBindBufferBase( GL.GL_UNIFORM_BUFFER, binding, self.buffer )
+
 class ShaderProgram( int ):
-    """Integer sub-class with context-manager operation"""
+    """Integer sub-class with context-manager operation
+
+    After linking (compileProgram/load) the program's active uniforms,
+    attributes and uniform blocks are introspected once, so that
+    locations can be looked up without a round-trip to the driver and
+    setUniform can skip uploading values which haven't changed.
+    """
     validated = False
+    _uniforms = None
+    _attributes = None
+    _uniformBlocks = None
     def __enter__( self ):
         """Start use of the program"""
         glUseProgram( self )
     def __exit__( self, typ, val, tb ):
         """Stop use of the program"""
         glUseProgram( 0 )
+    def delete( self ):
+        """Delete the program, see deleteProgram"""
+        deleteProgram( self )
     
     def check_validate( self ):
         """Check that the program validates
@@ -128,6 +308,129 @@ class ShaderProgram( int ):
             ))
         return self
 
+    def introspect( self ):
+        """Query the active uniforms, attributes and uniform blocks
+
+        Called automatically after linking/loading, call again if the
+        program is re-linked.
+        """
+        uniforms = {}
+        members = {}
+        count = int( glGetProgramiv( self, GL.GL_ACTIVE_UNIFORMS ) )
+        blockIndices = offsets = arrayStrides = matrixStrides = None
+        if count and bool( GL.glGetActiveUniformsiv ):
+            indices = (GL.GLuint*count)( *range(count) )
+            def uniformsiv( pname ):
+                result = (GL.GLint*count)()
+                GL.glGetActiveUniformsiv( self, count, indices, pname, result )
+                return list(result)
+            blockIndices = uniformsiv( GL.GL_UNIFORM_BLOCK_INDEX )
+            offsets = uniformsiv( GL.GL_UNIFORM_OFFSET )
+            arrayStrides = uniformsiv( GL.GL_UNIFORM_ARRAY_STRIDE )
+            matrixStrides = uniformsiv( GL.GL_UNIFORM_MATRIX_STRIDE )
+        for index in range( count ):
+            name, size, type = GL.glGetActiveUniform( self, index )
+            name = _cleanName( name )
+            if blockIndices is not None and blockIndices[index] >= 0:
+                members.setdefault( blockIndices[index], {} )[name] = BlockMember(
+                    name, int(type), int(size), offsets[index],
+                    arrayStrides[index], matrixStrides[index],
+                )
+                continue
+            location = GL.glGetUniformLocation( self, name )
+            uniforms[name] = ActiveVariable( name, location, int(type), int(size) )
+        attributes = {}
+        for index in range( int( glGetProgramiv( self, GL.GL_ACTIVE_ATTRIBUTES ) ) ):
+            name, size, type = GL.glGetActiveAttrib( self, index )
+            name = _cleanName( name )
+            location = GL.glGetAttribLocation( self, name )
+            attributes[name] = ActiveVariable( name, location, int(type), int(size) )
+        blocks = {}
+        if members:
+            for index in range( int( glGetProgramiv( self, GL.GL_ACTIVE_UNIFORM_BLOCKS ) ) ):
+                length = GL.GLint()
+                GL.glGetActiveUniformBlockiv( self, index, GL.GL_UNIFORM_BLOCK_NAME_LENGTH, length )
+                nameBuffer = ctypes.create_string_buffer( max(length.value,1) )
+                GL.glGetActiveUniformBlockName( self, index, len(nameBuffer), None, nameBuffer )
+                size = GL.GLint()
+                GL.glGetActiveUniformBlockiv( self, index, GL.GL_UNIFORM_BLOCK_DATA_SIZE, size )
+                name = _cleanName( nameBuffer.value )
+                blocks[name] = UniformBlock( self, name, index, size.value, members.get( index, {} ) )
+        self._uniforms = uniforms
+        self._attributes = attributes
+        self._uniformBlocks = blocks
+        self._locations = dict([ (name, info.location) for name, info in uniforms.items() ])
+        self._setters = {}
+        self._values = {}
+        return self
+
+    @property
+    def uniforms( self ):
+        """Mapping of uniform name: ActiveVariable (excluding block members)"""
+        if self._uniforms is None:
+            self.introspect()
+        return self._uniforms
+    @property
+    def attributes( self ):
+        """Mapping of attribute name: ActiveVariable"""
+        if self._attributes is None:
+            self.introspect()
+        return self._attributes
+    @property
+    def uniformBlocks( self ):
+        """Mapping of uniform block name: UniformBlock"""
+        if self._uniformBlocks is None:
+            self.introspect()
+        return self._uniformBlocks
+
+    def uniformLocation( self, name ):
+        """Cached glGetUniformLocation
+
+        Names which are not active uniforms themselves (e.g. 'lights[2]')
+        are queried once and then cached as well.
+        """
+        if self._uniforms is None:
+            self.introspect()
+        try:
+            return self._locations[name]
+        except KeyError as err:
+            location = self._locations[name] = GL.glGetUniformLocation( self, name )
+            return location
+    def attributeLocation( self, name ):
+        """Cached glGetAttribLocation, -1 if not an active attribute"""
+        info = self.attributes.get( name )
+        if info is None:
+            return -1
+        return info.location
+
+    def setUniform( self, name, *values ):
+        """Set uniform name (on this program, which must be in use)
+
+        values -- scalars and/or sequences (including nested matrices),
+            flattened into the components for the uniform's type, which
+            determines the glUniform* entry point used
+
+        Values are remembered per-location so that setting a uniform to
+        the value it already has does not call into the GL.
+
+        returns True if the GL was called
+        """
+        location = self.uniformLocation( name )
+        if location < 0:
+            return False
+        values = _flattenValues( values )
+        if self._values.get( location ) == values:
+            return False
+        setter = self._setters.get( location )
+        if setter is None:
+            info = self._uniforms.get( name ) or self._uniforms.get( name.split('[')[0] )
+            setter = self._setters[location] = _uniformSetter(
+                info.type if info is not None else GL.GL_FLOAT
+            )[0]
+        setter( location, values )
+        self._values[location] = values
+        return True
+
     def retrieve( self ):
         """Attempt to retrieve binary for this compiled shader
         
@@ -155,6 +458,7 @@ class ShaderProgram( int ):
         if validate:
             self.check_validate()
         self.check_linked()
+        self.introspect()
         return self
 
 def compileProgram(*shaders, **named):
@@ -174,6 +478,10 @@ def compileProgram(*shaders, **named):
         function is *not* really intended for advanced usage,
         if you're finding yourself specifying this flag you 
         likely should be using your own shader management code.
+    cache (keyword only) -- ProgramCache used to share programs 
+        between identical calls (shaders created by compileShader 
+        from the same sources), default is the module-level 
+        PROGRAM_CACHE, pass False to always link a new program
 
     This convenience function is *not* standard OpenGL,
     but it does wind up being fairly useful for demos
@@ -191,17 +499,38 @@ def compileProgram(*shaders, **named):
     Note:
         If (and only if) validation of the linked program
         *passes* then the passed-in shader objects will be
-        deleted from the GL.
+        deleted from the GL.  This is also the case when an 
+        already-linked program is returned from the cache.
+
+        Cached programs are shared, delete them with deleteProgram
+        (or ShaderProgram.delete) rather than glDeleteProgram so
+        that the next identical call links a new one instead of
+        returning the dead ID (which the driver may since have
+        reused for an unrelated program).
 
     returns ShaderProgram() (GLuint) program reference
     raises RuntimeError subclasses {
         ShaderCompilationError, ShaderValidationError, ShaderLinkError,
     } when a link/validation failure occurs
     """
+    cache = named.get('cache', True)
+    if cache is True:
+        cache = PROGRAM_CACHE
+    key = None
+    if cache:
+        key = cache.programKey( shaders, named )
+    if key is not None:
+        program = cache.lookup( key ) or cache.load( key, named )
+        if program is not None:
+            cache.store( key, program )
+            for shader in shaders:
+                glDeleteShader(shader)
+            _forgetShaders( shaders )
+            return program
     program = glCreateProgram()
     if named.get('separable'):
         glProgramParameteri( program, separate_shader_objects.GL_PROGRAM_SEPARABLE, GL_TRUE )
-    if named.get('retrievable'):
+    if named.get('retrievable') or (key is not None and cache.persistent()):
         glProgramParameteri( program, get_program_binary.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE )
     for shader in shaders:
         glAttachShader(program, shader)
@@ -210,8 +539,13 @@ def compileProgram(*shaders, **named):
     if named.get('validate', True):
         program.check_validate()
     program.check_linked()
+    program.introspect()
     for shader in shaders:
         glDeleteShader(shader)
+    _forgetShaders( shaders )
+    if key is not None:
+        cache.store( key, program )
+        cache.save( key, program )
     return program
 def compileShader( source, shaderType ):
     """Compile shader source of given type
@@ -240,8 +574,260 @@ def compileShader( source, shaderType ):
             source,
             shaderType,
         )
+    _shaderDigests()[ int(shader) ] = _digest( shaderType, source )
     return shader
 
+SHADER_DIGESTS_KEY = 'OpenGL.GL.shaders.digests'
+
+def _cleanName( name ):
+    """Convert reported variable name to text, dropping array suffix"""
+    if not isinstance( name, (bytes,unicode) ):
+        # raw output array (e.g. ctypes array when numpy is not available)
+        name = memoryview( name ).tobytes()
+    if isinstance( name, bytes ):
+        name = name.decode( 'latin-1' )
+    name = name.split( '\0' )[0]
+    if name.endswith( '[0]' ):
+        name = name[:-3]
+    return name
+
+def _digest( shaderType, source ):
+    """Produce hex digest identifying a shader stage and its source strings"""
+    digest = hashlib.sha256( as_8_bit( '%d:'%(int(shaderType),) ) )
+    for segment in source:
+        digest.update( as_8_bit( '%d:'%(len(segment),) ) )
+        digest.update( segment )
+    return digest.hexdigest()
+
+def _shaderDigests():
+    """Per-context mapping from shader ID to source digest (from compileShader)"""
+    digests = contextdata.getValue( SHADER_DIGESTS_KEY )
+    if digests is None:
+        digests = {}
+        contextdata.setValue( SHADER_DIGESTS_KEY, digests )
+    return digests
+
+def _forgetShaders( shaders ):
+    """Drop digests for deleted shaders"""
+    digests = _shaderDigests()
+    for shader in shaders:
+        digests.pop( int(shader), None )
+
+class ProgramCache( object ):
+    """Cache of linked shader programs
+
+    Programs are keyed by a hash of the driver (vendor, renderer and
+    version strings), the program flags, and the stage type and source
+    of each attached shader.
+
+    In-process, a per-context mapping from key to program lets identical
+    requests share a single program.  If directory is set, program
+    binaries (glGetProgramBinary) are also written there and reloaded
+    with glProgramBinary on later runs, falling back to compiling from
+    source if the driver rejects the stored binary (e.g. after a driver
+    update which didn't change the version string).
+    """
+    MAGIC = as_8_bit( 'PyOpenGL-program-binary-1\n' )
+    def __init__( self, directory=None ):
+        self.directory = directory
+        self.contextKey = ('OpenGL.GL.shaders.ProgramCache', id(self))
+        _CACHES.add( self )
+
+    def _state( self ):
+        """Per-context state (programs by key, driver string, binary support)"""
+        state = contextdata.getValue( self.contextKey )
+        if state is None:
+            state = {'programs': {}}
+            contextdata.setValue( self.contextKey, state )
+        return state
+
+    def driver( self ):
+        """String identifying the current context's driver"""
+        state = self._state()
+        if 'driver' not in state:
+            state['driver'] = as_8_bit( '' ).join([
+                (GL.glGetString( constant ) or as_8_bit( '' )) + as_8_bit( '\n' )
+                for constant in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)
+            ])
+        return state['driver']
+
+    def persistent( self ):
+        """Whether binaries can be saved/loaded for the current context"""
+        if not self.directory:
+            return False
+        state = self._state()
+        if 'binaries' not in state:
+            try:
+                formats = GL.glGetIntegerv( get_program_binary.GL_NUM_PROGRAM_BINARY_FORMATS )
+                state['binaries'] = bool( int(formats) ) and bool( get_program_binary.glGetProgramBinary )
+            except (error.GLError, error.NullFunctionError, TypeError, ValueError) as err:
+                state['binaries'] = False
+        return state['binaries']
+
+    def key( self, digests, named ):
+        """Calculate the cache key for sequence of stage digests and flags"""
+        digest = hashlib.sha256( self.driver() )
+        digest.update( as_8_bit( 'separable=%d retrievable=%d validate=%d\n'%(
+            bool(named.get('separable')),
+            bool(named.get('retrievable')),
+            bool(named.get('validate', True)),
+        ) ) )
+        for stage in digests:
+            digest.update( as_8_bit( stage+'\n' ) )
+        return digest.hexdigest()
+
+    def programKey( self, shaders, named ):
+        """Calculate cache key for shaders created by compileShader
+
+        returns None if any of the shaders wasn't created by compileShader
+        (so its source isn't known)
+        """
+        digests = _shaderDigests()
+        try:
+            stages = [ digests[int(shader)] for shader in shaders ]
+        except (KeyError, TypeError, ValueError) as err:
+            return None
+        return self.key( stages, named )
+
+    def lookup( self, key ):
+        """Find the in-process program for key (or None)
+
+        Programs deleted through deleteProgram are forgotten when they
+        are deleted; the glIsProgram check only catches programs
+        deleted directly whose ID hasn't been reused yet.
+        """
+        programs = self._state()['programs']
+        program = programs.get( key )
+        if program is not None and not GL.glIsProgram( program ):
+            del programs[key]
+            program = None
+        return program
+
+    def forget( self, program ):
+        """Drop program from the current context's in-process cache (it is being deleted)"""
+        programs = self._state()['programs']
+        for key, cached in list( programs.items() ):
+            if int(cached) == int(program):
+                del programs[key]
+
+    def store( self, key, program ):
+        """Register program as the in-process program for key"""
+        self._state()['programs'][key] = program
+        return program
+
+    def filename( self, key ):
+        return os.path.join( self.directory, key + '.bin' )
+
+    def load( self, key, named=None ):
+        """Load program for key from the on-disk binary cache (or None)
+
+        If the driver rejects the binary the file is removed so that the
+        freshly-compiled program's binary replaces it.
+        """
+        if not self.persistent():
+            return None
+        filename = self.filename( key )
+        try:
+            with open( filename, 'rb' ) as handle:
+                data = handle.read()
+        except (IOError, OSError) as err:
+            return None
+        header = len(self.MAGIC) + 4
+        if not data.startswith( self.MAGIC ) or len(data) <= header:
+            self.discard( key )
+            return None
+        format, = struct.unpack( '<I', data[len(self.MAGIC):header] )
+        program = ShaderProgram( glCreateProgram() )
+        try:
+            program.load( format, data[header:], validate=(named or {}).get('validate', True) )
+        except (error.GLError, ShaderLinkError, ShaderValidationError) as err:
+            log.info( 'Driver rejected cached program binary %s: %s', filename, err )
+            GL.glDeleteProgram( program )
+            self.discard( key )
+            return None
+        return program
+
+    def save( self, key, program ):
+        """Write program's binary to the on-disk cache (if enabled)"""
+        if not self.persistent():
+            return False
+        try:
+            format, binary = program.retrieve()
+            if not len(binary):
+                return False
+            if not os.path.isdir( self.directory ):
+                os.makedirs( self.directory )
+            filename = self.filename( key )
+            temporary = '%s.%d.tmp'%( filename, os.getpid() )
+            with open( temporary, 'wb' ) as handle:
+                handle.write( self.MAGIC )
+                handle.write( struct.pack( '<I', format ) )
+                handle.write( memoryview( binary ).tobytes() )
+            getattr( os, 'replace', os.rename )( temporary, filename )
+        except (error.GLError, IOError, OSError) as err:
+            log.warning( 'Unable to save program binary for %s: %s', key, err )
+            return False
+        return True
+
+    def discard( self, key ):
+        """Remove the on-disk binary for key (if present)"""
+        try:
+            os.remove( self.filename( key ) )
+        except (IOError, OSError) as err:
+            pass
+
+    def program( self, *stages, **named ):
+        """Get a program for the given (source, shaderType) stages
+
+        Checks the in-process cache, then the on-disk cache, and only
+        then compiles from source, so a warm cache avoids compiling
+        entirely.  named are passed to compileProgram.
+        """
+        digests = []
+        for source, shaderType in stages:
+            if isinstance( source, (bytes,unicode)):
+                source = [ source ]
+            digests.append( _digest( shaderType, [ as_8_bit(s) for s in source ] ) )
+        key = self.key( digests, named )
+        program = self.lookup( key ) or self.load( key, named )
+        if program is not None:
+            return self.store( key, program )
+        named = dict( named )
+        named['cache'] = self
+        return compileProgram(
+            *[ compileShader( source, shaderType ) for source, shaderType in stages ],
+            **named
+        )
+
+_CACHES = weakref.WeakSet()
+PROGRAM_CACHE = ProgramCache( os.environ.get( 'PYOPENGL_SHADER_CACHE' ) )
+
+def deleteProgram( program ):
+    """glDeleteProgram( program ), dropping it from every ProgramCache
+
+    Use this for programs from compileProgram/cachedProgram, a cache
+    can't tell a deleted program from a new one which the driver
+    gave the same ID.
+    """
+    for cache in list( _CACHES ):
+        cache.forget( program )
+    GL.glDeleteProgram( program )
+
+def cachedProgram( *stages, **named ):
+    """Get a (possibly cached) program for (source, shaderType) stages
+
+    Uses PROGRAM_CACHE unless cache is passed, see ProgramCache.program
+
+    Usage:
+
+        shader = cachedProgram(
+            (vertexSource, GL_VERTEX_SHADER),
+            (fragmentSource, GL_FRAGMENT_SHADER),
+        )
+    """
+    cache = named.pop( 'cache', None ) or PROGRAM_CACHE
+    return cache.program( *stages, **named )
+
 class ShaderCompilationError(RuntimeError):
     """Raised when a shader compilation fails"""
 class ShaderValidationError(RuntimeError):
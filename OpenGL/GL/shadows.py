@@ -0,0 +1,391 @@
+"""Cascaded sun shadow maps with cached static depth
+
+A directional light (the sun) casts shadows into a set of cascades:
+square orthographic depth maps centred on the viewer, each covering a
+larger area at a lower texel density.  Re-rendering everything into
+every cascade each frame would cost as much as drawing the scene again,
+so each cascade keeps the depth of the static world in its own texture:
+
+    shadows = CascadedShadowMap( sunDirection, extents=(50.0, 200.0) )
+    ...
+    shadows.update( eye, drawStatic, drawDynamic )  # before the scene
+    camera.look()
+    shadows.prepare( glGetFloatv( GL_MODELVIEW_MATRIX ))
+    ... draw lit geometry with shadows.program ...
+
+update() re-renders a cascade's static depth (drawStatic( cascade ))
+only when the cascade has to move.  Cascade centres are snapped to a
+grid of snapTexels texels in light space, so small camera movements
+(and all camera rotations) leave the cached depth valid, and the map
+does not shimmer when it does move.  Every frame the cached depth is
+copied (glBlitFramebuffer) into the cascade's frame map and only the
+dynamic casters (drawDynamic( cascade )) are drawn on top of it.
+Without framebuffer blits the static casters are simply re-drawn every
+frame.  Call invalidate() when the static world changes, passing the
+bounding box of what changed to re-render only the cascades it casts
+into.
+
+Both callbacks are called with the cascade's light matrices loaded and
+colour writes disabled; cascade.overlaps( box ) tells whether an
+axis-aligned box (minX, minY, minZ, maxX, maxY, maxZ) can cast into
+the cascade, so callers can skip everything else.
+
+program is a GLSL 1.20 program for the lit geometry: per-fragment
+diffuse sun light with an ambient term, the sun's contribution masked
+by the first cascade containing the fragment.  Colours come from
+gl_Color modulated by texture unit 0 (prepare() binds a white texture
+there, so untextured geometry is unaffected while textured display
+lists can bind their own) and fragments with alpha below 0.5 are
+discarded, matching alpha-tested impostors.  The cascades' depth
+textures are bound to the units following unit 0.
+"""
+import math
+from OpenGL import GL
+from OpenGL.GL import framebufferobjects as fbos
+from OpenGL.GL.shaders import compileProgram, compileShader, deleteProgram
+
+__all__ = (
+    'ShadowCascade',
+    'CascadedShadowMap',
+    'LIGHTING_VERTEX_SHADER',
+    'LIGHTING_FRAGMENT_SHADER',
+)
+
+LIGHTING_VERTEX_SHADER = '''#version 120
+#define CASCADES %(cascades)d
+uniform mat4 eyeToShadow[CASCADES];
+varying vec3 normal;
+varying vec4 shadowCoords[CASCADES];
+void main() {
+    vec4 eye = gl_ModelViewMatrix * gl_Vertex;
+    normal = gl_NormalMatrix * gl_Normal;
+    for (int i = 0; i < CASCADES; i++) {
+        shadowCoords[i] = eyeToShadow[i] * eye;
+    }
+    gl_FrontColor = gl_Color;
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+    gl_Position = gl_ProjectionMatrix * eye;
+}
+'''
+LIGHTING_FRAGMENT_SHADER = '''#version 120
+#define CASCADES %(cascades)d
+uniform sampler2D base;
+uniform sampler2DShadow shadowMaps[CASCADES];
+uniform vec3 lightDirection;
+uniform float ambient;
+varying vec3 normal;
+varying vec4 shadowCoords[CASCADES];
+void main() {
+    vec4 color = gl_Color * texture2D( base, gl_TexCoord[0].st );
+    if (color.a < 0.5) discard;
+    vec3 n = normalize( gl_FrontFacing ? normal : -normal );
+    float lit = 1.0;
+    for (int i = 0; i < CASCADES; i++) {
+        vec3 coord = shadowCoords[i].xyz / shadowCoords[i].w;
+        if (all( greaterThan( coord, vec3( 0.0 ))) && all( lessThan( coord, vec3( 1.0 )))) {
+            lit = shadow2D( shadowMaps[i], coord ).r;
+            break;
+        }
+    }
+    float diffuse = max( dot( n, lightDirection ), 0.0 ) * lit;
+    gl_FragColor = vec4( color.rgb * (ambient + (1.0 - ambient) * diffuse), color.a );
+}
+'''
+
+# maps clip space [-1,1] to texture/depth space [0,1]
+BIAS = (
+    (0.5, 0.0, 0.0, 0.5),
+    (0.0, 0.5, 0.0, 0.5),
+    (0.0, 0.0, 0.5, 0.5),
+    (0.0, 0.0, 0.0, 1.0),
+)
+
+def _dot( a, b ):
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+def _cross( a, b ):
+    return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+def _normalize( a ):
+    length = math.sqrt( _dot( a, a ))
+    return (a[0]/length, a[1]/length, a[2]/length)
+def _multiply( a, b ):
+    """Product of two row-major 4x4 matrices"""
+    return tuple(
+        tuple( sum( a[row][k] * b[k][column] for k in range( 4 )) for column in range( 4 ))
+        for row in range( 4 )
+    )
+def _rigidInverse( modelview ):
+    """Row-major inverse of a rotation+translation matrix given as glGetFloatv returns it"""
+    rotation = [[modelview[column][row] for column in range( 3 )] for row in range( 3 )]
+    translation = [modelview[3][row] for row in range( 3 )]
+    inverse = []
+    for row in range( 3 ):
+        axis = [rotation[k][row] for k in range( 3 )]
+        inverse.append( tuple( axis ) + (-_dot( axis, translation ),) )
+    inverse.append( (0.0, 0.0, 0.0, 1.0) )
+    return tuple( inverse )
+def _flatten( matrix ):
+    return [value for row in matrix for value in row]
+
+class ShadowCascade( object ):
+    """One orthographic depth map of a CascadedShadowMap
+
+    extent -- width (and height) in world units of the covered square
+    center -- snapped light-space (right, up, depth) grid coordinates of
+        the current placement, None before the first update
+    view, projection -- row-major light matrices for the placement
+    static, frame -- (framebuffer, depth texture) pairs, the cached
+        static depth and the per-frame depth including dynamic casters
+    """
+    def __init__( self, extent, resolution ):
+        self.extent = extent
+        self.resolution = resolution
+        self.center = None
+        self.view = self.projection = None
+        self.axes = None
+        self.origin = None
+        self.static = self._depthTarget()
+        self.frame = self._depthTarget()
+    def _depthTarget( self ):
+        texture = GL.glGenTextures( 1 )
+        GL.glBindTexture( GL.GL_TEXTURE_2D, texture )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_COMPARE_MODE, GL.GL_COMPARE_R_TO_TEXTURE )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_COMPARE_FUNC, GL.GL_LEQUAL )
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D, 0, GL.GL_DEPTH_COMPONENT24, self.resolution, self.resolution, 0,
+            GL.GL_DEPTH_COMPONENT, GL.GL_UNSIGNED_INT, None,
+        )
+        GL.glBindTexture( GL.GL_TEXTURE_2D, 0 )
+        framebuffer = fbos.glGenFramebuffers( 1 )
+        fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, framebuffer )
+        fbos.glFramebufferTexture2D(
+            fbos.GL_FRAMEBUFFER, fbos.GL_DEPTH_ATTACHMENT, GL.GL_TEXTURE_2D, texture, 0,
+        )
+        GL.glDrawBuffer( GL.GL_NONE )
+        GL.glReadBuffer( GL.GL_NONE )
+        try:
+            fbos.checkFramebufferStatus()
+        finally:
+            fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, 0 )
+        return framebuffer, texture
+    @property
+    def texelSize( self ):
+        return self.extent / float( self.resolution )
+    def place( self, eye, axes, snap, depthStep, depthRange ):
+        """Move over eye (snapped to the grid), returns whether the placement changed"""
+        right, up, forward = axes
+        step = self.texelSize * snap
+        center = (
+            int( math.floor( _dot( eye, right ) / step + 0.5 )),
+            int( math.floor( _dot( eye, up ) / step + 0.5 )),
+            int( math.floor( _dot( eye, forward ) / depthStep + 0.5 )),
+        )
+        if center == self.center and axes == self.axes:
+            return False
+        self.center, self.axes = center, axes
+        x, y, z = center[0] * step, center[1] * step, center[2] * depthStep
+        # light "eye" sits depthRange before the snapped centre, looking along forward
+        self.origin = tuple(
+            right[i] * x + up[i] * y + forward[i] * (z - depthRange) for i in range( 3 )
+        )
+        back = tuple( -f for f in forward )
+        self.view = tuple(
+            tuple( axis ) + (-_dot( axis, self.origin ),) for axis in (right, up, back)
+        ) + ((0.0, 0.0, 0.0, 1.0),)
+        half, far = self.extent / 2.0, 2.0 * depthRange
+        self.projection = (
+            (1.0 / half, 0.0, 0.0, 0.0),
+            (0.0, 1.0 / half, 0.0, 0.0),
+            (0.0, 0.0, -2.0 / far, -1.0),
+            (0.0, 0.0, 0.0, 1.0),
+        )
+        return True
+    def overlaps( self, box ):
+        """Whether the world-space box can cast a shadow into this cascade"""
+        if self.view is None:
+            return False
+        half = self.extent / 2.0
+        low, high = box[:3], box[3:]
+        for row in self.view[:2]:
+            # light-space range of the box along this axis
+            lowest = highest = row[3]
+            for axis in range( 3 ):
+                a, b = row[axis] * low[axis], row[axis] * high[axis]
+                lowest += min( a, b )
+                highest += max( a, b )
+            if highest < -half or lowest > half:
+                return False
+        return True
+    def invalidate( self ):
+        """Forget the cached static depth, the next update re-renders it"""
+        self.center = None
+    def delete( self ):
+        for framebuffer, texture in (self.static, self.frame):
+            fbos.glDeleteFramebuffers( 1, [framebuffer] )
+            GL.glDeleteTextures( [texture] )
+
+class CascadedShadowMap( object ):
+    """Sun shadows in camera-centred cascades with cached static depth
+
+    lightDirection -- direction towards the sun (need not be normalized)
+    extents -- covered square size per cascade, finest first
+    snapTexels -- cascades move in steps of this many of their texels
+    depthRange -- casters and receivers must lie within this distance of
+        the cascade centre along the light direction
+    ambient -- light received by surfaces the sun doesn't reach
+    polygonOffset -- (factor, units) applied while rendering depth
+
+    stats counts static re-renders ('static') and dynamic passes
+    ('dynamic') since creation.
+    """
+    def __init__(
+        self, lightDirection, extents=(50.0, 200.0), resolution=1024, snapTexels=16,
+        depthRange=150.0, ambient=0.55, polygonOffset=(2.0, 4.0),
+    ):
+        self.resolution = resolution
+        self.snapTexels = snapTexels
+        self.depthRange = depthRange
+        self.ambient = ambient
+        self.polygonOffset = polygonOffset
+        self.canBlit = bool( fbos.glBlitFramebuffer )
+        self.cascades = [ShadowCascade( extent, resolution ) for extent in extents]
+        self.setLightDirection( lightDirection )
+        self.program = self._compileProgram()
+        self.locations = {}
+        self.white = self._whiteTexture()
+        self.stats = {'static': 0, 'dynamic': 0}
+    def setLightDirection( self, lightDirection ):
+        """Point the light somewhere else (re-renders every cascade)"""
+        self.lightDirection = _normalize( lightDirection )
+        forward = tuple( -d for d in self.lightDirection )
+        reference = (0.0, 0.0, 1.0) if abs( forward[1] ) > 0.99 else (0.0, 1.0, 0.0)
+        right = _normalize( _cross( forward, reference ))
+        up = _cross( right, forward )
+        self.axes = (right, up, forward)
+        self.invalidate()
+    def invalidate( self, box=None ):
+        """Forget the cached static depth, e.g. after the static world changed
+
+        box -- world-space box (minX, minY, minZ, maxX, maxY, maxZ) of the
+            change, only the cascades it overlaps are re-rendered; all
+            of them if None
+        """
+        for cascade in self.cascades:
+            if box is None or cascade.overlaps( box ):
+                cascade.invalidate()
+    def _compileProgram( self ):
+        values = {'cascades': len(self.cascades)}
+        return compileProgram(
+            compileShader( LIGHTING_VERTEX_SHADER % values, GL.GL_VERTEX_SHADER ),
+            compileShader( LIGHTING_FRAGMENT_SHADER % values, GL.GL_FRAGMENT_SHADER ),
+            validate=False,
+        )
+    def _whiteTexture( self ):
+        texture = GL.glGenTextures( 1 )
+        GL.glBindTexture( GL.GL_TEXTURE_2D, texture )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST )
+        GL.glTexParameteri( GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST )
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, 1, 1, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, b'\xff\xff\xff\xff',
+        )
+        GL.glBindTexture( GL.GL_TEXTURE_2D, 0 )
+        return texture
+    def _location( self, name ):
+        location = self.locations.get( name )
+        if location is None:
+            location = self.locations[name] = GL.glGetUniformLocation( self.program, name )
+        return location
+    def _render( self, cascade, target, draw, clear ):
+        fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, target[0] )
+        GL.glViewport( 0, 0, cascade.resolution, cascade.resolution )
+        if clear:
+            GL.glClear( GL.GL_DEPTH_BUFFER_BIT )
+        GL.glMatrixMode( GL.GL_PROJECTION )
+        GL.glLoadTransposeMatrixf( _flatten( cascade.projection ))
+        GL.glMatrixMode( GL.GL_MODELVIEW )
+        GL.glLoadTransposeMatrixf( _flatten( cascade.view ))
+        draw( cascade )
+    def update( self, eye, drawStatic, drawDynamic ):
+        """Refresh the cascades around eye (call outside of any offscreen target)
+
+        Leaves framebuffer 0 bound; viewport, matrices and other state are
+        restored.
+        """
+        GL.glPushAttrib(
+            GL.GL_VIEWPORT_BIT | GL.GL_ENABLE_BIT | GL.GL_COLOR_BUFFER_BIT |
+            GL.GL_DEPTH_BUFFER_BIT | GL.GL_POLYGON_BIT | GL.GL_TRANSFORM_BIT
+        )
+        for mode in (GL.GL_PROJECTION, GL.GL_MODELVIEW):
+            GL.glMatrixMode( mode )
+            GL.glPushMatrix()
+        GL.glColorMask( GL.GL_FALSE, GL.GL_FALSE, GL.GL_FALSE, GL.GL_FALSE )
+        GL.glDepthMask( GL.GL_TRUE )
+        GL.glEnable( GL.GL_DEPTH_TEST )
+        GL.glDisable( GL.GL_LIGHTING )
+        GL.glDisable( GL.GL_BLEND )
+        GL.glEnable( GL.GL_POLYGON_OFFSET_FILL )
+        GL.glPolygonOffset( *self.polygonOffset )
+        depthStep = self.depthRange / 4.0
+        try:
+            for cascade in self.cascades:
+                moved = cascade.place( eye, self.axes, self.snapTexels, depthStep, self.depthRange )
+                if not self.canBlit:
+                    self._render( cascade, cascade.frame, drawStatic, True )
+                    self.stats['static'] += 1
+                else:
+                    size = cascade.resolution
+                    if moved:
+                        self._render( cascade, cascade.static, drawStatic, True )
+                        self.stats['static'] += 1
+                    fbos.glBindFramebuffer( fbos.GL_READ_FRAMEBUFFER, cascade.static[0] )
+                    fbos.glBindFramebuffer( fbos.GL_DRAW_FRAMEBUFFER, cascade.frame[0] )
+                    fbos.glBlitFramebuffer(
+                        0, 0, size, size, 0, 0, size, size, GL.GL_DEPTH_BUFFER_BIT, GL.GL_NEAREST,
+                    )
+                self._render( cascade, cascade.frame, drawDynamic, False )
+                self.stats['dynamic'] += 1
+        finally:
+            fbos.glBindFramebuffer( fbos.GL_FRAMEBUFFER, 0 )
+            for mode in (GL.GL_PROJECTION, GL.GL_MODELVIEW):
+                GL.glMatrixMode( mode )
+                GL.glPopMatrix()
+            GL.glPopAttrib()
+    def prepare( self, modelview ):
+        """Set the program's uniforms and bind the shadow maps for this frame
+
+        modelview -- the camera's view matrix as returned by glGetFloatv
+            (rotation and translation only), i.e. read right after the
+            camera was set up and before any model transforms
+        """
+        eyeToWorld = _rigidInverse( modelview )
+        matrices = []
+        for cascade in self.cascades:
+            matrices.extend( _flatten( _multiply(
+                _multiply( BIAS, cascade.projection ), _multiply( cascade.view, eyeToWorld ),
+            )))
+        rotation = [[modelview[column][row] for column in range( 3 )] for row in range( 3 )]
+        lightDirection = [_dot( rotation[row], self.lightDirection ) for row in range( 3 )]
+        GL.glUseProgram( self.program )
+        GL.glUniformMatrix4fv( self._location( 'eyeToShadow' ), len(self.cascades), GL.GL_TRUE, matrices )
+        GL.glUniform3f( self._location( 'lightDirection' ), *lightDirection )
+        GL.glUniform1f( self._location( 'ambient' ), self.ambient )
+        GL.glUniform1i( self._location( 'base' ), 0 )
+        GL.glUniform1iv(
+            self._location( 'shadowMaps' ), len(self.cascades),
+            [index + 1 for index in range( len(self.cascades) )],
+        )
+        GL.glUseProgram( 0 )
+        for index, cascade in enumerate( self.cascades ):
+            GL.glActiveTexture( GL.GL_TEXTURE1 + index )
+            GL.glBindTexture( GL.GL_TEXTURE_2D, cascade.frame[1] )
+        GL.glActiveTexture( GL.GL_TEXTURE0 )
+        GL.glBindTexture( GL.GL_TEXTURE_2D, self.white )
+    def delete( self ):
+        for cascade in self.cascades:
+            cascade.delete()
+        del self.cascades[:]
+        GL.glDeleteTextures( [self.white] )
+        deleteProgram( self.program )
@@ -0,0 +1,212 @@
+"""Per-context shadow of GL state that elides redundant state changes
+
+Each GL entry-point call goes through the full wrapper machinery even
+when the call does not change anything (e.g. glEnable( GL_BLEND ) when
+blending is already enabled).  StateCache remembers the values most
+recently set through it and skips calls which would not change them.
+
+The cache is stored per-context using OpenGL.contextdata, use
+getStateCache() to retrieve the one for the current context:
+
+    state = getStateCache()
+    state.enable( GL_BLEND )
+    state.blendFunc( GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA )
+    state.color( 1.0, 0.5, 0.0, alpha )
+    ...
+    stats = state.endFrame() # {'calls': ..., 'elided': ...}
+
+Note: the cache only knows about changes made through it.  Any state
+changed behind its back (direct GL calls, display lists which set
+colours, etc.) must be reported with invalidate(), e.g.
+invalidate( 'color' ) after calling a display list which sets colours,
+or invalidate() to forget everything.  Save and restore attribute
+groups with pushAttrib()/popAttrib() (and pushClientAttrib()/
+popClientAttrib()) rather than glPushAttrib/glPopAttrib, so that the
+cache is restored along with the GL state:
+
+    state.pushAttrib( GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT )
+    state.disable( GL_DEPTH_TEST )
+    ...
+    state.popAttrib() # cache again matches the restored state
+
+Setting tracking = False turns the cache into a simple pass-through
+(calls are still counted), which makes it easy to compare behaviour
+and cost with and without elision.
+"""
+from OpenGL import GL, contextdata
+
+__all__ = (
+    'StateCache',
+    'getStateCache',
+)
+
+CONTEXT_KEY = 'OpenGL.GL.statecache'
+
+# Cache keys (or kinds of tuple keys) saved by each attribute group
+ATTRIB_KEYS = (
+    (GL.GL_ENABLE_BIT, ('enable',)),
+    (GL.GL_COLOR_BUFFER_BIT, ('blendFunc', ('enable',GL.GL_BLEND))),
+    (GL.GL_DEPTH_BUFFER_BIT, ('depthMask', ('enable',GL.GL_DEPTH_TEST))),
+    (GL.GL_LIGHTING_BIT, (('enable',GL.GL_LIGHTING), ('enable',GL.GL_COLOR_MATERIAL))),
+    (GL.GL_CURRENT_BIT, ('color',)),
+    (GL.GL_TRANSFORM_BIT, ('matrixMode',)),
+    (GL.GL_TEXTURE_BIT, ('activeTexture', 'texture')),
+)
+CLIENT_ATTRIB_KEYS = (
+    (GL.GL_CLIENT_VERTEX_ARRAY_BIT, (('buffer',GL.GL_ARRAY_BUFFER),)),
+)
+
+def _saved( mask, groups ):
+    """Cache keys and key kinds covered by the attribute bits in mask"""
+    covered = []
+    for bit, keys in groups:
+        if mask & bit:
+            covered.extend( keys )
+    return covered
+
+def _covers( key, covered ):
+    return key in covered or (isinstance( key, tuple ) and key[0] in covered)
+
+class StateCache( object ):
+    """Client-side record of current GL state for a single context
+
+    Keys in the current mapping are:
+
+        ('enable',cap) -- enable bit for cap
+        'blendFunc' -- (sfactor,dfactor)
+        'depthMask' -- boolean depth-mask
+        'color' -- (r,g,b,a) current colour
+        'matrixMode' -- current matrix mode
+        ('buffer',target) -- buffer bound to target
+        'program' -- current program
+        'activeTexture' -- active texture unit
+        ('texture',unit,target) -- texture bound to target on unit
+
+    invalidate() accepts either the key itself or, for the tuple keys,
+    their first element to forget all of that kind.
+    """
+    def __init__( self, tracking=True ):
+        self.tracking = tracking
+        self.current = {}
+        self.calls = 0
+        self.elided = 0
+        self.lastFrame = {'calls': 0, 'elided': 0}
+        self.attribStack = []
+        self.clientAttribStack = []
+
+    def _set( self, key, value, function, *args ):
+        """Call function(*args) unless key is already known to be value"""
+        self.calls += 1
+        current = self.current
+        if self.tracking and key in current and current[key] == value:
+            self.elided += 1
+            return False
+        function( *args )
+        current[key] = value
+        return True
+
+    def invalidate( self, *keys ):
+        """Forget cached values so the next set always reaches the GL
+
+        keys -- keys to forget (see class docstring), if none are
+            passed then all cached state is forgotten
+        """
+        if not keys:
+            self.current.clear()
+            return
+        for key in list(self.current):
+            if key in keys or (isinstance( key, tuple ) and key[0] in keys):
+                del self.current[key]
+
+    def _push( self, push, mask, groups, stack ):
+        push( mask )
+        stack.append( (_saved( mask, groups ), dict(self.current)) )
+    def _pop( self, pop, stack ):
+        pop()
+        covered, saved = stack.pop()
+        current = self.current
+        for key in set(current) | set(saved):
+            if _covers( key, covered ):
+                if key in saved:
+                    current[key] = saved[key]
+                else:
+                    current.pop( key, None )
+    def pushAttrib( self, mask ):
+        """glPushAttrib( mask ), remembering the cached values of those groups"""
+        self._push( GL.glPushAttrib, mask, ATTRIB_KEYS, self.attribStack )
+    def popAttrib( self ):
+        """glPopAttrib(), restoring the cached values saved by the matching pushAttrib()"""
+        self._pop( GL.glPopAttrib, self.attribStack )
+    def pushClientAttrib( self, mask ):
+        """glPushClientAttrib( mask ), remembering the cached values of those groups"""
+        self._push( GL.glPushClientAttrib, mask, CLIENT_ATTRIB_KEYS, self.clientAttribStack )
+    def popClientAttrib( self ):
+        """glPopClientAttrib(), restoring the cached values saved by the matching pushClientAttrib()"""
+        self._pop( GL.glPopClientAttrib, self.clientAttribStack )
+
+    def enable( self, cap ):
+        """glEnable( cap ) unless already enabled"""
+        return self._set( ('enable',cap), True, GL.glEnable, cap )
+    def disable( self, cap ):
+        """glDisable( cap ) unless already disabled"""
+        return self._set( ('enable',cap), False, GL.glDisable, cap )
+    def blendFunc( self, sfactor, dfactor ):
+        """glBlendFunc( sfactor, dfactor ) unless already current"""
+        return self._set( 'blendFunc', (sfactor,dfactor), GL.glBlendFunc, sfactor, dfactor )
+    def depthMask( self, flag ):
+        """glDepthMask( flag ) unless already current"""
+        flag = bool(flag)
+        return self._set( 'depthMask', flag, GL.glDepthMask, flag )
+    def color( self, red, green, blue, alpha=1.0 ):
+        """glColor4f( red, green, blue, alpha ) unless already current
+
+        Note that glColor3f is equivalent to glColor4f with alpha 1.0
+        """
+        value = (red,green,blue,alpha)
+        return self._set( 'color', value, GL.glColor4f, red, green, blue, alpha )
+    def matrixMode( self, mode ):
+        """glMatrixMode( mode ) unless already current"""
+        return self._set( 'matrixMode', mode, GL.glMatrixMode, mode )
+    def bindBuffer( self, target, buffer ):
+        """glBindBuffer( target, buffer ) unless already bound"""
+        return self._set( ('buffer',target), buffer, GL.glBindBuffer, target, buffer )
+    def useProgram( self, program ):
+        """glUseProgram( program ) unless already current"""
+        return self._set( 'program', program, GL.glUseProgram, program )
+    def activeTexture( self, unit ):
+        """glActiveTexture( unit ) unless already active"""
+        return self._set( 'activeTexture', unit, GL.glActiveTexture, unit )
+    def bindTexture( self, target, texture ):
+        """glBindTexture( target, texture ) unless already bound
+
+        Bindings are tracked per texture unit, so if the active unit is
+        not known (never set through the cache, or invalidated) the call
+        always goes through.
+        """
+        unit = self.current.get( 'activeTexture' )
+        if unit is None:
+            self.calls += 1
+            GL.glBindTexture( target, texture )
+            return True
+        return self._set( ('texture',unit,target), texture, GL.glBindTexture, target, texture )
+
+    def endFrame( self ):
+        """Finish counting for a frame
+
+        returns {'calls': count, 'elided': count} for the frame which
+        is also stored as lastFrame, and resets the counters
+        """
+        self.lastFrame = {'calls': self.calls, 'elided': self.elided}
+        self.calls = self.elided = 0
+        return self.lastFrame
+
+def getStateCache( context=None ):
+    """Get the StateCache for the given (default current) context
+
+    Creates the cache on first use.
+    """
+    cache = contextdata.getValue( CONTEXT_KEY, context=context )
+    if cache is None:
+        cache = StateCache()
+        contextdata.setValue( CONTEXT_KEY, cache, context=context )
+    return cache
@@ -128,6 +128,15 @@ import occurs the flags should no longer be changed.
 
         Default: False
 
+    PROFILING -- If True, then wrap functions with
+        OpenGL.profiler timing proxies.  Nothing is recorded until
+        OpenGL.profiler.start() is called, so the profiler can be
+        switched on and off at run-time around the code of interest,
+        but the (small) cost of the proxies is paid on every call
+        while this flag is set.
+
+        Default: False
+
     ALLOW_NUMPY_SCALARS -- if True, we will wrap
         all GLint/GLfloat calls conversions with wrappers
         that allow for passing numpy scalar values.
@@ -205,6 +214,7 @@ USE_ACCELERATE = environ_key("USE_ACCELERATE", True)
 CONTEXT_CHECKING = environ_key("CONTEXT_CHECKING", False)
 
 FULL_LOGGING = environ_key("FULL_LOGGING", False)
+PROFILING = environ_key("PROFILING", False)
 ALLOW_NUMPY_SCALARS = environ_key("ALLOW_NUMPY_SCALARS", False)
 UNSIGNED_BYTE_IMAGES_AS_STRING = environ_key("UNSIGNED_BYTE_IMAGES_AS_STRING", True)
 MODULE_ANNOTATIONS = False
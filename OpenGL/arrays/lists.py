@@ -129,32 +129,79 @@ class ListHandler( formathandler.FormatHandler ):
             length = getattr( base, '_length_', None)
             if length is not None:
                 yield length
+    @classmethod
+    def arrayType( cls, typeCode, dims ):
+        """Get the (cached) ctypes array type for typeCode with dims"""
+        key = (typeCode,dims)
+        try:
+            return _ARRAY_TYPE_CACHE[ key ]
+        except KeyError:
+            arrayType = GL_TYPE_TO_ARRAY_MAPPING[ typeCode ]
+            for dim in dims[::-1]:
+                arrayType *= dim
+            _ARRAY_TYPE_CACHE[ key ] = arrayType
+            return arrayType
     @err_on_copy
     @classmethod
     def asArray( cls, value, typeCode=None ):
         """Convert given value to a ctypes array value of given typeCode
         
-        This does a *lot* of work just to get the data into the correct
-        format.  It's not going to be anywhere near as fast as a numpy
-        or similar approach!
+        Flat sequences of numbers (the common glVertex3fv( [x,y,z] ) case)
+        are converted with a single call to a cached array type's
+        constructor.  Nested sequences are sized once (from the first
+        element at each level) and then filled in a single pass.  It's
+        still not going to be anywhere near as fast as a numpy array!
         """
         if typeCode is None:
             raise NotImplementedError( """Haven't implemented type-inference for lists yet""" )
-        arrayType = GL_TYPE_TO_ARRAY_MAPPING[ typeCode ]
         if isinstance( value, (list,tuple)):
-            subItems = [
-                cls.asArray( item, typeCode )
-                for item in value
-            ]
-            if subItems:
-                for dim in cls.dimensions( subItems[0] )[::-1]:
-                    arrayType *= dim
-                arrayType *= len( subItems )
-                result = arrayType()
-                result[:] = subItems
-                return result
+            if not value:
+                return None
+            if not isinstance( value[0], (list,tuple)):
+                try:
+                    return cls.arrayType( typeCode, (len(value),) )( *value )
+                except TypeError:
+                    # e.g. a sequence (or ctypes array) further along
+                    pass
+            return cls.nestedAsArray( value, typeCode )
         else:
-            return arrayType( value )
+            return GL_TYPE_TO_ARRAY_MAPPING[ typeCode ]( value )
+    @classmethod
+    def nestedAsArray( cls, value, typeCode ):
+        """Convert nested sequences of numbers to a multi-dimensional array"""
+        dims = []
+        item = value
+        while isinstance( item, (list,tuple)) and item:
+            dims.append( len(item) )
+            item = item[0]
+        if isinstance( item, (list,tuple)):
+            # empty innermost sequence, nothing to store
+            return None
+        dims = tuple(dims)
+        flat = []
+        def fill( items, level ):
+            if len(items) != dims[level]:
+                raise ValueError( 
+                    """Non-uniform array encountered: %s versus %s"""%(
+                        len(items), dims[level],
+                    ), value
+                )
+            if level == len(dims) - 1:
+                flat.extend( items )
+            else:
+                for child in items:
+                    if not isinstance( child, (list,tuple)):
+                        raise ValueError( 
+                            """Non-uniform array encountered: %r at depth %s"""%(
+                                child, level+1,
+                            ), value
+                        )
+                    fill( child, level+1 )
+        fill( value, 0 )
+        result = cls.arrayType( typeCode, dims )()
+        base = cls.arrayType( typeCode, (len(flat),) ).from_buffer( result )
+        base[:] = flat
+        return result
     @err_on_copy
     @classmethod
     def unitSize( cls, value, typeCode=None ):
@@ -171,6 +218,8 @@ class ListHandler( formathandler.FormatHandler ):
         return ctypes.sizeof( value )
 
 
+_ARRAY_TYPE_CACHE = {}
+
 ARRAY_TO_GL_TYPE_MAPPING = {
     _types.GLdouble: GL_1_1.GL_DOUBLE,
     _types.GLfloat: GL_1_1.GL_FLOAT,
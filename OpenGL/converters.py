@@ -106,7 +106,7 @@ class ReturnValues( Converter ):
         ))
 
 # Now the concrete classes...
-from OpenGL import acceleratesupport
+from OpenGL import acceleratesupport, outputpool
 CallFuncPyConverter = None
 if acceleratesupport.ACCELERATE_AVAILABLE:
     try:
@@ -190,10 +190,25 @@ if CallFuncPyConverter is None:
         indexLookups = [
             ('outIndex','name', 'cArgIndex' ),
         ]
-        __slots__ = ('index','size','arrayType','outIndex','inIndex')
+        __slots__ = ('index','size','arrayType','outIndex','inIndex','unpackScalar')
         def __call__( self, pyArgs, index, baseOperation ):
-            """Return pyArgs[ self.index ]"""
-            return self.arrayType.zeros( self.getSize(pyArgs) )
+            """Return a new (or pooled, see OpenGL.outputpool) output array"""
+            size = self.getSize(pyArgs)
+            pool = outputpool.current()
+            if pool is None:
+                if size != (1,) or not getattr( self, 'unpackScalar', False ):
+                    return self.arrayType.zeros( size )
+                # unpacked to a scalar by oldStyleReturn, so never escapes
+                pool = outputpool.scalars()
+            key = (self,size)
+            try:
+                return pool[key]
+            except KeyError:
+                result = pool[key] = self.arrayType.zeros( size )
+                return result
+            except TypeError:
+                # unhashable size specification
+                return self.arrayType.zeros( size )
         def getSize( self, pyArgs ):
             """Retrieve the array size for this argument"""
             return self.size
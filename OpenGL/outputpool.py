@@ -0,0 +1,66 @@
+"""Per-thread pools of reusable output arrays for wrapped entry points
+
+Wrappers built with Wrapper.setOutput (glGetFloatv, glGetIntegerv,
+glGenBuffers, ...) normally allocate a new output array on every call.
+Code which makes lots of such calls can instead reuse one array per
+(array type, size) for the current thread:
+
+    from OpenGL import outputpool
+    with outputpool.pooled():
+        matrix = glGetFloatv( GL_MODELVIEW_MATRIX )
+        ...
+
+Warning: while pooling is enabled, the returned arrays are *shared*, the
+next call producing an output of the same type and size overwrites the
+contents.  Copy any result you need to keep beyond that point.
+
+Size-(1,) outputs which are unpacked to scalars (the default
+SIZE_1_ARRAY_UNPACK behaviour) never escape to the caller, so those
+always use the per-thread scalar pool, whether or not pooling is enabled.
+
+Alternatively, an explicit output array can be passed as the output
+argument of any wrapper which was set up with orPassIn (all the glGet*
+query functions), e.g. glGetFloatv( GL_MODELVIEW_MATRIX, matrix ),
+in which case that array is filled and returned.
+"""
+import threading
+_local = threading.local()
+
+__all__ = (
+    'pooled',
+    'enable',
+    'disable',
+)
+
+def current():
+    """Get the current thread's output pool (dict) or None if not pooling"""
+    return getattr( _local, 'pool', None )
+
+def scalars():
+    """Get the current thread's pool for unpacked size-(1,) outputs"""
+    pool = getattr( _local, 'scalars', None )
+    if pool is None:
+        pool = _local.scalars = {}
+    return pool
+
+def enable():
+    """Enable output pooling for the current thread, returns the pool"""
+    pool = current()
+    if pool is None:
+        pool = _local.pool = {}
+    return pool
+
+def disable():
+    """Disable output pooling for the current thread (dropping the arrays)"""
+    _local.pool = None
+
+class pooled( object ):
+    """Context manager enabling output pooling for the current thread
+
+    Nests, the enclosing state is restored on exit.
+    """
+    def __enter__( self ):
+        self.previous = current()
+        return enable()
+    def __exit__( self, typ, val, tb ):
+        _local.pool = self.previous
@@ -124,8 +124,12 @@ class BasePlatform( object ):
             return _CheckContext( func, self.CurrentContextIsValid )
         return func 
     def wrapLogging( self, func ):
-        """Wrap function with logging operations if appropriate"""
-        return logs.logOnFail( func, logs.getLog( 'OpenGL.errors' ))
+        """Wrap function with logging (and profiling) operations if appropriate"""
+        func = logs.logOnFail( func, logs.getLog( 'OpenGL.errors' ))
+        if _configflags.PROFILING:
+            from OpenGL import profiler
+            func = profiler.ProfiledFunction( func )
+        return func
     
     def finalArgType( self, typ ):
         """Retrieve a final type for arg-type"""
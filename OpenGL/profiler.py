@@ -0,0 +1,264 @@
+"""Aggregate profiler for GL entry points
+
+Set PYOPENGL_PROFILING=true (or OpenGL.PROFILING = True before importing
+any OpenGL.* modules) and the platform wraps every entry point with a
+timing proxy (the same place FULL_LOGGING wraps them) and every
+Python-coded wrapper records its own overhead.  Recording is switched
+on and off at run-time:
+
+    from OpenGL import profiler
+    profiler.start()
+    for i in range(100):
+        display()
+    profiler.stop()
+    print( profiler.report( limit=20 ) )
+    profiler.writeChromeTrace( 'frames.json' ) # if started with trace=True
+
+For each entry point the profiler records the number of calls and the
+total, average and 99th-percentile wall time, split between the time
+spent in the driver (the ctypes call, including error checking) and in
+the Python wrapper around it (argument conversion, output arrays, etc.).
+Base-function calls made from inside another wrapper (e.g. a glGet done
+by an array-size converter) are recorded as calls in their own right and
+are not counted as the caller's wrapper overhead.
+
+Chrome-trace output (trace=True) can be loaded in chrome://tracing or
+https://ui.perfetto.dev to see the individual calls on a timeline.
+"""
+import threading, time, random, json, os
+from OpenGL import logs
+
+__all__ = (
+    'start',
+    'stop',
+    'reset',
+    'stats',
+    'report',
+    'writeChromeTrace',
+    'Profiler',
+    'PROFILER',
+)
+
+# number of samples kept per entry point for the percentile
+MAX_SAMPLES = 10000
+# number of events kept for Chrome-trace output
+MAX_EVENTS = 1000000
+
+class CallStats( object ):
+    """Aggregate timings for a single entry point"""
+    __slots__ = ('name','count','total','driver','wrapper','samples')
+    def __init__( self, name ):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.driver = 0.0
+        self.wrapper = 0.0
+        self.samples = []
+    def add( self, duration, driver, wrapper ):
+        """Record one call of duration seconds"""
+        self.count += 1
+        self.total += duration
+        self.driver += driver
+        self.wrapper += wrapper
+        samples = self.samples
+        if len(samples) < MAX_SAMPLES:
+            samples.append( duration )
+        else:
+            # reservoir sampling keeps an unbiased sample of all calls
+            index = random.randrange( self.count )
+            if index < MAX_SAMPLES:
+                samples[index] = duration
+    @property
+    def average( self ):
+        return self.total / self.count if self.count else 0.0
+    def percentile( self, fraction=.99 ):
+        """Estimate the duration below which fraction of calls complete"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted( self.samples )
+        return ordered[ min( len(ordered)-1, int( fraction * len(ordered) )) ]
+    def asDict( self ):
+        return {
+            'name': self.name,
+            'count': self.count,
+            'total': self.total,
+            'average': self.average,
+            'p99': self.percentile( .99 ),
+            'driver': self.driver,
+            'wrapper': self.wrapper,
+        }
+
+class _Frame( object ):
+    """Wrapper call in progress (collects the time of calls it makes)"""
+    __slots__ = ('name','driver','children')
+    def __init__( self, name ):
+        self.name = name
+        self.driver = 0.0
+        self.children = 0.0
+
+class Profiler( object ):
+    """Collects CallStats (and optionally trace events) while active"""
+    def __init__( self ):
+        self.active = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+    def reset( self ):
+        """Forget everything recorded so far"""
+        with self.lock:
+            self.calls = {}
+            self.events = []
+            self.started = time.perf_counter()
+    def start( self, trace=False ):
+        """Start recording, trace -- also keep per-call Chrome-trace events"""
+        if not _enabled():
+            logs.getLog( 'OpenGL.profiler' ).warning(
+                """Profiler started without PYOPENGL_PROFILING set, no GL calls will be recorded""",
+            )
+        self.tracing = trace
+        self.active = True
+    def stop( self ):
+        """Stop recording (recorded values are kept until reset())"""
+        self.active = False
+    def stack( self ):
+        """Stack of wrapper calls in progress for the current thread"""
+        try:
+            return self.local.stack
+        except AttributeError:
+            stack = self.local.stack = []
+            return stack
+    def record( self, name, start, duration, driver, wrapper, category ):
+        """Record a call of name taking duration seconds"""
+        with self.lock:
+            stats = self.calls.get( name )
+            if stats is None:
+                stats = self.calls[name] = CallStats( name )
+            stats.add( duration, driver, wrapper )
+            if self.tracing:
+                self._trace( name, category, start, duration )
+    def trace( self, name, category, start, duration ):
+        """Record a trace event (only) if tracing"""
+        if self.tracing:
+            with self.lock:
+                self._trace( name, category, start, duration )
+    def _trace( self, name, category, start, duration ):
+        if len(self.events) < MAX_EVENTS:
+            self.events.append( (
+                name, category, start, duration, threading.current_thread().ident,
+            ))
+    def stats( self ):
+        """Get list of CallStats sorted by descending total time"""
+        with self.lock:
+            calls = list(self.calls.values())
+        return sorted( calls, key=lambda s: s.total, reverse=True )
+    def report( self, sort='total', limit=None ):
+        """Produce a plain-text table of the recorded calls
+
+        sort -- 'total', 'count', 'average', 'p99', 'driver' or 'wrapper'
+        limit -- maximum number of rows to include
+        """
+        rows = [ s.asDict() for s in self.stats() ]
+        rows.sort( key=lambda row: row[sort], reverse=True )
+        if limit is not None:
+            rows = rows[:limit]
+        grand = sum( [ row['total'] for row in rows ] ) or 1.0
+        lines = [
+            '%-32s %9s %10s %9s %9s %10s %10s %6s'%(
+                'function','calls','total ms','avg us','p99 us',
+                'driver ms','wrapper ms','%',
+            )
+        ]
+        for row in rows:
+            lines.append( '%-32s %9d %10.3f %9.2f %9.2f %10.3f %10.3f %6.1f'%(
+                row['name'][:32], row['count'], row['total']*1e3,
+                row['average']*1e6, row['p99']*1e6,
+                row['driver']*1e3, row['wrapper']*1e3,
+                row['total']*100.0/grand,
+            ))
+        return '\n'.join( lines )
+    def chromeTrace( self ):
+        """Produce Chrome-trace (Trace Event Format) data for recorded events"""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        started = self.started
+        return {
+            'traceEvents': [
+                {
+                    'name': name, 'cat': category, 'ph': 'X',
+                    'ts': (start - started) * 1e6, 'dur': duration * 1e6,
+                    'pid': pid, 'tid': tid,
+                }
+                for (name,category,start,duration,tid) in events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+    def writeChromeTrace( self, filename ):
+        """Write chromeTrace() as JSON to filename"""
+        with open( filename, 'w' ) as handle:
+            json.dump( self.chromeTrace(), handle )
+
+PROFILER = Profiler()
+start = PROFILER.start
+stop = PROFILER.stop
+reset = PROFILER.reset
+stats = PROFILER.stats
+report = PROFILER.report
+writeChromeTrace = PROFILER.writeChromeTrace
+
+def _enabled():
+    """Check whether the entry points were wrapped (PROFILING flag)"""
+    from OpenGL import _configflags
+    return _configflags.PROFILING
+
+class ProfiledFunction( logs._LoggedFunction ):
+    """Timing proxy for a base (ctypes) function"""
+    def __init__( self, base ):
+        super( ProfiledFunction, self ).__init__( base, logs.getLog( 'OpenGL.profiler' ) )
+    def __bool__( self ):
+        return bool( self.__dict__[''] )
+    __nonzero__ = __bool__
+    def __call__( self, *args, **named ):
+        function = self.__dict__['']
+        if not PROFILER.active:
+            return function( *args, **named )
+        begin = time.perf_counter()
+        try:
+            return function( *args, **named )
+        finally:
+            duration = time.perf_counter() - begin
+            stack = PROFILER.stack()
+            name = function.__name__
+            if stack and stack[-1].name == name:
+                # the driver part of a wrapper call, recorded by the wrapper
+                stack[-1].driver += duration
+                PROFILER.trace( name, 'driver', begin, duration )
+            else:
+                if stack:
+                    stack[-1].children += duration
+                PROFILER.record( name, begin, duration, duration, 0.0, 'driver' )
+
+def profiledWrapper( name, callFunction ):
+    """Wrap finalised Wrapper callFunction to record wrapper/driver timings"""
+    def profiledCall( *args ):
+        if not PROFILER.active:
+            return callFunction( *args )
+        stack = PROFILER.stack()
+        frame = _Frame( name )
+        stack.append( frame )
+        begin = time.perf_counter()
+        try:
+            return callFunction( *args )
+        finally:
+            duration = time.perf_counter() - begin
+            stack.pop()
+            if stack:
+                stack[-1].children += duration
+            PROFILER.record(
+                name, begin, duration, frame.driver,
+                duration - frame.driver - frame.children, 'wrapper',
+            )
+    profiledCall.__name__ = name
+    profiledCall.__doc__ = getattr( callFunction, '__doc__', None )
+    return profiledCall
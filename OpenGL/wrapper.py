@@ -2,7 +2,7 @@
 import ctypes, logging
 from OpenGL import platform, error
 assert platform
-from OpenGL._configflags import STORE_POINTERS, ERROR_ON_COPY, SIZE_1_ARRAY_UNPACK
+from OpenGL._configflags import STORE_POINTERS, ERROR_ON_COPY, SIZE_1_ARRAY_UNPACK, PROFILING
 from OpenGL import converters
 from OpenGL.converters import DefaultCConverter
 from OpenGL.converters import returnCArgument,returnPyArgument
@@ -181,6 +181,11 @@ class Wrapper( LateBind ):
             )
         if oldStyleReturn:
             returnObject = conv.oldStyleReturn
+            try:
+                # size-(1,) results are unpacked, so the array can be pooled
+                conv.unpackScalar = True
+            except AttributeError:
+                pass
         else:
             returnObject = converters.returnCArgument( outArg )
         if orPassIn:
@@ -402,6 +407,11 @@ class Wrapper( LateBind ):
             #self.__class__.set_call( callFunction )
             #self.__class__.__dict__[ '__call__' ] = callFunction
             #print 'setting class call', callFunction
+            if PROFILING:
+                from OpenGL import profiler
+                callFunction = profiler.profiledWrapper(
+                    self.wrappedOperation.__name__, callFunction
+                )
             self.setFinalCall( callFunction )
             return callFunction
         #return self
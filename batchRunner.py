@@ -0,0 +1,215 @@
+"""Plays many seeded dragonGame matches with a scripted warrior on a pool of processes.
+
+    python batchRunner.py --matches 64 --ticks 3600 --policy fireInterval=10
+
+Every match runs dragonGame's simulation (simulationStep()) without a window
+or GL context, 60 ticks per simulated second, driving the warrior through the
+same input handlers as the keyboard and mouse. A match is determined by its
+seed and the policy, so results do not depend on the number of processes.
+Each process simulates one match at a time with module-global game state of
+its own; per-match metrics are streamed back to the parent as matches finish
+and aggregated at the end.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+TICKS_PER_SECOND = 60
+START_TIME = 1000000.0  # simulation clock at the start of every match
+# Scripted warrior: keeps engageDistance from the nearest dragon, fires every
+# fireInterval ticks, raises the shield when a fireball is within shieldDistance,
+# goes for hearts below healBelow health and changes strafe direction every strafeTicks.
+DEFAULT_POLICY = {'engageDistance': 25.0, 'fireInterval': 20, 'shieldDistance': 8.0, 'healBelow': 40,
+                  'strafeTicks': 90}
+
+game = None  # the dragonGame module, imported by each worker process
+
+
+def initWorker():
+    global game
+    import dragonGame as game
+    # chunks are generated on the simulating process, no threads competing for the cores
+    game.CHUNK_WORKERS = 0
+    game.eventBus.unsubscribe(game.eventLogger)
+    game.eventBus.unsubscribe(game.showEventOnHud)
+    # results go back through the pool; the game's console messages would only interleave with them
+    sys.stdout = open(os.devnull, 'w')
+
+
+class MatchMetrics:
+    """Event handler counting a match's gameplay events by kind."""
+
+    def __init__(self):
+        self.counts = {}
+
+    def __call__(self, event):
+        self.counts[event.kind] = self.counts.get(event.kind, 0) + 1
+
+
+class Bot:
+    """Plays the warrior by feeding input events to dragonGame's input handlers."""
+
+    def __init__(self, policy, seed):
+        self.policy = policy
+        self.rng = random.Random(seed)
+        self.strafe = b'a'
+        self.held = set()
+
+    def hold(self, wanted):
+        for key in self.held - wanted:
+            game.releaseKey(key)
+        for key in wanted - self.held:
+            game.pressKey(key)
+        self.held = wanted
+
+    def aimAt(self, target):
+        camera = game.camera
+        dx, dy, dz = [target[i] - camera.position[i] for i in range(3)]
+        yaw = math.degrees(math.atan2(dx, -dz))
+        pitch = math.degrees(math.atan2(dy, math.sqrt(dx * dx + dz * dz)))
+        turn = (yaw - camera.rotation[0] + 180.0) % 360.0 - 180.0
+        game.lookAround(turn / camera.sensitivity, (camera.rotation[1] - pitch) / camera.sensitivity)
+
+    def act(self, tick):
+        policy, warrior = self.policy, game.warrior
+        position = warrior.position
+        dragons = [dragon for dragon in game.dragons if dragon.isAlive]
+        wanted = set()
+        if warrior.health < policy['healBelow'] and game.hearts:
+            heart = min(game.hearts, key=lambda h: (h['position'][0] - position[0]) ** 2 + (h['position'][2] - position[2]) ** 2)
+            self.aimAt(heart['position'])
+            wanted.add(b'w')
+        elif dragons:
+            dragon = min(dragons, key=lambda d: (d.position[0] - position[0]) ** 2 + (d.position[2] - position[2]) ** 2)
+            self.aimAt(dragon.position)
+            distance = math.sqrt((dragon.position[0] - position[0]) ** 2 + (dragon.position[2] - position[2]) ** 2)
+            if distance > policy['engageDistance']:
+                wanted.add(b'w')
+            if tick % policy['strafeTicks'] == 0:
+                self.strafe = self.rng.choice((b'a', b'd'))
+            wanted.add(self.strafe)
+            if tick % policy['fireInterval'] == 0:
+                game.pressMouseButton(game.GLUT_LEFT_BUTTON, game.GLUT_DOWN)
+        shieldDistanceSq = policy['shieldDistance'] ** 2
+        if any(sum((fireball['pos'][i] - position[i]) ** 2 for i in range(3)) < shieldDistanceSq
+               for fireball in game.dragonFireballs):
+            game.pressKey(b'e')
+        self.hold(wanted)
+
+
+def runMatch(job):
+    """Plays one match, returns its metrics."""
+    index, seed, ticks, policy = job
+    start = time.perf_counter()
+    seeds = random.Random(seed)
+    game.generateWorld(seeds.randrange(2**32))
+    game.camera = game.Camera()
+    for key in game.keys:
+        game.keys[key] = False
+    game.isControlsLocked = False
+    game.simTime = START_TIME
+    game.eventBus.clear()
+    game.restartGame(seeds.randrange(2**32))
+    game.camera.place()
+    metrics = MatchMetrics()
+    game.eventBus.subscribe(metrics)
+    bot = Bot(policy, seeds.randrange(2**32))
+    tick = 0
+    try:
+        while tick < ticks and not game.gameOver:
+            game.simTime = START_TIME + tick / float(TICKS_PER_SECOND)
+            bot.act(tick)
+            game.simulationStep()
+            tick += 1
+    finally:
+        game.eventBus.unsubscribe(metrics)
+    seconds = time.perf_counter() - start
+    counts = metrics.counts
+    return {'match': index, 'seed': seed, 'ticks': tick, 'survived': not game.gameOver,
+            'health': max(0, game.warrior.health), 'dragonHits': counts.get(game.DRAGON_HIT, 0),
+            'dragonsDefeated': counts.get(game.DRAGON_DEFEATED, 0), 'playerHits': counts.get(game.PLAYER_HIT, 0),
+            'heals': counts.get(game.PLAYER_HEALED, 0), 'bombs': counts.get(game.BOMB_EXPLODED, 0),
+            'seconds': seconds}
+
+
+SUMMARY_FIELDS = ('ticks', 'health', 'dragonHits', 'dragonsDefeated', 'playerHits', 'heals', 'bombs')
+
+
+def summarize(results):
+    """{field: (mean, min, max)} over the matches, plus the survival rate."""
+    summary = {'survived': sum(1 for result in results if result['survived']) / float(len(results))}
+    for field in SUMMARY_FIELDS:
+        values = [result[field] for result in results]
+        summary[field] = (sum(values) / float(len(values)), min(values), max(values))
+    return summary
+
+
+def runBatch(matches, ticks, policy=None, seed=0, processes=None, callback=None):
+    """Plays matches with seeds seed, seed + 1, ... on processes worker processes.
+
+    callback(result) is called in the parent as each match finishes. Returns
+    the results ordered by match.
+    """
+    policy = dict(DEFAULT_POLICY, **(policy or {}))
+    jobs = [(index, seed + index, ticks, policy) for index in range(matches)]
+    results = []
+    with multiprocessing.Pool(processes or os.cpu_count(), initializer=initWorker) as pool:
+        for result in pool.imap_unordered(runMatch, jobs):
+            results.append(result)
+            if callback is not None:
+                callback(result)
+    results.sort(key=lambda result: result['match'])
+    return results
+
+
+def parsePolicy(items):
+    policy = {}
+    for item in items:
+        name, _, value = item.partition('=')
+        if name not in DEFAULT_POLICY:
+            raise ValueError('Unknown policy parameter %r, choose from %s' % (name, ', '.join(sorted(DEFAULT_POLICY))))
+        policy[name] = type(DEFAULT_POLICY[name])(value)
+    return policy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate seeded dragonGame matches in parallel')
+    parser.add_argument('--matches', type=int, default=16)
+    parser.add_argument('--ticks', type=int, default=60 * TICKS_PER_SECOND, help='maximum length of a match')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first match')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--policy', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a bot parameter (%s)' % ', '.join(sorted(DEFAULT_POLICY)))
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    options = parser.parse_args(argv)
+    try:
+        policy = parsePolicy(options.policy)
+    except ValueError as error:
+        parser.error(str(error))
+
+    def report(result):
+        if not options.quiet:
+            print('match %4d  seed %6d  %5d ticks  %-8s health %3d  dragon hits %3d  defeated %2d  hit %2d  %.1fs' % (
+                result['match'], result['seed'], result['ticks'], 'survived' if result['survived'] else 'died',
+                result['health'], result['dragonHits'], result['dragonsDefeated'], result['playerHits'],
+                result['seconds']))
+            sys.stdout.flush()
+
+    start = time.perf_counter()
+    results = runBatch(options.matches, options.ticks, policy, options.seed, options.processes, report)
+    elapsed = time.perf_counter() - start
+    summary = summarize(results)
+    print('%d matches, %.0f%% survived' % (len(results), summary['survived'] * 100))
+    for field in SUMMARY_FIELDS:
+        print('%-16s mean %8.1f  min %6d  max %6d' % ((field,) + summary[field]))
+    totalTicks = sum(result['ticks'] for result in results)
+    print('%d ticks in %.1fs: %.0f ticks/s' % (totalTicks, elapsed, totalTicks / elapsed if elapsed else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
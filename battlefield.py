@@ -7,6 +7,7 @@ try:
     from OpenGL.GL import *
     from OpenGL.GLU import *
     from OpenGL.GLUT import *
+    from OpenGL.GL.primitives import solidSphere
 except ImportError:
     print("PyOpenGL and GLUT are required to run this program.")
     print("Please install them with: pip install PyOpenGL PyOpenGL_accelerate")
@@ -422,7 +423,7 @@ def display():
                 glColor3f(1, 0, 0)  # Flashing red
             else:
                 glColor3f(0.8, 0.8, 0)  # Yellow
-            glutSolidSphere(0.5, 16, 16)
+            solidSphere(0.5, 16, 16)
             glPopMatrix()
         elif bomb.get('state') == 'exploding':
             progress = (
@@ -434,7 +435,7 @@ def display():
             glEnable(GL_BLEND)
             glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
             glColor4f(1.0, 0.5, 0.0, alpha)
-            glutSolidSphere(radius, 32, 32)
+            solidSphere(radius, 32, 32)
             glDisable(GL_BLEND)
             glPopMatrix()
 
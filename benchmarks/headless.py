@@ -0,0 +1,342 @@
+#! /usr/bin/env python
+"""Headless rendering harness for the demo scenes (no GLUT window required)
+
+Creates an offscreen context (an EGL pbuffer or an OSMesa buffer), imports
+dragonGame.py, battlefield.py and/or dragon.py, runs their setup code and
+then renders display()-equivalent frames, reporting frames-per-second and
+GL calls per frame, and optionally saving or comparing reference images:
+
+    python benchmarks/headless.py --platform egl --frames 200 --save refs
+    python benchmarks/headless.py --compare refs dragonGame
+    python benchmarks/headless.py --replay session.input dragonGame
+    python benchmarks/headless.py --snapshot checkpoint.snapshot dragonGame
+
+The platform is selected by setting PYOPENGL_PLATFORM before OpenGL is
+imported (on display-less Mesa, EGL_PLATFORM=surfaceless is also set).
+
+The scenes are GLUT programs, so the window-system entry points they use
+are replaced in the scene module's namespace: glutSwapBuffers becomes
+glFinish and cursor/redisplay/modifier calls are ignored.  Spheres and
+cubes are buffer-object meshes (OpenGL.GL.primitives), drawn the same as
+in the window.  dragonGame's text goes through textAtlas.TextRenderer,
+which uses its built-in 5x7 font when GLUT is not initialised, so the
+reference images show the HUD in that font instead of Helvetica.  The
+scene's time module is replaced by a simulated clock advancing 1/60s per
+frame and random is seeded, so that reference images are reproducible.
+--replay plays an input log recorded with dragonGame.py --record back
+into the dragonGame scene, so recorded sessions can serve as benchmark
+workloads; --snapshot starts the scene from a snapshot saved in the game
+(N key) instead.
+
+GL calls per frame are counted with OpenGL.profiler (PYOPENGL_PROFILING is
+set by the harness) in a separate pass after the timed frames, so the
+counting does not distort the frame rate.
+"""
+import sys, os, time, struct, zlib, argparse, random, importlib
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ )))
+sys.path.insert( 0, ROOT )
+SCENES = ('dragonGame','battlefield','dragon')
+FRAME_TIME = 1.0/60
+
+class SimulatedClock( object ):
+    """Stand-in for the time module whose time() only advances per frame"""
+    def __init__( self, start=1000000.0 ):
+        self.now = start
+    def time( self ):
+        return self.now
+    def advance( self, seconds=FRAME_TIME ):
+        self.now += seconds
+    def __getattr__( self, key ):
+        return getattr( time, key )
+
+class EGLContext( object ):
+    """Pbuffer-backed desktop GL context created through EGL"""
+    def __init__( self, width, height ):
+        import ctypes
+        from OpenGL import EGL
+        self.EGL = EGL
+        self.display = EGL.eglGetDisplay( EGL.EGL_DEFAULT_DISPLAY )
+        if not EGL.eglInitialize( self.display, None, None ):
+            raise RuntimeError( 'Unable to initialise EGL display' )
+        attributes = (EGL.EGLint * 13)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE,
+        )
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig( self.display, attributes, ctypes.pointer( config ), 1, ctypes.pointer( count ))
+        if not count.value:
+            raise RuntimeError( 'No EGL config supports desktop GL pbuffers' )
+        self.surface = EGL.eglCreatePbufferSurface(
+            self.display, config,
+            (EGL.EGLint * 5)( EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE ),
+        )
+        EGL.eglBindAPI( EGL.EGL_OPENGL_API )
+        self.context = EGL.eglCreateContext( self.display, config, EGL.EGL_NO_CONTEXT, None )
+        if not EGL.eglMakeCurrent( self.display, self.surface, self.surface, self.context ):
+            raise RuntimeError( 'Unable to make EGL context current' )
+    def destroy( self ):
+        EGL = self.EGL
+        EGL.eglMakeCurrent( self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT )
+        EGL.eglDestroySurface( self.display, self.surface )
+        EGL.eglDestroyContext( self.display, self.context )
+        EGL.eglTerminate( self.display )
+
+class OSMesaContext( object ):
+    """Software context rendering into a client-side OSMesa buffer"""
+    def __init__( self, width, height ):
+        from OpenGL import osmesa, arrays
+        from OpenGL.GL import GL_UNSIGNED_BYTE
+        self.osmesa = osmesa
+        self.context = osmesa.OSMesaCreateContextExt( osmesa.OSMESA_RGBA, 24, 0, 0, None )
+        if not self.context:
+            raise RuntimeError( 'Unable to create OSMesa context' )
+        self.buffer = arrays.GLubyteArray.zeros( (height, width, 4) )
+        if not osmesa.OSMesaMakeCurrent( self.context, self.buffer, GL_UNSIGNED_BYTE, width, height ):
+            raise RuntimeError( 'Unable to make OSMesa context current' )
+    def destroy( self ):
+        self.osmesa.OSMesaDestroyContext( self.context )
+
+CONTEXTS = {
+    'egl': EGLContext,
+    'osmesa': OSMesaContext,
+}
+
+def installWindowReplacements( module ):
+    """Replace the GLUT window-system calls used by a scene module"""
+    from OpenGL import GL
+    replacements = {
+        'glutSwapBuffers': GL.glFinish,
+        'glutPostRedisplay': lambda: None,
+        'glutWarpPointer': lambda x, y: None,
+        'glutSetCursor': lambda cursor: None,
+        'glutGetModifiers': lambda: 0,
+    }
+    for name, function in replacements.items():
+        if hasattr( module, name ):
+            setattr( module, name, function )
+
+def setupDragonGame( module, width, height ):
+    """Equivalent of dragonGame.main() without the GLUT window"""
+    module.setupOpengl()
+    # the render scale follows real frame times, which would make images irreproducible
+    module.dynamicResolution = False
+    module.generateWorld()
+    module.compileDisplayLists()
+    module.camera = module.Camera()
+    module.lastMousePos = {'x': width // 2, 'y': height // 2}
+    module.simTime = module.time.time()
+    module.restartGame()
+    module.reshape( width, height )
+    def frame():
+        module.idle()
+        module.display()
+    return frame
+
+def setupBattlefield( module, width, height ):
+    """Equivalent of battlefield.main() without the GLUT window"""
+    module.setup_opengl()
+    module.generate_world()
+    module.compile_display_lists()
+    module.game_state = {'last_wall_check': module.time.time()}
+    for _ in range( module.NUM_BOMBS ):
+        module.spawn_bomb()
+    module.camera = module.Camera( position=(0, 2, 5) )
+    module.last_mouse_pos = {'x': width // 2, 'y': height // 2}
+    module.reshape( width, height )
+    def frame():
+        module.idle()
+        module.display()
+    return frame
+
+def setupDragon( module, width, height ):
+    """Equivalent of dragon.main() without the GLUT window"""
+    module.init()
+    module.reshape( width, height )
+    module.create_fireball()
+    def frame():
+        module.idle()
+        module.display()
+    return frame
+
+SETUPS = {
+    'dragonGame': setupDragonGame,
+    'battlefield': setupBattlefield,
+    'dragon': setupDragon,
+}
+
+def loadScene( name, width, height, seed=1 ):
+    """Import scene name and run its setup, returns a function rendering one frame"""
+    random.seed( seed )
+    module = importlib.import_module( name )
+    clock = SimulatedClock()
+    module.time = clock
+    installWindowReplacements( module )
+    frame = SETUPS[name]( module, width, height )
+    def step():
+        clock.advance()
+        frame()
+    return step
+
+def readPixels( width, height ):
+    """Read the framebuffer as top-to-bottom RGBA rows"""
+    from OpenGL import GL
+    GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 1 )
+    data = GL.glReadPixels( 0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE )
+    data = bytes( memoryview( data ).cast( 'B' ) ) if not isinstance( data, bytes ) else data
+    stride = width * 4
+    return b''.join( [
+        data[row*stride:(row+1)*stride] for row in range( height-1, -1, -1 )
+    ])
+
+def writePng( filename, width, height, pixels ):
+    """Write top-to-bottom RGBA pixels as a PNG file"""
+    stride = width * 4
+    raw = b''.join( [
+        b'\0' + pixels[row*stride:(row+1)*stride] for row in range( height )
+    ])
+    def chunk( kind, data ):
+        return struct.pack( '>I', len(data) ) + kind + data + struct.pack( '>I', zlib.crc32( kind + data ) & 0xffffffff )
+    with open( filename, 'wb' ) as handle:
+        handle.write( b'\x89PNG\r\n\x1a\n' )
+        handle.write( chunk( b'IHDR', struct.pack( '>IIBBBBB', width, height, 8, 6, 0, 0, 0 )))
+        handle.write( chunk( b'IDAT', zlib.compress( raw, 6 )))
+        handle.write( chunk( b'IEND', b'' ))
+
+def readPng( filename ):
+    """Read a PNG written by writePng, returns (width, height, pixels)"""
+    with open( filename, 'rb' ) as handle:
+        data = handle.read()
+    offset = 8
+    chunks = {}
+    while offset < len( data ):
+        length, = struct.unpack( '>I', data[offset:offset+4] )
+        kind = data[offset+4:offset+8]
+        chunks[kind] = chunks.get( kind, b'' ) + data[offset+8:offset+8+length]
+        offset += 12 + length
+    width, height, depth, colorType = struct.unpack( '>IIBB', chunks[b'IHDR'][:10] )
+    if (depth, colorType) != (8, 6):
+        raise ValueError( 'Only 8-bit RGBA reference images are supported: %s'%( filename, ))
+    raw = zlib.decompress( chunks[b'IDAT'] )
+    stride = width * 4
+    rows = []
+    for row in range( height ):
+        start = row * (stride + 1)
+        if raw[start:start+1] != b'\0':
+            raise ValueError( 'Only unfiltered reference images are supported: %s'%( filename, ))
+        rows.append( raw[start+1:start+1+stride] )
+    return width, height, b''.join( rows )
+
+def comparePixels( expected, actual, tolerance=8 ):
+    """Fraction of pixels whose channels differ by more than tolerance"""
+    different = 0
+    for index in range( 0, len( expected ), 4 ):
+        for channel in range( 4 ):
+            if abs( expected[index+channel] - actual[index+channel] ) > tolerance:
+                different += 1
+                break
+    return different / float( max( 1, len( expected ) // 4 ))
+
+def runScene( name, width, height, frames=100, warmup=5, countFrames=10, setup=None ):
+    """Render frames of scene name, returns results dict (and final pixels)
+
+    countFrames -- number of extra frames rendered to count GL calls, 0 to skip
+    setup -- optional function called with the scene module before rendering
+    """
+    from OpenGL import profiler
+    step = loadScene( name, width, height )
+    if setup is not None:
+        setup( sys.modules[name] )
+    # scenes may have started the profiler themselves (dragonGame's FrameStats)
+    profiler.stop()
+    for i in range( warmup ):
+        step()
+    start = time.perf_counter()
+    for i in range( frames ):
+        step()
+    elapsed = time.perf_counter() - start
+    calls = 0
+    if countFrames:
+        profiler.reset()
+        profiler.start()
+        for i in range( countFrames ):
+            step()
+        profiler.stop()
+        calls = sum( [ stats.count for stats in profiler.stats() ] )
+        profiler.reset()
+    pixels = readPixels( width, height )
+    return {
+        'scene': name,
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': frames / elapsed if elapsed else 0.0,
+        'frameMs': elapsed * 1000.0 / frames if frames else 0.0,
+        'glCallsPerFrame': calls / float( countFrames ) if countFrames else 0.0,
+    }, pixels
+
+def configureEnvironment( platform ):
+    """Set environment so the next OpenGL import uses platform"""
+    os.environ['PYOPENGL_PLATFORM'] = platform
+    os.environ.setdefault( 'PYOPENGL_PROFILING', 'true' )
+    if platform == 'egl' and not os.environ.get( 'DISPLAY' ):
+        os.environ.setdefault( 'EGL_PLATFORM', 'surfaceless' )
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description='Render the demo scenes offscreen' )
+    parser.add_argument( 'scenes', nargs='*', help='scenes to render (default: %s)'%( ', '.join( SCENES ), ))
+    parser.add_argument( '--platform', default='egl', choices=sorted( CONTEXTS ))
+    parser.add_argument( '--frames', type=int, default=100 )
+    parser.add_argument( '--size', default='640x360', help='WIDTHxHEIGHT of the offscreen buffer' )
+    parser.add_argument( '--save', metavar='DIR', help='save a reference PNG per scene into DIR' )
+    parser.add_argument( '--compare', metavar='DIR', help='compare final frames with the PNGs in DIR' )
+    parser.add_argument( '--tolerance', type=int, default=8, help='per-channel difference ignored when comparing' )
+    parser.add_argument( '--threshold', type=float, default=0.005, help='fraction of differing pixels allowed' )
+    parser.add_argument( '--replay', metavar='LOG', help='replay an input log recorded with dragonGame.py --record' )
+    parser.add_argument( '--snapshot', metavar='FILE', help='start dragonGame from a snapshot saved in the game' )
+    options = parser.parse_args( argv )
+    for name in options.scenes:
+        if name not in SCENES:
+            parser.error( 'unknown scene %r, choose from %s'%( name, ', '.join( SCENES )))
+    if options.replay and options.snapshot:
+        parser.error( '--replay starts from the recorded session, it cannot be combined with --snapshot' )
+    width, height = [ int(x) for x in options.size.lower().split( 'x' ) ]
+    configureEnvironment( options.platform )
+    failures = 0
+    for name in options.scenes or SCENES:
+        # a fresh context per scene, so no GL state leaks between them
+        context = CONTEXTS[options.platform]( width, height )
+        try:
+            setup = None
+            if options.replay and name == 'dragonGame':
+                setup = lambda module: module.startReplay( options.replay )
+            elif options.snapshot and name == 'dragonGame':
+                setup = lambda module: module.loadSnapshot( options.snapshot )
+            results, pixels = runScene( name, width, height, frames=options.frames, setup=setup )
+            print( '%-12s %8.1f fps %8.2f ms/frame %10.1f GL calls/frame'%(
+                name, results['fps'], results['frameMs'], results['glCallsPerFrame'],
+            ))
+            if options.save:
+                if not os.path.isdir( options.save ):
+                    os.makedirs( options.save )
+                writePng( os.path.join( options.save, name + '.png' ), width, height, pixels )
+            if options.compare:
+                refWidth, refHeight, expected = readPng( os.path.join( options.compare, name + '.png' ))
+                if (refWidth, refHeight) != (width, height):
+                    print( '%-12s reference is %sx%s, rendered %sx%s'%( name, refWidth, refHeight, width, height ))
+                    failures += 1
+                    continue
+                difference = comparePixels( expected, pixels, options.tolerance )
+                status = 'ok' if difference <= options.threshold else 'MISMATCH'
+                print( '%-12s %.3f%% of pixels differ: %s'%( name, difference * 100, status ))
+                if difference > options.threshold:
+                    failures += 1
+        finally:
+            context.destroy()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
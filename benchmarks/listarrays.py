@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+"""Benchmark conversion of Python lists/tuples by arrays.lists.ListHandler
+
+Measures ListHandler.asArray (the conversion used when e.g. glVertex3fv
+or glColor4fv is passed a Python list) for 3-, 4- and 16-element flat
+sequences and a nested 4x4 matrix.  No GL context is required.
+
+    python benchmarks/listarrays.py [iterations]
+"""
+import sys, os, timeit
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ))))
+from OpenGL.arrays import lists
+from OpenGL.raw.GL.VERSION.GL_1_1 import GL_FLOAT, GL_INT
+
+CASES = [
+    ('3 floats (list)', [1.0,2.0,3.0], GL_FLOAT),
+    ('3 floats (tuple)', (1.0,2.0,3.0), GL_FLOAT),
+    ('4 floats (list)', [1.0,0.5,0.25,1.0], GL_FLOAT),
+    ('4 ints (tuple)', (0,0,640,480), GL_INT),
+    ('16 floats (list)', [float(i) for i in range(16)], GL_FLOAT),
+    ('4x4 floats (nested)', [[float(i*4+j) for j in range(4)] for i in range(4)], GL_FLOAT),
+]
+
+def run( iterations=100000 ):
+    """Time each case, returns [(name, microseconds-per-conversion), ...]"""
+    asArray = lists.ListHandler.asArray
+    results = []
+    for name, value, typeCode in CASES:
+        seconds = min( timeit.repeat(
+            lambda: asArray( value, typeCode ), number=iterations, repeat=3,
+        ))
+        results.append( (name, seconds / iterations * 1e6) )
+    return results
+
+def main():
+    iterations = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100000
+    for name, micros in run( iterations ):
+        print( '%-24s %8.3f us'%( name, micros ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+"""Benchmark suite for the wrapper, array, VBO and scene hot paths
+
+Runs in a headless context (see headless.py) and measures:
+
+    import -- time to import OpenGL.GL in a fresh interpreter
+    wrapper.* -- per-call overhead of representative wrapper signatures
+    arrays.* -- array marshalling (asArray + dataPointer) per format handler
+    vbo.* -- VBO create/bind/delete and update/bind cycles
+    readpixels -- glReadPixels throughput
+    frame.dragonGame.* -- full dragonGame frames at 1x/10x/100x props
+
+Results are written as JSON and can be compared against a baseline run:
+
+    python benchmarks/suite.py --output base.json
+    ... change things ...
+    python benchmarks/suite.py --output new.json --baseline base.json
+
+Every result records its unit and whether lower or higher is better, a
+comparison flags results which are worse than the baseline by more than
+--threshold (default 10%) and exits with a non-zero status if any are.
+"""
+import sys, os, time, json, timeit, subprocess, platform as _platform
+import headless
+
+SCALES = (1, 10, 100)
+
+class Results( object ):
+    """Named measurements, {name: {'value','unit','better'}}"""
+    def __init__( self ):
+        self.values = {}
+    def add( self, name, value, unit, better='lower' ):
+        self.values[name] = {'value': value, 'unit': unit, 'better': better}
+        print( '%-40s %12.3f %s'%( name, value, unit ))
+    def skip( self, name, reason ):
+        print( '%-40s %12s (%s)'%( name, 'skipped', reason ))
+
+def timePerCall( function, number=2000, repeat=3 ):
+    """Best-of-repeat microseconds per call of function()"""
+    return min( timeit.repeat( function, number=number, repeat=repeat )) / number * 1e6
+
+def benchImport( results, repeat=3 ):
+    """Import time of OpenGL.GL, less bare interpreter start-up"""
+    environment = dict( os.environ, PYTHONPATH=headless.ROOT )
+    def run( code ):
+        best = None
+        for i in range( repeat ):
+            start = time.perf_counter()
+            subprocess.check_call( [sys.executable, '-c', code], env=environment )
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min( best, elapsed )
+        return best
+    results.add( 'import.OpenGL.GL', (run( 'import OpenGL.GL' ) - run( 'pass' )) * 1e3, 'ms' )
+
+def benchWrappers( results ):
+    """Per-call cost of representative wrapper signatures"""
+    from OpenGL import GL
+    from OpenGL.arrays import GLintArray
+    viewport = GLintArray.zeros( (4,) )
+    cases = [
+        ('wrapper.glColor3f', lambda: GL.glColor3f( 1.0, 0.5, 0.25 )),
+        ('wrapper.glColor3fv.list', lambda: GL.glColor3fv( [1.0, 0.5, 0.25] )),
+        ('wrapper.glColor4fv.tuple', lambda: GL.glColor4fv( (1.0, 0.5, 0.25, 1.0) )),
+        ('wrapper.glGetIntegerv.output', lambda: GL.glGetIntegerv( GL.GL_VIEWPORT )),
+        ('wrapper.glGetIntegerv.passed', lambda: GL.glGetIntegerv( GL.GL_VIEWPORT, viewport )),
+        ('wrapper.glGetFloatv.matrix', lambda: GL.glGetFloatv( GL.GL_MODELVIEW_MATRIX )),
+        ('wrapper.glIsEnabled', lambda: GL.glIsEnabled( GL.GL_DEPTH_TEST )),
+    ]
+    def genDelete():
+        GL.glDeleteBuffers( 1, [GL.glGenBuffers( 1 )] )
+    cases.append( ('wrapper.glGenBuffers+glDeleteBuffers', genDelete) )
+    for name, function in cases:
+        results.add( name, timePerCall( function ), 'us' )
+
+def arraySamples():
+    """(handler name, 16-value sample, 4096-value sample) for available formats"""
+    import ctypes, struct
+    small = [float(i) for i in range( 16 )]
+    large = [float(i % 256) for i in range( 4096 )]
+    samples = [
+        ('lists', small, large),
+        ('ctypes', (ctypes.c_float*16)( *small ), (ctypes.c_float*4096)( *large )),
+        ('bytes', struct.pack( '16f', *small ), struct.pack( '4096f', *large )),
+    ]
+    try:
+        import numpy
+    except ImportError:
+        samples.append( ('numpy', None, None) )
+    else:
+        samples.append( ('numpy', numpy.array( small, 'f' ), numpy.array( large, 'f' )) )
+    return samples
+
+def benchArrays( results ):
+    """asArray + dataPointer cost per format handler"""
+    from OpenGL import arrays
+    floats = arrays.GLfloatArray
+    for handler, small, large in arraySamples():
+        if small is None:
+            results.skip( 'arrays.%s'%( handler, ), 'not installed' )
+            continue
+        if handler == 'bytes':
+            # bytes are only accepted as untyped (GLubyte/GLvoid) data
+            arrayType = arrays.GLubyteArray
+        else:
+            arrayType = floats
+        for size, value in (('16', small), ('4096', large)):
+            def marshal( value=value ):
+                arrayType.dataPointer( arrayType.asArray( value ))
+            number = 2000 if size == '16' else 200
+            results.add( 'arrays.%s.%s'%( handler, size ), timePerCall( marshal, number ), 'us' )
+
+def benchVBO( results ):
+    """VBO life-cycle costs"""
+    import ctypes
+    from OpenGL.arrays import vbo
+    data = (ctypes.c_float * 3000)( *range( 3000 ))
+    other = (ctypes.c_float * 3000)( *range( 3000, 6000 ))
+    def createBindDelete():
+        buffer = vbo.VBO( data )
+        buffer.bind()
+        buffer.unbind()
+        buffer.delete()
+    buffer = vbo.VBO( data )
+    buffer.bind()
+    buffer.unbind()
+    state = [data, other]
+    def updateBind():
+        state.reverse()
+        buffer.set_array( state[0] )
+        buffer.bind()
+        buffer.unbind()
+    def bindUnbind():
+        buffer.bind()
+        buffer.unbind()
+    results.add( 'vbo.create+bind+delete', timePerCall( createBindDelete, 500 ), 'us' )
+    results.add( 'vbo.set_array+bind', timePerCall( updateBind, 500 ), 'us' )
+    results.add( 'vbo.bind+unbind', timePerCall( bindUnbind, 2000 ), 'us' )
+    buffer.delete()
+
+def benchReadPixels( results, width, height ):
+    """glReadPixels RGBA/UNSIGNED_BYTE throughput"""
+    from OpenGL import GL
+    GL.glPixelStorei( GL.GL_PACK_ALIGNMENT, 1 )
+    def read():
+        GL.glReadPixels( 0, 0, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE )
+    micros = timePerCall( read, 50 )
+    results.add( 'readpixels.%dx%d'%( width, height ), width * height * 4 / micros, 'MB/s', better='higher' )
+
+def scaleProps( scale ):
+    """Function multiplying dragonGame's prop density by scale"""
+    def setup( module ):
+        if scale == 1:
+            return
+        world = module.world
+        world.density = scale
+        world.clear()
+        world.preload( module.warrior.position )
+    return setup
+
+def benchFrames( results, platform, width, height, frames ):
+    """Full dragonGame frames with 1x/10x/100x prop counts"""
+    for scale in SCALES:
+        context = headless.CONTEXTS[platform]( width, height )
+        try:
+            count = max( 2, frames // scale )
+            stats, pixels = headless.runScene(
+                'dragonGame', width, height, frames=count, warmup=1,
+                countFrames=0, setup=scaleProps( scale ),
+            )
+        finally:
+            context.destroy()
+        results.add( 'frame.dragonGame.%dx'%( scale, ), stats['frameMs'], 'ms' )
+
+def compare( current, baseline, threshold ):
+    """Print comparison with baseline values, returns names of regressions"""
+    regressions = []
+    print( '\n%-40s %12s %12s %9s'%( 'benchmark', 'baseline', 'current', 'change' ))
+    for name in sorted( current ):
+        if name not in baseline:
+            continue
+        new, old = current[name]['value'], baseline[name]['value']
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = change > threshold if current[name]['better'] == 'lower' else change < -threshold
+        if worse:
+            regressions.append( name )
+        print( '%-40s %12.3f %12.3f %+8.1f%%%s'%(
+            name, old, new, change * 100, '  REGRESSION' if worse else '',
+        ))
+    return regressions
+
+def main( argv=None ):
+    import argparse
+    parser = argparse.ArgumentParser( description='Run the PyOpenGL/scene benchmark suite' )
+    parser.add_argument( '--platform', default='egl', choices=sorted( headless.CONTEXTS ))
+    parser.add_argument( '--output', metavar='FILE', help='write results as JSON to FILE' )
+    parser.add_argument( '--baseline', metavar='FILE', help='compare with results JSON in FILE' )
+    parser.add_argument( '--threshold', type=float, default=0.10, help='relative change counted as a regression' )
+    parser.add_argument( '--frames', type=int, default=30, help='frames at 1x scale (fewer at larger scales)' )
+    parser.add_argument( '--size', default='640x360' )
+    parser.add_argument( '--skip-frames', action='store_true', help='skip the full-frame scene benchmarks' )
+    options = parser.parse_args( argv )
+    width, height = [ int(x) for x in options.size.lower().split( 'x' ) ]
+    # the profiler proxies would distort the wrapper timings
+    os.environ['PYOPENGL_PROFILING'] = 'false'
+    headless.configureEnvironment( options.platform )
+
+    results = Results()
+    benchImport( results )
+    context = headless.CONTEXTS[options.platform]( width, height )
+    try:
+        from OpenGL import GL
+        renderer = GL.glGetString( GL.GL_RENDERER ).decode( 'latin-1' )
+        benchWrappers( results )
+        benchArrays( results )
+        benchVBO( results )
+        benchReadPixels( results, width, height )
+    finally:
+        context.destroy()
+    if not options.skip_frames:
+        benchFrames( results, options.platform, width, height, options.frames )
+
+    document = {
+        'python': sys.version.split()[0],
+        'machine': _platform.platform(),
+        'platform': options.platform,
+        'renderer': renderer,
+        'time': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+        'results': results.values,
+    }
+    if options.output:
+        with open( options.output, 'w' ) as handle:
+            json.dump( document, handle, indent=2, sort_keys=True )
+    if options.baseline:
+        with open( options.baseline ) as handle:
+            baseline = json.load( handle )
+        regressions = compare( results.values, baseline['results'], options.threshold )
+        if regressions:
+            print( '\n%d regression(s): %s'%( len(regressions), ', '.join( regressions )))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
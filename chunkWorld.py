@@ -0,0 +1,430 @@
+import math
+import random
+import sys
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from OpenGL.GL import (glGenLists, glNewList, glEndList, glDeleteLists, glCallList, glPushMatrix,
+                       glPopMatrix, glTranslatef, GL_COMPILE)
+from OpenGL.GL.picking import BVH
+
+from lod import projectedSize
+
+# Props per chunk of CHUNK_AREA square units at density 1.0, matching the old
+# fixed 200x200 world (150 trees, 70 rocks, 800 shrubs, 30 walls)
+PROP_DENSITY = {'trees': 150 / 40000.0, 'rocks': 70 / 40000.0, 'shrubs': 800 / 40000.0,
+                'random_walls': 30 / 40000.0}
+# Height of each prop's origin above the ground
+PROP_HEIGHTS = {'trees': 0.0, 'rocks': 0.5, 'shrubs': 1.0, 'random_walls': 0.0}
+# Rough per-prop cost of a chunk's data (position tuple, list slot) and of each
+# display list compiled with the prop in it (matrix push, translate, call, pop)
+BYTES_PER_PROP = 96
+BYTES_PER_LIST_PROP = 64
+
+
+def _distanceSq(bounds, x, z):
+    """Squared XZ distance from (x, z) to the nearest point of bounds (minX, minZ, maxX, maxZ)."""
+    minX, minZ, maxX, maxZ = bounds
+    dx = max(minX - x, 0.0, x - maxX)
+    dz = max(minZ - z, 0.0, z - maxZ)
+    return dx * dx + dz * dz
+
+
+class Cell:
+    """A square part of a chunk whose props are drawn with one display list per LOD combination."""
+    __slots__ = ('bounds', 'box', 'center', 'objects', 'count', 'lists', 'vertices', 'levels', 'listId')
+
+    def __init__(self, bounds, objects, box=None):
+        self.bounds = bounds
+        self.box = box  # (minX, minY, minZ, maxX, maxY, maxZ) enclosing everything drawn for the cell
+        self.objects = objects
+        self.count = sum(len(positions) for positions in objects.values())
+        minX, minZ, maxX, maxZ = bounds
+        self.center = ((minX + maxX) / 2.0, 0.0, (minZ + maxZ) / 2.0)
+        self.lists = {}  # levels of the prop types whose geometry changes with the level -> display list
+        self.vertices = {}  # display list -> vertices it draws
+        self.levels = None  # levels drawn last frame, for hysteresis
+        self.listId = None
+
+
+class Chunk:
+    __slots__ = ('coords', 'bounds', 'box', 'objects', 'cells', 'count', 'pickingScene', 'byteSize', 'lastUsed')
+
+    def __init__(self, coords, bounds, objects, cells, pickingScene):
+        self.coords = coords
+        self.bounds = bounds  # (minX, minZ, maxX, maxZ)
+        self.objects = objects
+        self.cells = cells
+        # (minX, minY, minZ, maxX, maxY, maxZ) enclosing the boxes of all cells, None without props
+        self.box = None
+        if cells:
+            self.box = tuple(min(cell.box[axis] for cell in cells) for axis in range(3)) + \
+                tuple(max(cell.box[axis] for cell in cells) for axis in range(3, 6))
+        self.count = sum(len(positions) for positions in objects.values())
+        self.pickingScene = pickingScene
+        self.byteSize = self.count * BYTES_PER_PROP + sys.getsizeof(objects)
+        self.lastUsed = 0
+
+    def distanceSq(self, x, z):
+        """Squared XZ distance from (x, z) to the nearest point of the chunk."""
+        return _distanceSq(self.bounds, x, z)
+
+    def lists(self):
+        return [listId for cell in self.cells for listId in cell.lists.values()]
+
+    def listBytes(self):
+        """Estimated size of the chunk's compiled display lists."""
+        return sum(len(cell.lists) * cell.count for cell in self.cells) * BYTES_PER_LIST_PROP
+
+
+class ChunkedWorld:
+    """Procedural world of square chunks generated around the player on demand.
+
+    Chunk contents depend only on (seed, chunk coordinates), so a chunk that was
+    evicted is regenerated identically when the player comes back. Generation
+    (prop placement and the chunk's picking BVH) runs on a thread pool, or
+    synchronously in update() with workers=0. Loaded
+    chunks are kept in LRU order and chunks outside the view radius are evicted
+    once the estimated size of all loaded chunks exceeds the memory budget;
+    sync() deletes their display lists on the rendering thread.
+
+    For drawing, each chunk is split into cellsPerSide x cellsPerSide cells.
+    visibleCells() culls cells by distance and picks a level of detail per prop
+    type in each cell from the type's projected size (propSizes) with
+    lodSelector, then draws the cell with one display list replaying
+    propLevels[type][level] at every prop (None skips the prop at that level).
+    The lists are compiled when a cell first needs a combination of levels;
+    prop types drawn with the same list at every level don't count towards
+    the combination. Compiled lists count towards the memory budget, and once
+    it is exceeded after evicting chunks, the lists cells are not currently
+    drawn with are released too.
+    Each cell's box encloses its props using drawBounds[type] = (half width,
+    bottom, top) around each prop position, for occlusion tests.
+    cell.vertices[list] is the number of vertices each of a cell's lists
+    draws, from listVertices (prop list -> vertices), for frame statistics.
+
+    Chunks found in stored (coords -> {type: flat x, y, z doubles}, e.g. read
+    from a snapshot) are built from those positions instead of being placed
+    again; propArrays() returns the same form for every known chunk.
+    """
+
+    def __init__(self, seed, propLevels, propSizes, lodSelector, chunkSize=50.0, cellsPerSide=4, viewRadius=2,
+                 memoryBudget=4 * 1024 * 1024, workers=2, density=1.0, pickBounds=None, drawBounds=None,
+                 heightAt=None, listVertices=None):
+        self.seed = seed
+        self.propLevels = propLevels
+        self.propSizes = propSizes
+        self.propKeys = sorted(propLevels)
+        # indices (into propKeys) of the prop types whose list differs between levels
+        self.lodIndices = tuple(index for index, key in enumerate(self.propKeys) if len(set(propLevels[key])) > 1)
+        self.lodSelector = lodSelector
+        self.chunkSize = chunkSize
+        self.cellsPerSide = cellsPerSide
+        self.viewRadius = viewRadius
+        self.memoryBudget = memoryBudget
+        self.density = density
+        self.pickBounds = pickBounds or {}
+        self.drawBounds = drawBounds or {}
+        self.heightAt = heightAt or (lambda x, z: 0.0)
+        self.listVertices = listVertices if listVertices is not None else {}
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.chunks = OrderedDict()  # coords -> Chunk, least recently used first
+        self.pending = {}  # coords -> Future
+        self.releasedLists = []  # display lists of evicted chunks, deleted by sync()
+        self.stored = {}  # coords -> {type: flat position array} of chunks generated before
+        self.byteSize = 0
+        self.frame = 0
+        self.compileFrame = None
+        self.frameCompiles = 0  # lists compiled since update() last advanced the frame
+        self.stats = {'generated': 0, 'evicted': 0, 'compiled': 0, 'released': 0, 'lists': 0, 'visible': 0,
+                      'culled': 0}
+
+    def chunkCoords(self, x, z):
+        return (int(math.floor(x / self.chunkSize)), int(math.floor(z / self.chunkSize)))
+
+    def generate(self, coords):
+        """Builds the contents of the chunk at coords (runs on a worker thread)."""
+        stored = self.stored.get(coords)
+        if stored is None:
+            objects = self._placeProps(coords)
+        else:
+            objects = {}
+            for key, flat in stored.items():
+                values = flat.tolist()
+                objects[key] = list(zip(values[0::3], values[1::3], values[2::3]))
+        return self._buildChunk(coords, objects)
+
+    def _placeProps(self, coords):
+        cx, cz = coords
+        rng = random.Random('%s:%d:%d' % (self.seed, cx, cz))
+        minX, minZ = cx * self.chunkSize, cz * self.chunkSize
+        area = self.chunkSize * self.chunkSize
+        objects = {}
+        for key in sorted(PROP_DENSITY):
+            expected = PROP_DENSITY[key] * area * self.density
+            count = int(expected) + (1 if rng.random() < expected - int(expected) else 0)
+            positions = []
+            for _ in range(count):
+                x, z = rng.uniform(minX, minX + self.chunkSize), rng.uniform(minZ, minZ + self.chunkSize)
+                positions.append((x, self.heightAt(x, z) + PROP_HEIGHTS[key], z))
+            objects[key] = positions
+        return objects
+
+    def _buildChunk(self, coords, objects):
+        """The chunk at coords holding objects ({type: [position, ...]}), split into cells."""
+        cx, cz = coords
+        minX, minZ = cx * self.chunkSize, cz * self.chunkSize
+        maxX, maxZ = minX + self.chunkSize, minZ + self.chunkSize
+        cellSize = self.chunkSize / self.cellsPerSide
+        cellObjects = [[{} for i in range(self.cellsPerSide)] for j in range(self.cellsPerSide)]
+        items = []
+        for key, positions in objects.items():
+            for pos in positions:
+                i = min(int((pos[0] - minX) / cellSize), self.cellsPerSide - 1)
+                j = min(int((pos[2] - minZ) / cellSize), self.cellsPerSide - 1)
+                cellObjects[j][i].setdefault(key, []).append(pos)
+            if key in self.pickBounds:
+                halfSize, bottom, top = self.pickBounds[key]
+                for index, pos in enumerate(positions):
+                    items.append(((key, '%d,%d/%d' % (cx, cz, index)),
+                                  (pos[0] - halfSize, pos[1] + bottom, pos[2] - halfSize),
+                                  (pos[0] + halfSize, pos[1] + top, pos[2] + halfSize)))
+        cells = []
+        for j in range(self.cellsPerSide):
+            for i in range(self.cellsPerSide):
+                if cellObjects[j][i]:
+                    bounds = (minX + i * cellSize, minZ + j * cellSize, minX + (i + 1) * cellSize, minZ + (j + 1) * cellSize)
+                    cells.append(Cell(bounds, cellObjects[j][i], self._cellBox(cellObjects[j][i])))
+        return Chunk(coords, (minX, minZ, maxX, maxZ), objects, cells, BVH(items))
+
+    def _cellBox(self, objects):
+        corners = []
+        for key, positions in objects.items():
+            halfSize, bottom, top = self.drawBounds.get(key, (0.0, 0.0, 0.0))
+            for x, y, z in positions:
+                corners.append((x - halfSize, y + bottom, z - halfSize))
+                corners.append((x + halfSize, y + top, z + halfSize))
+        return tuple(min(c[axis] for c in corners) for axis in range(3)) + \
+            tuple(max(c[axis] for c in corners) for axis in range(3))
+
+    def neededCoords(self, position):
+        """Chunk coordinates within the view radius of position, nearest first."""
+        cx, cz = self.chunkCoords(position[0], position[2])
+        radius = self.viewRadius
+        coords = [(cx + i, cz + j) for i in range(-radius, radius + 1) for j in range(-radius, radius + 1)]
+        coords.sort(key=lambda c: (c[0] - cx) ** 2 + (c[1] - cz) ** 2)
+        return coords
+
+    def _add(self, chunk):
+        self.chunks[chunk.coords] = chunk
+        self.byteSize += chunk.byteSize
+        self.stats['generated'] += 1
+
+    def _touch(self, coords):
+        chunk = self.chunks[coords]
+        chunk.lastUsed = self.frame
+        self.chunks.move_to_end(coords)
+        return chunk
+
+    def update(self, position):
+        """Schedules generation around position, collects finished chunks and evicts far ones."""
+        self.frame += 1
+        for coords, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[coords]
+                self._add(future.result())
+        needed = self.neededCoords(position)
+        for coords in needed:
+            if coords in self.chunks:
+                self._touch(coords)
+            elif self.executor is None:
+                self._add(self.generate(coords))
+                self._touch(coords)
+            elif coords not in self.pending:
+                self.pending[coords] = self.executor.submit(self.generate, coords)
+        self.evict(set(needed))
+
+    def evict(self, keep=()):
+        """Drops least recently used chunks (never those in keep) until within the memory budget.
+
+        If that is not enough, releases the display lists of cells other than
+        the one each cell is drawn with, least recently used chunks first.
+        """
+        for coords in list(self.chunks):
+            if self.byteSize <= self.memoryBudget:
+                return
+            if coords in keep:
+                continue
+            chunk = self.chunks.pop(coords)
+            lists = chunk.lists()
+            self.byteSize -= chunk.byteSize + chunk.listBytes()
+            self.releasedLists.extend(lists)
+            self.stats['lists'] -= len(lists)
+            self.stats['evicted'] += 1
+        for chunk in self.chunks.values():
+            for cell in chunk.cells:
+                if self.byteSize <= self.memoryBudget:
+                    return
+                for key, listId in list(cell.lists.items()):
+                    if listId != cell.listId:
+                        del cell.lists[key]
+                        del cell.vertices[listId]
+                        self.releasedLists.append(listId)
+                        self.byteSize -= cell.count * BYTES_PER_LIST_PROP
+                        self.stats['lists'] -= 1
+                        self.stats['released'] += 1
+
+    def chunkAt(self, x, z):
+        """The chunk containing (x, z), generated synchronously if it is not loaded yet."""
+        coords = self.chunkCoords(x, z)
+        if coords in self.chunks:
+            return self._touch(coords)
+        future = self.pending.pop(coords, None)
+        self._add(future.result() if future is not None else self.generate(coords))
+        return self._touch(coords)
+
+    def preload(self, position):
+        """Synchronously generates every chunk in view of position."""
+        for coords in self.neededCoords(position):
+            self.chunkAt(coords[0] * self.chunkSize, coords[1] * self.chunkSize)
+
+    def sync(self):
+        """Deletes the display lists of evicted chunks (must run on the rendering thread)."""
+        for listId in self.releasedLists:
+            glDeleteLists(listId, 1)
+        del self.releasedLists[:]
+
+    def clear(self):
+        """Forgets every chunk, e.g. after changing the density."""
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        for chunk in self.chunks.values():
+            self.releasedLists.extend(chunk.lists())
+        self.chunks.clear()
+        self.byteSize = 0
+        self.stats['lists'] = 0
+
+    def _compilesThisFrame(self):
+        if self.compileFrame != self.frame:
+            self.compileFrame, self.frameCompiles = self.frame, 0
+        return self.frameCompiles
+
+    def _listKey(self, levels):
+        return tuple(levels[index] for index in self.lodIndices)
+
+    def _compileCell(self, cell, levels, listKey):
+        listId = glGenLists(1)
+        vertices = 0
+        glNewList(listId, GL_COMPILE)
+        for key, level in zip(self.propKeys, levels):
+            propList = self.propLevels[key][level]
+            if propList is None:
+                continue
+            positions = cell.objects.get(key, ())
+            vertices += len(positions) * self.listVertices.get(propList, 0)
+            for pos in positions:
+                glPushMatrix()
+                glTranslatef(pos[0], pos[1], pos[2])
+                glCallList(propList)
+                glPopMatrix()
+        glEndList()
+        self._compilesThisFrame()
+        self.frameCompiles += 1
+        cell.lists[listKey] = listId
+        cell.vertices[listId] = vertices
+        self.byteSize += cell.count * BYTES_PER_LIST_PROP
+        self.stats['compiled'] += 1
+        self.stats['lists'] += 1
+        return listId
+
+    def visibleCells(self, eye, cullingDistance, pixelsPerUnit, maxCompiles=None):
+        """Cells within cullingDistance of eye, each with listId set to the display list to draw.
+
+        At most maxCompiles new lists are compiled per frame (counting those
+        compiled by casterList()); beyond that a cell keeps its previous levels
+        until a later frame (cells that have never been drawn are always compiled).
+        """
+        cullingDistSq = cullingDistance ** 2
+        select = self.lodSelector.select
+        sizes = [self.propSizes[key] for key in self.propKeys]
+        noLevels = (None,) * len(self.propKeys)
+        cells = []
+        visible = culled = 0
+        for chunk in self.chunks.values():
+            if chunk.distanceSq(eye[0], eye[2]) >= cullingDistSq:
+                culled += chunk.count
+                continue
+            for cell in chunk.cells:
+                distanceSq = _distanceSq(cell.bounds, eye[0], eye[2])
+                if distanceSq >= cullingDistSq:
+                    culled += cell.count
+                    continue
+                distance = math.sqrt(distanceSq)
+                levels = tuple(select(projectedSize(size, distance, pixelsPerUnit), previous)
+                               for size, previous in zip(sizes, cell.levels or noLevels))
+                listKey = self._listKey(levels)
+                listId = cell.lists.get(listKey)
+                if listId is None:
+                    if cell.listId is not None and maxCompiles is not None and \
+                            self._compilesThisFrame() >= maxCompiles:
+                        levels, listId = cell.levels, cell.listId
+                    else:
+                        listId = self._compileCell(cell, levels, listKey)
+                cell.levels, cell.listId = levels, listId
+                visible += cell.count
+                cells.append(cell)
+        self.stats['visible'], self.stats['culled'] = visible, culled
+        return cells
+
+    def drawCell(self, cell):
+        glCallList(cell.listId)
+
+    def loadedCells(self):
+        for chunk in self.chunks.values():
+            for cell in chunk.cells:
+                yield cell
+
+    def casterList(self, cell, levels, maxCompiles=None):
+        """Display list for drawing cell into a shadow map, None if that would exceed maxCompiles this frame.
+
+        A cell casts with the list it was last drawn with; cells that have not
+        been drawn yet use (and if necessary compile) the list for levels.
+        """
+        if cell.listId is not None:
+            return cell.listId
+        listKey = self._listKey(levels)
+        listId = cell.lists.get(listKey)
+        if listId is None:
+            if maxCompiles is not None and self._compilesThisFrame() >= maxCompiles:
+                return None
+            listId = self._compileCell(cell, levels, listKey)
+        return listId
+
+    def objectsNear(self, x, z, radius):
+        """Yields (key, position) for every prop in chunks overlapping the square around (x, z)."""
+        minX, minZ = self.chunkCoords(x - radius, z - radius)
+        maxX, maxZ = self.chunkCoords(x + radius, z + radius)
+        for cx in range(minX, maxX + 1):
+            for cz in range(minZ, maxZ + 1):
+                chunk = self.chunkAt(cx * self.chunkSize, cz * self.chunkSize)
+                for key, positions in chunk.objects.items():
+                    for pos in positions:
+                        yield key, pos
+
+    def propArrays(self):
+        """{coords: {type: flat x, y, z doubles}} of every loaded or stored chunk."""
+        arrays = dict(self.stored)
+        for coords, chunk in self.chunks.items():
+            if coords not in arrays:
+                arrays[coords] = dict((key, array('d', [value for pos in positions for value in pos]))
+                                      for key, positions in chunk.objects.items())
+        return arrays
+
+    def pickingScenes(self):
+        return [chunk.pickingScene for chunk in self.chunks.values()]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
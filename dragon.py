@@ -1,6 +1,10 @@
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
+from OpenGL.GL.primitives import solidSphere, solidCube
+from OpenGL.GL.statecache import getStateCache
+from particles import createParticleSystem
+from lod import pixelsPerUnit
 import math
 import random
 import time
@@ -22,7 +26,7 @@ right_mouse_dragging = False
 wing_angle = 0
 jaw_angle = 0.0
 fireballs = []
-embers = []
+embers = None  # particle system, created in init()
 last_time = 0
 delta_time = 0
 
@@ -44,7 +48,7 @@ class Dragon:
         glPushMatrix()
         glTranslatef(*position)
         glScalef(*scale)
-        glutSolidCube(1)
+        solidCube(1)
         glPopMatrix()
 
     def draw_pyramid(self, scale=(1, 1, 1), position=(0, 0, 0)):
@@ -75,7 +79,11 @@ class Dragon:
         """Draws a sphere."""
         glPushMatrix()
         glTranslatef(*position)
-        glutSolidSphere(radius, 20, 20)
+        # the cached unit sphere is scaled up, keep its normals unit length for lighting
+        state = getStateCache()
+        state.enable(GL_RESCALE_NORMAL)
+        solidSphere(radius, 20, 20)
+        state.disable(GL_RESCALE_NORMAL)
         glPopMatrix()
 
     def draw_spine(self):
@@ -311,8 +319,9 @@ def create_fireball():
 
 def update_fireballs_and_embers(delta_time):
     """Updates fireballs and spawns embers from them."""
-    global fireballs, embers
+    global fireballs
     gravity = 9.8
+    ember_spawns = []
     # Update fireballs
     for p in fireballs:
         for i in range(3):
@@ -324,16 +333,11 @@ def update_fireballs_and_embers(delta_time):
             vel_spread = 0.2
             ember_vel = [
                 p['vel'][i]*0.1 + random.uniform(-vel_spread, vel_spread) for i in range(3)]
-            embers.append(
-                {'pos': p['pos'][:], 'vel': ember_vel, 'life': 0.8, 'max_life': 0.8})
+            ember_spawns.append((p['pos'][:], ember_vel, 0.8))
     fireballs = [p for p in fireballs if p['life'] > 0]
     # Update embers
-    for p in embers:
-        for i in range(3):
-            p['pos'][i] += p['vel'][i] * delta_time
-        p['vel'][1] -= gravity * 0.5 * delta_time
-        p['life'] -= delta_time
-    embers = [p for p in embers if p['life'] > 0]
+    embers.emit(ember_spawns)
+    embers.update(delta_time, gravity * 0.5)
 
 
 def draw_billboard_particles(particles, modelview_matrix):
@@ -365,10 +369,11 @@ def draw_billboard_particles(particles, modelview_matrix):
 
 def draw_fire_and_embers(modelview_matrix):
     """Main drawing function for all fire effects."""
-    glDisable(GL_LIGHTING)
-    glEnable(GL_BLEND)
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE)
-    glDepthMask(GL_FALSE)
+    state = getStateCache()
+    state.disable(GL_LIGHTING)
+    state.enable(GL_BLEND)
+    state.blendFunc(GL_SRC_ALPHA, GL_ONE)
+    state.depthMask(False)
 
     # Draw main fireball clouds
     fire_particles = []
@@ -387,23 +392,20 @@ def draw_fire_and_embers(modelview_matrix):
     if fire_particles:
         draw_billboard_particles(fire_particles, modelview_matrix)
 
-    # Draw embers
-    ember_particles = []
-    for p in embers:
-        ember_particles.append({'pos': p['pos'], 'life': p['life'], 'max_life': p['max_life'],
-                                'size': 0.1, 'color': (1.0, 0.4, 0.0)})
-    if ember_particles:
-        draw_billboard_particles(ember_particles, modelview_matrix)
+    # Draw embers as point sprites
+    pixel_scale = pixelsPerUnit(glGetIntegerv(GL_VIEWPORT)[3], 45)
+    embers.draw(pixel_scale, 0.1, (1.0, 0.4, 0.0))
 
-    glDepthMask(GL_TRUE)
-    glDisable(GL_BLEND)
-    glEnable(GL_LIGHTING)
+    state.depthMask(True)
+    state.disable(GL_BLEND)
+    state.enable(GL_LIGHTING)
 
 # --- Drawing and Scene Functions ---
 
 
 def draw_ground():
-    glDisable(GL_LIGHTING)
+    state = getStateCache()
+    state.disable(GL_LIGHTING)
     glColor3f(0.3, 0.3, 0.3)
     glBegin(GL_LINES)
     for i in range(-20, 21):
@@ -412,13 +414,13 @@ def draw_ground():
         glVertex3f(-20, -5, i)
         glVertex3f(20, -5, i)
     glEnd()
-    glEnable(GL_LIGHTING)
+    state.enable(GL_LIGHTING)
 
 
 def display():
     """Main display callback function."""
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    glMatrixMode(GL_MODELVIEW)
+    getStateCache().matrixMode(GL_MODELVIEW)
     glLoadIdentity()
 
     glTranslatef(0.0, 0.0, camera_zoom)
@@ -434,7 +436,7 @@ def display():
                 head_rot_x, head_rot_y, jaw_angle)
     glPopMatrix()
 
-    if fireballs or embers:
+    if fireballs or embers.alive:
         draw_fire_and_embers(modelview_matrix)
 
     glutSwapBuffers()
@@ -446,7 +448,7 @@ def reshape(w, h):
     if h == 0:
         h = 1
     glViewport(0, 0, w, h)
-    glMatrixMode(GL_PROJECTION)
+    getStateCache().matrixMode(GL_PROJECTION)
     glLoadIdentity()
     gluPerspective(45, (w / h), 0.1, 100.0)
 
@@ -520,16 +522,18 @@ def motion(x, y):
 
 
 def init():
-    global last_time
+    global last_time, embers
     glClearColor(0.5, 0.7, 0.9, 1.0)
-    glEnable(GL_DEPTH_TEST)
-    glEnable(GL_LIGHTING)
-    glEnable(GL_LIGHT0)
-    glEnable(GL_COLOR_MATERIAL)
+    state = getStateCache()
+    state.enable(GL_DEPTH_TEST)
+    state.enable(GL_LIGHTING)
+    state.enable(GL_LIGHT0)
+    state.enable(GL_COLOR_MATERIAL)
     glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
     glLightfv(GL_LIGHT0, GL_POSITION, [0, 15, -5, 1])
     glLightfv(GL_LIGHT0, GL_DIFFUSE, [1.0, 1.0, 1.0, 1.0])
     glLightfv(GL_LIGHT0, GL_AMBIENT, [0.8, 0.8, 0.8, 1.0])
+    embers = createParticleSystem(100000)
     last_time = time.time()
 
 
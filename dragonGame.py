@@ -1,24 +1,52 @@
+import atexit
 import sys
 import math
 import random
 import time
+import zlib
+from collections import deque
 
 try:
     from OpenGL.GL import *
     from OpenGL.GLU import *
     from OpenGL.GLUT import *
+    from OpenGL.GL.picking import BVH, pick
+    from OpenGL.GL.statecache import getStateCache
+    from OpenGL.GL.primitives import Mesh, solidSphere, solidCube, getMeshCache
+    from OpenGL.GL.shadows import CascadedShadowMap
+    from OpenGL.GL import framebufferobjects
+    from OpenGL.GL.rendertargets import (getRenderTargetPool, PostPass, PostProcessChain, PASS_VERTEX_SHADER,
+                                         SHARPEN_SHADER)
+    from OpenGL.GL.shaders import compileProgram, compileShader
+    from OpenGL.error import NullFunctionError, GLError
+    from OpenGL.arrays import GLfloatArray
+    from renderQueue import RenderQueue
+    from frameStats import FrameStats
+    from chunkWorld import ChunkedWorld
+    from terrain import HeightField, Terrain
+    from lod import LodSelector, Impostor, pixelsPerUnit, projectedSize
+    from textAtlas import TextRenderer, builtinFont, glutFont, glutAvailable
+    from dynamicResolution import GpuTimer, ResolutionController
+    from particles import createParticleSystem
+    from occlusion import OcclusionCuller
+    from events import EventBus, EventLogger
+    from inputLog import InputRecorder, InputPlayer, KEY_DOWN, KEY_UP, MOUSE_BUTTON, MOUSE_LOOK
+    from snapshot import writeSnapshot, readSnapshot
 except ImportError:
     print("PyOpenGL and GLUT are required to run this program.")
     sys.exit(1)
 
 # --- Constants ---
 WINDOW_WIDTH, WINDOW_HEIGHT = 1280, 720
-WORLD_SIZE = 100
+WORLD_SIZE = 100  # dragons, bombs and hearts spawn within this distance of the warrior
+WORLD_SEED = None  # None picks a random seed per run
 CULLING_DISTANCE = 100.0
 WALL_BLOCK_SIZE = 1.5
 TREE_COLLISION_SIZE = 1.0
 SHRUB_COLLISION_SIZE = 2.0
 SKY_COLOR = (0.5, 0.7, 1.0, 1.0)
+GROUND_COLOR = (0.1, 0.6, 0.1)
+FIELD_OF_VIEW = 55
 GRAVITY = 0.025
 
 # --- Gameplay Constants ---
@@ -45,6 +73,76 @@ WALL_SPAWN_CHANCE = 0.40
 WALL_SPAWN_INTERVAL = 5.0
 WALL_SPAWN_DISTANCE = 10.0
 WALL_LIFETIME = 8.0
+USE_STATE_CACHE = True
+# --- Chunk streaming ---
+CHUNK_SIZE = 50.0
+CHUNK_VIEW_RADIUS = 2  # chunks kept loaded in each direction around the warrior
+CHUNK_CELLS_PER_SIDE = 4  # props are batched and LOD-selected per cell
+CHUNK_WORKERS = 2
+CHUNK_MEMORY_BUDGET = 4 * 1024 * 1024
+# --- Terrain ---
+TERRAIN_AMPLITUDE = 8.0
+TERRAIN_FEATURE_SIZE = 80.0
+TERRAIN_TILE_RESOLUTION = 16  # quads along each side of every LOD tile
+TERRAIN_PIXEL_ERROR = 2.0  # tiles are refined until their error is below this many pixels
+TERRAIN_CACHE_TILES = 256
+TERRAIN_BUILDS_PER_FRAME = 4
+# --- Level of detail: projected sizes in pixels where levels 0/1 end ---
+LOD_THRESHOLDS = (240.0, 100.0)
+LOD_HYSTERESIS = 0.2
+LOD_COMPILES_PER_FRAME = 32
+# Size in world units used to estimate each prop's projected size
+PROP_LOD_SIZES = {'trees': 10.0, 'shrubs': 2.5, 'rocks': 1.0, 'random_walls': 3.0}
+DRAGON_LOD_SIZE = 20.0
+# Impostor bounds: (half width, bottom, top) around the prop origin
+TREE_IMPOSTOR_BOUNDS = (2.8, -0.5, 9.0)
+SHRUB_IMPOSTOR_BOUNDS = (1.5, -1.25, 1.0)
+# --- Picking bounds: (half width, bottom offset, top offset) ---
+PICK_BOUNDS = {'trees': (2.0, 0.0, 9.0), 'rocks': (0.5, -0.5, 0.5), 'shrubs': (1.5, -1.0, 1.0),
+               'random_walls': (0.75, -0.75, 2.25)}
+DRAGON_PICK_SIZE = 5.0
+# Drawn extents of the props (half width, bottom, top), enclosing every LOD level
+PROP_DRAW_BOUNDS = {'trees': TREE_IMPOSTOR_BOUNDS, 'shrubs': SHRUB_IMPOSTOR_BOUNDS, 'rocks': (0.5, -0.5, 0.5),
+                    'random_walls': (0.75, -0.75, 2.25)}
+OCCLUSION_QUERY_INTERVAL = 4  # frames a visible cell is trusted before it is tested again
+# --- Sun light and shadows ---
+SUN_DIRECTION = (0.4, 1.0, 0.3)  # towards the sun
+SHADOW_CASCADES = (50.0, 200.0)  # width of the area around the camera covered by each cascade
+SHADOW_MAP_SIZE = 1024
+SHADOW_PROP_LEVEL = 1  # props cast shadows with their LOD 1 geometry
+# --- Frame stats overlay ---
+STATS_GRAPH_WIDTH = 240
+STATS_GRAPH_HEIGHT = 80
+STATS_GRAPH_MAX_MS = 50.0
+# --- Text ---
+BUILTIN_TEXT_SIZE = 2  # the built-in 5x7 font is scaled up to roughly match Helvetica 18
+TEXT_CACHE_SIZE = 512  # distinct strings kept laid out in vertex buffers
+# --- Dynamic resolution: the scene is rendered smaller and upscaled to hold the frame budget ---
+FRAME_BUDGET_MS = 1000.0 / 30
+RENDER_SCALE_MIN = 0.5
+RENDER_SCALE_MAX = 1.0
+SHARPEN_STRENGTH = 0.4
+
+EMBER_CAPACITY = 100000
+EMBER_LIFE = 0.8
+EMBER_SIZE = 0.1
+EMBER_COLOR = (1.0, 0.4, 0.0)
+# --- Gameplay events ---
+EVENT_QUEUE_SIZE = 1024  # events raised in one tick beyond this are dropped
+PLAYER_HIT, PLAYER_HEALED, PLAYER_DIED = 'playerHit', 'playerHealed', 'playerDied'
+DRAGON_HIT, DRAGON_DEFEATED, DRAGON_EVADING, DRAGON_SPAWNED = 'dragonHit', 'dragonDefeated', 'dragonEvading', 'dragonSpawned'
+BOMB_TRIGGERED, BOMB_EXPLODED, WALL_SPAWNED = 'bombTriggered', 'bombExploded', 'wallSpawned'
+EVENT_MESSAGES = {PLAYER_HIT: "Player hit! Health: {value}", PLAYER_HEALED: "Player healed! Health: {value}",
+                  PLAYER_DIED: "Game Over!", DRAGON_HIT: "Dragon hit! Health: {value}",
+                  DRAGON_DEFEATED: "Dragon defeated!", DRAGON_EVADING: "Dragon evading!",
+                  DRAGON_SPAWNED: "A new dragon has appeared!", BOMB_TRIGGERED: "Bomb triggered!",
+                  BOMB_EXPLODED: "Boom!", WALL_SPAWNED: "A blocking wall appears!"}
+HUD_EVENTS = (PLAYER_HEALED, DRAGON_DEFEATED, DRAGON_SPAWNED, BOMB_TRIGGERED, WALL_SPAWNED)
+HUD_MESSAGE_LINES = 4
+HUD_MESSAGE_TIME = 3.0  # seconds a message stays on screen
+# --- Snapshots ---
+SNAPSHOT_FILE = 'dragonGame.snapshot'  # saved with N, restored with M
+DRAGON_RENDER_STATE = ('detail', 'lodLevel')  # Dragon attributes set while drawing, not simulated
 
 # --- Global State Variables ---
 camera = None
@@ -53,23 +151,59 @@ dragons = [] # --- MODIFIED FOR MULTIPLE DRAGONS ---
 keys = {b'w': False, b's': False, b'a': False, b'd': False,
         b' ': False, b'x': False, b'c': False, b'r': False}
 lastMousePos = {'x': 0, 'y': 0}
+lodSelector = LodSelector(LOD_THRESHOLDS, LOD_HYSTERESIS)
 isMouseWarping = False
 isControlsLocked = False
 gameOver = False
 
 # --- World and Game Objects ---
+world = None
+terrain = None
 objectPositions = {}
 playerProjectiles = []
 dragonFireballs = []
-embers = []
+embers = None  # ParticleSystem, created once the GL context exists
 bombs = []
 # --- ADDED FOR HEARTS ---
 hearts = []
 # -------------------------
 gameState = {}
+stateCache = None
+renderQueue = None
+modelviewBuffer = None  # reused every frame instead of allocating a new matrix
+cameraMatrices = None  # (modelview, projection, viewport) of the last frame's camera, for picking
+frameStats = None
+showFrameStats = False
+textRenderer = None
+textSize = 1
+renderTargets = None  # None when framebuffer objects are unavailable
+meshCache = None  # the context's unit meshes, kept to release them at exit
+postChain = None
+renderScale = 1.0
+dynamicResolution = True
+gpuTimer = None
+occlusionCuller = None
+shadowMap = None
+sceneProgram = 0  # program for lit opaque geometry, 0 without shadows
+shadowChunks = {}  # coords -> chunk for the chunks whose props are in the cached static shadow depth
+resolutionController = ResolutionController(FRAME_BUDGET_MS, RENDER_SCALE_MIN, RENDER_SCALE_MAX)
+eventBus = EventBus(EVENT_QUEUE_SIZE)  # gameplay events, dispatched once per tick by idle()
+eventLogger = EventLogger(EVENT_MESSAGES)
+hudMessages = deque(maxlen=HUD_MESSAGE_LINES)  # (time shown until, text)
+# --- Simulation clock, randomness and input recording ---
+# The simulation reads the time once per tick and draws from its own generator, so a recorded
+# session (seeds, tick times and input) replays to the same state however it is rendered.
+simTime = time.time()
+clockOffset = 0.0  # added to time.time() to continue the clock of a finished replay
+rng = random.Random(random.randrange(2**32))
+inputRecorder = None
+inputPlayer = None
 
 # --- Display List Handles ---
-LIST_IDS = {'tree': 1, 'rock': 2, 'wall': 3, 'shrub': 4}
+LIST_IDS = {'tree': 1, 'rock': 2, 'wall': 3, 'shrub': 4,
+            'tree_lod1': 5, 'shrub_lod1': 6, 'tree_impostor': 7, 'shrub_impostor': 8}
+LIST_VERTICES = {}  # display list id -> vertices it draws, filled by compileDisplayLists()
+immediateVertices = 0  # vertices drawn by drawCube() so far, including those recorded into display lists
 
 # -----------------------------------------------------------------------------
 # --- Warrior Prince Class (Player) ---
@@ -80,15 +214,7 @@ def drawWarriorCube(scaleX, scaleY, scaleZ):
     """Draws a solid color cube, scaled to the given dimensions."""
     glPushMatrix()
     glScalef(scaleX, scaleY, scaleZ)
-    vertices = [[0.5,  0.5, -0.5], [0.5, -0.5, -0.5], [-0.5, -0.5, -0.5], [-0.5,  0.5, -0.5],
-                [0.5,  0.5,  0.5], [0.5, -0.5,  0.5], [-0.5, -0.5,  0.5], [-0.5,  0.5,  0.5]]
-    faces = [[0, 1, 2, 3], [3, 2, 6, 7], [7, 6, 5, 4],
-             [4, 5, 1, 0], [0, 3, 7, 4], [1, 5, 6, 2]]
-    glBegin(GL_QUADS)
-    for face in faces:
-        for vertexIndex in face:
-            glVertex3fv(vertices[vertexIndex])
-    glEnd()
+    solidCube(1.0)
     glPopMatrix()
 
 
@@ -140,18 +266,18 @@ class Warrior:
     def takeDamage(self, amount):
         if not self.isShieldActive:
             self.health -= amount
-            print(f"Player hit! Health: {self.health}")
+            eventBus.publish(PLAYER_HIT, self.health)
             if self.health <= 0:
                 global gameOver
                 gameOver = True
-                print("Game Over!")
+                eventBus.publish(PLAYER_DIED)
 
     # --- ADDED FOR HEARTS ---
     def heal(self, amount):
         self.health += amount
         if self.health > PLAYER_MAX_HEALTH:
             self.health = PLAYER_MAX_HEALTH
-        print(f"Player healed! Health: {self.health}")
+        eventBus.publish(PLAYER_HEALED, self.health)
     # -------------------------
 
     def update(self):
@@ -407,12 +533,12 @@ class Warrior:
         if not self.isShieldActive:
             return
         glPushMatrix()
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        stateCache.enable(GL_BLEND)
+        stateCache.blendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         glTranslatef(0, 0.5, -4.0)
         glColor4f(0.3, 0.7, 1.0, self.shieldAlpha)
         drawWarriorCube(7, 7, 0.3)
-        glDisable(GL_BLEND)
+        stateCache.disable(GL_BLEND)
         glPopMatrix()
 
 # -----------------------------------------------------------------------------
@@ -432,9 +558,10 @@ class Dragon:
         else:
             self.colorScheme = colorScheme
 
-        self.position = [random.uniform(-WORLD_SIZE/2, WORLD_SIZE/2), 
-                         random.uniform(20, 35), 
-                         random.uniform(-WORLD_SIZE/2, WORLD_SIZE/2)]
+        center = spawnCenter()
+        self.position = [center[0] + rng.uniform(-WORLD_SIZE/2, WORLD_SIZE/2), 
+                         rng.uniform(20, 35), 
+                         center[2] + rng.uniform(-WORLD_SIZE/2, WORLD_SIZE/2)]
         self.health = DRAGON_MAX_HEALTH
         self.isAlive = True
         self.deathTimer = 0
@@ -446,26 +573,29 @@ class Dragon:
         self.headRotX = 0.0
         self.headRotY = 0.0
         self.bodyRotY = 0.0
+        # Level of detail: 0 is full detail, higher levels drop small parts
+        self.detail = 0
+        self.lodLevel = None
         # AI
         self.attackCooldown = 0
         self.targetPosition = list(self.position)
         self.moveTimer = 0
         self.isEvading = False
         self.evadeTimer = 0
-        self.circlingAngle = random.uniform(0, 2 * math.pi)
-        self.circlingDirection = random.choice([-1, 1])
+        self.circlingAngle = rng.uniform(0, 2 * math.pi)
+        self.circlingDirection = rng.choice([-1, 1])
 
     def takeDamage(self, amount):
         if not self.isAlive: return
         self.health -= amount
-        print(f"Dragon hit! Health: {self.health}")
+        eventBus.publish(DRAGON_HIT, self.health, self)
         if self.health <= 0:
             self.isAlive = False
-            self.deathTimer = time.time()
-            print("Dragon defeated!")
+            self.deathTimer = simTime
+            eventBus.publish(DRAGON_DEFEATED, data=self)
 
     def update(self, playerPos, playerProjectiles):
-        currentTime = time.time()
+        currentTime = simTime
         if not self.isAlive:
             if currentTime - self.deathTimer > DRAGON_RESPAWN_TIME:
                 self.respawn()
@@ -489,7 +619,7 @@ class Dragon:
             targetX = playerPos[0] + radius * math.cos(self.circlingAngle)
             targetZ = playerPos[2] + radius * math.sin(self.circlingAngle)
             self.targetPosition = [targetX, 20, targetZ]
-            if random.random() < 0.01:
+            if rng.random() < 0.01:
                 self.circlingDirection *= -1
 
         direction = [self.targetPosition[i] - self.position[i] for i in range(3)]
@@ -511,7 +641,7 @@ class Dragon:
         # Attack AI
         if currentTime > self.attackCooldown and not self.isEvading:
             self.shootFireball()
-            self.attackCooldown = currentTime + random.uniform(2, 4)
+            self.attackCooldown = currentTime + rng.uniform(2, 4)
 
         # Animation
         self.wingAngle = math.sin(currentTime * 5) * 40
@@ -521,7 +651,7 @@ class Dragon:
 
     def evade(self, projectile):
         self.isEvading = True
-        self.evadeTimer = time.time() + 2.0
+        self.evadeTimer = simTime + 2.0
         self.targetPosition[1] += 10
         projVel = projectile['vel']
         sideVec = [-projVel[2], 0, projVel[0]]
@@ -529,7 +659,7 @@ class Dragon:
         if mag > 0:
             self.targetPosition[0] += sideVec[0]/mag * 20
             self.targetPosition[2] += sideVec[2]/mag * 20
-        print("Dragon evading!")
+        eventBus.publish(DRAGON_EVADING, data=self)
 
     def shootFireball(self):
         global dragonFireballs
@@ -550,13 +680,16 @@ class Dragon:
         dragonFireballs.append({'pos': startPos, 'vel': [velX, velY, velZ], 'life': 5.0, 'max_life': 5.0, 'size': 1.0, 'state': 'flying'})
 
     def respawn(self):
-        self.position = [random.uniform(-WORLD_SIZE/2, WORLD_SIZE/2), random.uniform(20, 35), random.uniform(-WORLD_SIZE/2, WORLD_SIZE/2)]
+        center = spawnCenter()
+        self.position = [center[0] + rng.uniform(-WORLD_SIZE/2, WORLD_SIZE/2), rng.uniform(20, 35),
+                         center[2] + rng.uniform(-WORLD_SIZE/2, WORLD_SIZE/2)]
         self.health = DRAGON_MAX_HEALTH
         self.isAlive = True
-        print("A new dragon has appeared!")
+        eventBus.publish(DRAGON_SPAWNED, data=self)
 
-    def draw(self):
+    def draw(self, detail=0):
         if not self.isAlive: return
+        self.detail = detail
         glPushMatrix()
         glTranslatef(self.position[0], self.position[1], self.position[2])
         glRotatef(-self.bodyRotY, 0, 1, 0)
@@ -565,7 +698,8 @@ class Dragon:
         self.drawTorso()
         self.drawNeck()
         self.drawHead(self.breathingOffset, self.headRotX, self.headRotY, self.jawAngle)
-        self.drawLegs()
+        if self.detail < 2:
+            self.drawLegs()
         self.drawTail(self.tailSwayAngle)
         glPushMatrix()
         glTranslatef(1.8, 2.5, 0.5)
@@ -584,7 +718,7 @@ class Dragon:
         glPushMatrix()
         glTranslatef(*position)
         glScalef(*scale)
-        glutSolidCube(1)
+        solidCube(1)
         glPopMatrix()
 
     def drawPyramid(self, scale=(1, 1, 1), position=(0, 0, 0)):
@@ -609,7 +743,7 @@ class Dragon:
     def drawSphere(self, radius=1, position=(0, 0, 0)):
         glPushMatrix()
         glTranslatef(*position)
-        glutSolidSphere(radius, 20, 20)
+        solidSphere(radius, 20 >> self.detail, 20 >> self.detail)
         glPopMatrix()
 
     def drawSpine(self):
@@ -621,8 +755,12 @@ class Dragon:
     def drawTorso(self):
         glColor3f(*self.colorScheme['primary'])
         self.drawCube(scale=(3.5, 3, 5.5), position=(0, 1.5, 0))
+        if self.detail >= 2:
+            return
         glColor3f(*self.colorScheme['secondary'])
         self.drawCube(scale=(4, 3.5, 2), position=(0, 1.5, 1.5))
+        if self.detail >= 1:
+            return
         glColor3f(*self.colorScheme['belly'])
         for i in range(5):
             self.drawCube(scale=(2.5, 0.4, 0.8), position=(0, -0.2, 2.0 - i * 1.0))
@@ -637,6 +775,12 @@ class Dragon:
         glColor3f(*self.colorScheme['primary'])
         self.drawCube(scale=(2, 1.8, 2.5), position=(0, 0, 0))
         self.drawCube(scale=(1.5, 1.2, 2.5), position=(0, -0.2, 2.0))
+        if self.detail >= 1:
+            if self.detail == 1:
+                glColor3f(*self.colorScheme['secondary'])
+                self.drawCube(scale=(1.4, 0.5, 2.3), position=(0, -0.9, 2.0))
+            glPopMatrix()
+            return
         glColor3f(*self.colorScheme['teeth'])
         for i in range(5):
             glPushMatrix()
@@ -697,6 +841,10 @@ class Dragon:
         footZOffset = 0.5
         glRotatef(-20, 1, 0, 0)
         self.drawCube(scale=(1.0, 0.4, 1.5), position=(0, -1.8, footZOffset))
+        if self.detail >= 1:
+            glPopMatrix()
+            glPopMatrix()
+            return
         glColor3f(*self.colorScheme['horn'])
         clawYPos = -1.8
         clawZOffset = 0.8 + footZOffset
@@ -712,13 +860,16 @@ class Dragon:
         glTranslatef(0, 1.5, -2.5)
         glRotatef(swayAngle, 0, 1, 0)
         glRotatef(15, 1, 0, 0)
-        currentTime = time.time()
-        for i in range(8):
+        currentTime = simTime
+        # Fewer, longer segments at lower detail cover the same length
+        step = 1 << self.detail
+        for i in range(0, 8, step):
             scaleFactor = 1.0 - i * 0.08
-            self.drawCube(scale=(1.5*scaleFactor, 1.5*scaleFactor, 1.5))
-            glTranslatef(0, -0.1, -1.4)
-            glRotatef(math.sin(currentTime * 3 + i * 0.8) * 4, 1, 0, 0)
-            glRotatef(math.sin(currentTime * 2 + i * 0.5) * 5, 0, 1, 0)
+            glTranslatef(0, 0, -0.7 * (step - 1))
+            self.drawCube(scale=(1.5*scaleFactor, 1.5*scaleFactor, 1.5 * step))
+            glTranslatef(0, -0.1 * step, -1.4 * step + 0.7 * (step - 1))
+            glRotatef(math.sin(currentTime * 3 + i * 0.8) * 4 * step, 1, 0, 0)
+            glRotatef(math.sin(currentTime * 2 + i * 0.5) * 5 * step, 0, 1, 0)
         glColor3f(*self.colorScheme['horn'])
         self.drawPyramid(scale=(0.5, 1.0, 0.5), position=(0, 0, 0))
         glPopMatrix()
@@ -751,6 +902,9 @@ class Dragon:
             glVertex3fv(sparEndpoints[i])
             glVertex3fv(sparEndpoints[i+1])
         glEnd()
+        if self.detail >= 2:
+            glPopMatrix()
+            return
         glColor3f(*self.colorScheme['primary'])
         for i, spar in enumerate(sparDefinitions):
             glPushMatrix()
@@ -776,15 +930,16 @@ class Camera:
         self.thirdPersonElevation = 15.0
 
     def isColliding(self, nextPos):
-        collidableTypes = {'boundary_walls': WALL_BLOCK_SIZE, 'random_walls': WALL_BLOCK_SIZE, 'trees': TREE_COLLISION_SIZE, 'shrubs': SHRUB_COLLISION_SIZE, 'temp_walls': WALL_BLOCK_SIZE}
-        for objKey, objSize in collidableTypes.items():
-            positions = objectPositions.get(objKey, [])
-            if objKey == 'temp_walls':
-                positions = [item['pos'] for item in positions]
-            for objPos in positions:
-                if (nextPos[0] + self.playerRadius > objPos[0] - objSize / 2 and nextPos[0] - self.playerRadius < objPos[0] + objSize / 2 and
-                        nextPos[2] + self.playerRadius > objPos[2] - objSize / 2 and nextPos[2] - self.playerRadius < objPos[2] + objSize / 2):
-                    return True
+        collidableTypes = {'random_walls': WALL_BLOCK_SIZE, 'trees': TREE_COLLISION_SIZE, 'shrubs': SHRUB_COLLISION_SIZE, 'temp_walls': WALL_BLOCK_SIZE}
+        nearby = list(world.objectsNear(nextPos[0], nextPos[2], self.playerRadius + SHRUB_COLLISION_SIZE))
+        nearby += [('temp_walls', item['pos']) for item in objectPositions.get('temp_walls', [])]
+        for objKey, objPos in nearby:
+            objSize = collidableTypes.get(objKey)
+            if objSize is None:
+                continue
+            if (nextPos[0] + self.playerRadius > objPos[0] - objSize / 2 and nextPos[0] - self.playerRadius < objPos[0] + objSize / 2 and
+                    nextPos[2] + self.playerRadius > objPos[2] - objSize / 2 and nextPos[2] - self.playerRadius < objPos[2] + objSize / 2):
+                return True
         return False
 
     def update(self):
@@ -818,6 +973,7 @@ class Camera:
         if magnitude > 0:
             warrior.rotationY = - \
                 math.degrees(math.atan2(-moveVec[2], -moveVec[0])) + 90
+        groundBefore = terrain.heightAt(warrior.position[0], warrior.position[2])
         nextPosX = [warrior.position[0] + moveVec[0],
                       warrior.position[1], warrior.position[2]]
         if not self.isColliding(nextPosX):
@@ -826,25 +982,16 @@ class Camera:
                       warrior.position[2] + moveVec[2]]
         if not self.isColliding(nextPosZ):
             warrior.position[2] += moveVec[2]
-        if warrior.position[1] < 1.0:
-            warrior.position[1] = 1.0
-
-    def handleMouse(self, x, y):
-        global isMouseWarping, lastMousePos
-        if isMouseWarping:
-            isMouseWarping = False
-            lastMousePos['x'], lastMousePos['y'] = x, y
-            return
-        dx, dy = x - lastMousePos['x'], y - lastMousePos['y']
+        # Follow the ground, keeping any height gained with X/C
+        ground = terrain.heightAt(warrior.position[0], warrior.position[2])
+        warrior.position[1] += ground - groundBefore
+        if warrior.position[1] < ground + 1.0:
+            warrior.position[1] = ground + 1.0
+
+    def turn(self, dx, dy):
         self.rotation[0] += dx * self.sensitivity
         self.rotation[1] = max(-89.0, min(89.0,
                                          self.rotation[1] - dy * self.sensitivity))
-        centerX, centerY = WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2
-        if abs(x - centerX) > 200 or abs(y - centerY) > 200:
-            isMouseWarping = True
-            glutWarpPointer(centerX, centerY)
-        else:
-            lastMousePos['x'], lastMousePos['y'] = x, y
 
     def getCameraForwardVector(self):
         yawRad = math.radians(self.rotation[0])
@@ -855,8 +1002,8 @@ class Camera:
         mag = math.sqrt(x*x + y*y + z*z)
         return [x/mag, y/mag, z/mag]
 
-    def look(self):
-        glLoadIdentity()
+    def place(self):
+        """Moves the camera to follow the warrior, returns the point it looks at."""
         if self.isThirdPerson:
             camX = warrior.position[0] - self.thirdPersonDistance * math.sin(math.radians(
                 self.rotation[0])) * math.cos(math.radians(self.thirdPersonElevation))
@@ -866,18 +1013,19 @@ class Camera:
                 self.rotation[0])) * math.cos(math.radians(self.thirdPersonElevation))
             self.position = [camX, camY, camZ]
             lookTargetY = warrior.position[1] + 1.5
-            gluLookAt(camX, camY, camZ,
-                      warrior.position[0], lookTargetY, warrior.position[2], 0, 1, 0)
-        else:
-            pitchRad, yawRad = math.radians(
-                self.rotation[1]), math.radians(self.rotation[0])
-            camPos = [warrior.position[0],
-                       warrior.position[1] + 4.0, warrior.position[2]]
-            self.position = camPos
-            lookAtPoint = [camPos[0] + math.sin(yawRad) * math.cos(pitchRad), camPos[1] + math.sin(
-                pitchRad), camPos[2] - math.cos(yawRad) * math.cos(pitchRad)]
-            gluLookAt(camPos[0], camPos[1], camPos[2], lookAtPoint[0],
-                      lookAtPoint[1], lookAtPoint[2], 0, 1, 0)
+            return [warrior.position[0], lookTargetY, warrior.position[2]]
+        pitchRad, yawRad = math.radians(
+            self.rotation[1]), math.radians(self.rotation[0])
+        camPos = [warrior.position[0],
+                   warrior.position[1] + 4.0, warrior.position[2]]
+        self.position = camPos
+        return [camPos[0] + math.sin(yawRad) * math.cos(pitchRad), camPos[1] + math.sin(
+            pitchRad), camPos[2] - math.cos(yawRad) * math.cos(pitchRad)]
+
+    def look(self):
+        glLoadIdentity()
+        target = self.place()
+        gluLookAt(self.position[0], self.position[1], self.position[2], target[0], target[1], target[2], 0, 1, 0)
 
 # -----------------------------------------------------------------------------
 # --- World Generation and Drawing ---
@@ -890,12 +1038,16 @@ def drawCube(size, colors):
                 [-s, -s, -s], [s, -s, -s], [s, s, -s], [-s, s, -s]]
     faces = [(0, 1, 2, 3), (1, 5, 6, 2), (5, 4, 7, 6),
              (4, 0, 3, 7), (3, 2, 6, 7), (4, 5, 1, 0)]
+    normals = [(0, 0, 1), (1, 0, 0), (0, 0, -1), (-1, 0, 0), (0, 1, 0), (0, -1, 0)]
+    global immediateVertices
     glBegin(GL_QUADS)
     for i, face in enumerate(faces):
         glColor3fv(colors[i % len(colors)])
+        glNormal3fv(normals[i])
         for vIdx in face:
             glVertex3fv(vertices[vIdx])
     glEnd()
+    immediateVertices += 4 * len(faces)
 
 
 def drawTreeGeometry(): glPushMatrix(); trunkColor = [(0.4, 0.2, 0.0)]*6; trunkSize = 1.0; [(drawCube(trunkSize, trunkColor), glTranslatef(0, trunkSize, 0)) for _ in range(5)]; leafColors = [(0.0, 0.5, 0.0), (0.0, 0.6, 0.0)]; glTranslatef(0, 2, 0); drawCube(
@@ -906,6 +1058,16 @@ def drawWallGeometry(): glPushMatrix(); wallColors = [(0.6, 0.6, 0.6), (0.55, 0.
     WALL_BLOCK_SIZE, wallColors); glTranslatef(0, WALL_BLOCK_SIZE, 0); drawCube(WALL_BLOCK_SIZE, wallColors); glPopMatrix()
 
 
+def drawTreeLod1Geometry():
+    # One trunk box and one box around all the leaf cubes
+    glPushMatrix(); glTranslatef(0, 2.0, 0); glScalef(1, 5, 1); drawCube(1, [(0.4, 0.2, 0.0)]); glPopMatrix()
+    glPushMatrix(); glTranslatef(0, 6.9, 0); glScalef(5.5, 4.2, 5.5); drawCube(1, [(0.0, 0.5, 0.0), (0.0, 0.6, 0.0)]); glPopMatrix()
+
+
+def drawShrubLod1Geometry():
+    glPushMatrix(); glTranslatef(0, -0.15, 0); glScalef(3.0, 2.2, 3.0); drawCube(1, [(0.1, 0.4, 0.1), (0.1, 0.5, 0.1)]); glPopMatrix()
+
+
 def drawShrubGeometry(): glPushMatrix(); leafColors = [(0.1, 0.4, 0.1), (0.1, 0.5, 0.1)]; drawCube(2.0, leafColors); glTranslatef(0.75, -0.5, 0); drawCube(
     1.5, leafColors); glTranslatef(-1.5, 0, 0); drawCube(1.5, leafColors); glTranslatef(0.75, 0.5, 0.75); drawCube(1.5, leafColors); glTranslatef(0, 0, -1.5); drawCube(1.5, leafColors); glPopMatrix()
 
@@ -917,44 +1079,31 @@ def drawHeartGeometry():
     glPushMatrix()
     glTranslatef(0, s, 0)
     glScalef(s, s * 3, s)
-    glutSolidCube(1.0)
+    solidCube(1.0)
     glPopMatrix()
     glPushMatrix()
     glTranslatef(-s, s * 1.5, 0)
     glScalef(s, s * 2, s)
-    glutSolidCube(1.0)
+    solidCube(1.0)
     glPopMatrix()
     glPushMatrix()
     glTranslatef(s, s * 1.5, 0)
     glScalef(s, s * 2, s)
-    glutSolidCube(1.0)
+    solidCube(1.0)
     glPopMatrix()
     glPushMatrix()
     glTranslatef(-s * 2, s * 2, 0)
     glScalef(s, s, s)
-    glutSolidCube(1.0)
+    solidCube(1.0)
     glPopMatrix()
     glPushMatrix()
     glTranslatef(s * 2, s * 2, 0)
     glScalef(s, s, s)
-    glutSolidCube(1.0)
+    solidCube(1.0)
     glPopMatrix()
     glPopMatrix()
 
 
-def drawGround(): glColor3f(0.1, 0.6, 0.1); glBegin(GL_QUADS); glVertex3f(-WORLD_SIZE, 0, -WORLD_SIZE); glVertex3f(-WORLD_SIZE,
-                                                                                                                     0, WORLD_SIZE); glVertex3f(WORLD_SIZE, 0, WORLD_SIZE); glVertex3f(WORLD_SIZE, 0, -WORLD_SIZE); glEnd()
-
-
-def drawPlayerProjectiles():
-    for p in playerProjectiles:
-        glPushMatrix()
-        glTranslatef(p['pos'][0], p['pos'][1], p['pos'][2])
-        glColor3f(0.2, 1.0, 0.8)
-        glutSolidSphere(0.2, 10, 10)
-        glPopMatrix()
-
-
 def drawBillboardParticles(particles, modelviewMatrix):
     camRight = [modelviewMatrix[0][0],
                  modelviewMatrix[1][0], modelviewMatrix[2][0]]
@@ -979,9 +1128,7 @@ def drawBillboardParticles(particles, modelviewMatrix):
 
 
 def drawFireAndEmbers(modelviewMatrix):
-    glEnable(GL_BLEND)
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE)
-    glDepthMask(GL_FALSE)
+    """Draws fireball and ember billboards; blend and depth-mask state come from the render queue."""
     fireParticles = []
     
     flyingFireballs = [p for p in dragonFireballs if p.get('state', 'flying') == 'flying']
@@ -998,26 +1145,19 @@ def drawFireAndEmbers(modelviewMatrix):
     if fireParticles:
         drawBillboardParticles(fireParticles, modelviewMatrix)
     
-    emberParticles = []
-    for p in embers:
-        emberParticles.append({'pos': p['pos'], 'life': p['life'], 'max_life': p['max_life'], 'size': 0.1, 'color': (1.0, 0.4, 0.0)})
-    
-    if emberParticles:
-        drawBillboardParticles(emberParticles, modelviewMatrix)
-    
-    glDepthMask(GL_TRUE)
-    glDisable(GL_BLEND)
+    embers.draw(pixelsPerUnit(WINDOW_HEIGHT, FIELD_OF_VIEW), EMBER_SIZE, EMBER_COLOR)
+    frameStats.add('vertices', 4 * len(fireParticles) + embers.alive)
 
 
 def drawUi():
-    glMatrixMode(GL_PROJECTION)
+    stateCache.matrixMode(GL_PROJECTION)
     glPushMatrix()
     glLoadIdentity()
     gluOrtho2D(0, WINDOW_WIDTH, 0, WINDOW_HEIGHT)
-    glMatrixMode(GL_MODELVIEW)
+    stateCache.matrixMode(GL_MODELVIEW)
     glPushMatrix()
     glLoadIdentity()
-    glDisable(GL_DEPTH_TEST)
+    stateCache.disable(GL_DEPTH_TEST)
     # Health bars
     glColor3f(1, 0, 0)
     glRectf(10, WINDOW_HEIGHT - 30, 10 + 200, WINDOW_HEIGHT - 10)
@@ -1045,17 +1185,77 @@ def drawUi():
         drawText("Press 'R' to restart", WINDOW_WIDTH / 2 - 70, WINDOW_HEIGHT/2 - 30)
     if not camera.isThirdPerson:
         drawCrosshair()
-    glEnable(GL_DEPTH_TEST)
-    glMatrixMode(GL_PROJECTION)
+    drawHudMessages()
+    if showFrameStats:
+        drawFrameStats()
+    stateCache.enable(GL_DEPTH_TEST)
+    stateCache.matrixMode(GL_PROJECTION)
     glPopMatrix()
-    glMatrixMode(GL_MODELVIEW)
+    stateCache.matrixMode(GL_MODELVIEW)
     glPopMatrix()
 
 
-def drawText(text, x, y):
-    glWindowPos2f(x, y)
-    for character in text:
-        glutBitmapCharacter(GLUT_BITMAP_HELVETICA_18, ord(character))
+def drawText(text, x, y, dynamic=False):
+    textRenderer.draw(text, x, y, size=textSize, dynamic=dynamic)
+
+
+def showEventOnHud(event):
+    hudMessages.append((time.time() + HUD_MESSAGE_TIME, EVENT_MESSAGES[event.kind].format(value=event.value)))
+
+
+eventBus.subscribe(eventLogger)
+eventBus.subscribe(showEventOnHud, HUD_EVENTS)
+
+
+def drawHudMessages():
+    """Recent gameplay messages, newest first, below the player's health bar."""
+    now = time.time()
+    while hudMessages and hudMessages[0][0] < now:
+        hudMessages.popleft()
+    glColor3f(1, 1, 1)
+    for line, (_, text) in enumerate(reversed(hudMessages)):
+        drawText(text, 10, WINDOW_HEIGHT - 60 - 25 * line)
+
+
+def drawFrameStats():
+    """Draws the frame stats panel and a rolling frame-time graph in the bottom-left corner."""
+    left, bottom = 10, 10
+    stateCache.enable(GL_BLEND)
+    stateCache.blendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    glColor4f(0.0, 0.0, 0.0, 0.5)
+    glRectf(left, bottom, left + STATS_GRAPH_WIDTH + 180, bottom + STATS_GRAPH_HEIGHT + 140)
+    stateCache.disable(GL_BLEND)
+    # Budget lines at 60 and 30 fps
+    glLineWidth(1.0)
+    glBegin(GL_LINES)
+    for budgetMs, color in ((1000.0 / 60, (0.2, 1.0, 0.2)), (1000.0 / 30, (1.0, 1.0, 0.2))):
+        y = bottom + STATS_GRAPH_HEIGHT * budgetMs / STATS_GRAPH_MAX_MS
+        glColor3f(*color)
+        glVertex2f(left, y)
+        glVertex2f(left + STATS_GRAPH_WIDTH, y)
+    glEnd()
+    barWidth = STATS_GRAPH_WIDTH / float(FrameStats.GRAPH_LENGTH)
+    glBegin(GL_QUADS)
+    for i, frameMs in enumerate(frameStats.history):
+        height = STATS_GRAPH_HEIGHT * min(frameMs, STATS_GRAPH_MAX_MS) / STATS_GRAPH_MAX_MS
+        if frameMs > 1000.0 / 30:
+            glColor3f(1.0, 0.2, 0.2)
+        else:
+            glColor3f(0.8, 0.8, 0.8)
+        x = left + i * barWidth
+        glVertex2f(x, bottom)
+        glVertex2f(x + barWidth, bottom)
+        glVertex2f(x + barWidth, bottom + height)
+        glVertex2f(x, bottom + height)
+    glEnd()
+    glColor3f(1.0, 1.0, 1.0)
+    textY = bottom + STATS_GRAPH_HEIGHT + 120
+    textRenderer.begin()
+    for line in frameStats.lines():
+        # the numbers change every frame, stream them rather than caching a buffer per string
+        drawText(line, left + 5, textY, dynamic=True)
+        textY -= 20
+    textRenderer.end()
 
 
 def drawCrosshair():
@@ -1073,33 +1273,40 @@ def drawCrosshair():
 # -----------------------------------------------------------------------------
 
 
+def spawnCenter():
+    """The point spawns are scattered around: the warrior, or the origin before there is one."""
+    return warrior.position if warrior is not None else (0.0, 0.0, 0.0)
+
+
 def isPositionSafe(pos, radius):
-    collidableTypes = {'boundary_walls': WALL_BLOCK_SIZE, 'random_walls': WALL_BLOCK_SIZE,
-                        'trees': TREE_COLLISION_SIZE, 'shrubs': SHRUB_COLLISION_SIZE}
-    for objKey, objSize in collidableTypes.items():
-        for objPos in objectPositions.get(objKey, []):
-            if (pos[0] - objPos[0])**2 + (pos[2] - objPos[2])**2 < (radius + objSize / 2)**2:
-                return False
+    collidableTypes = {'random_walls': WALL_BLOCK_SIZE, 'trees': TREE_COLLISION_SIZE, 'shrubs': SHRUB_COLLISION_SIZE}
+    for objKey, objPos in world.objectsNear(pos[0], pos[2], radius + SHRUB_COLLISION_SIZE):
+        objSize = collidableTypes.get(objKey)
+        if objSize is not None and (pos[0] - objPos[0])**2 + (pos[2] - objPos[2])**2 < (radius + objSize / 2)**2:
+            return False
     return True
 
 
 def findSafeSpawnPoint():
+    center = spawnCenter()
     while True:
-        x = random.uniform(-WORLD_SIZE * 0.8, WORLD_SIZE * 0.8)
-        z = random.uniform(-WORLD_SIZE * 0.8, WORLD_SIZE * 0.8)
-        pos = [x, 1.0, z]
+        x = center[0] + rng.uniform(-WORLD_SIZE * 0.8, WORLD_SIZE * 0.8)
+        z = center[2] + rng.uniform(-WORLD_SIZE * 0.8, WORLD_SIZE * 0.8)
+        pos = [x, terrain.heightAt(x, z) + 1.0, z]
         if isPositionSafe(pos, 2.0):
             return pos
 
 
 def spawnHeart():
     pos = findSafeSpawnPoint()
-    pos[1] = 2.0
+    pos[1] += 1.0
     hearts.append({'position': pos})
 
 
 def spawnBomb():
-    bombs.append({'position': [random.uniform(-WORLD_SIZE, WORLD_SIZE), 0.5, random.uniform(-WORLD_SIZE, WORLD_SIZE)], 'state': 'idle', 'triggered_time': 0, 'explosion_start_time': 0})
+    center = spawnCenter()
+    x, z = center[0] + rng.uniform(-WORLD_SIZE, WORLD_SIZE), center[2] + rng.uniform(-WORLD_SIZE, WORLD_SIZE)
+    bombs.append({'position': [x, terrain.heightAt(x, z) + 0.5, z], 'state': 'idle', 'triggered_time': 0, 'explosion_start_time': 0})
 
 def spawnBlockingWall():
     yawRad = math.radians(camera.rotation[0])
@@ -1107,16 +1314,17 @@ def spawnBlockingWall():
     strafeVec = [math.cos(yawRad), 0, math.sin(yawRad)]
     centerPos = [warrior.position[0]+forwardVec[0]*WALL_SPAWN_DISTANCE, 0, warrior.position[2]+forwardVec[2]*WALL_SPAWN_DISTANCE]
     for i in range(-1, 2):
-        objectPositions['temp_walls'].append({'pos': [centerPos[0]+strafeVec[0]*i*WALL_BLOCK_SIZE, centerPos[1], centerPos[2]+strafeVec[2]*i*WALL_BLOCK_SIZE], 'despawn_time': time.time()+WALL_LIFETIME})
-    print("A blocking wall appears!")
+        x, z = centerPos[0]+strafeVec[0]*i*WALL_BLOCK_SIZE, centerPos[2]+strafeVec[2]*i*WALL_BLOCK_SIZE
+        objectPositions['temp_walls'].append({'pos': [x, terrain.heightAt(x, z), z], 'despawn_time': simTime+WALL_LIFETIME})
+    eventBus.publish(WALL_SPAWNED, data=centerPos)
 
 
 def updateGameLogic():
-    global playerProjectiles, dragonFireballs, embers, bombs, hearts, objectPositions, gameState
+    global playerProjectiles, dragonFireballs, bombs, hearts, objectPositions, gameState
     if gameOver:
         return
 
-    currentTime = time.time()
+    currentTime = simTime
     
     for heart in hearts[:]:
         distSq = (heart['position'][0] - warrior.position[0])**2 + \
@@ -1133,13 +1341,13 @@ def updateGameLogic():
             if (bomb['position'][0]-warrior.position[0])**2 + (bomb['position'][2]-warrior.position[2])**2 < BOMB_TRIGGER_RADIUS**2:
                 bomb['state'] = 'triggered'
                 bomb['triggered_time'] = currentTime
-                print("Bomb triggered!")
+                eventBus.publish(BOMB_TRIGGERED, data=bomb)
         elif bomb.get('state') == 'triggered':
             if currentTime > bomb['triggered_time']+BOMB_FUSE_TIME:
                 bomb['state'] = 'exploding'
                 bomb['explosion_start_time'] = currentTime
                 bomb['damage_dealt'] = False
-                print("Boom!")
+                eventBus.publish(BOMB_EXPLODED, data=bomb)
         elif bomb.get('state') == 'exploding':
             progress = (currentTime - bomb['explosion_start_time']) / BOMB_EXPLOSION_DURATION
             if progress < 1.0:
@@ -1157,7 +1365,7 @@ def updateGameLogic():
     objectPositions['temp_walls'] = [w for w in objectPositions['temp_walls'] if currentTime < w['despawn_time']]
     if currentTime > gameState.get('lastWallCheck', 0) + WALL_SPAWN_INTERVAL:
         gameState['lastWallCheck'] = currentTime
-        if random.random() < WALL_SPAWN_CHANCE:
+        if rng.random() < WALL_SPAWN_CHANCE:
             spawnBlockingWall()
 
     updatedProjectiles = []
@@ -1186,6 +1394,7 @@ def updateGameLogic():
 
     gravity = 9.8 * 0.016
     updatedFireballs = []
+    emberSpawns = []
     warriorPosWithJump = [warrior.position[0], warrior.position[1] + warrior.yPos, warrior.position[2]]
 
     for p in dragonFireballs:
@@ -1196,17 +1405,19 @@ def updateGameLogic():
             p['vel'][1] -= gravity
             p['life'] -= 0.016
 
-            if random.random() < 0.8:
-                embers.append({'pos': p['pos'][:], 'vel': [v*0.1 + random.uniform(-0.2, 0.2) for v in p['vel']], 'life': 0.8, 'max_life': 0.8})
+            if rng.random() < 0.8:
+                emberSpawns.append((p['pos'][:], [v*0.1 + rng.uniform(-0.2, 0.2) for v in p['vel']], EMBER_LIFE))
 
             distToPlayerSq = sum([(p['pos'][i] - warriorPosWithJump[i])**2 for i in range(3)])
             
+            ground = terrain.heightAt(p['pos'][0], p['pos'][2])
+            
             if distToPlayerSq < 4:
                 warrior.takeDamage(20)
                 isExplodingThisFrame = True
                 p['damage_dealt'] = True
             
-            elif p['pos'][1] <= 0.1 or p['life'] <= 0:
+            elif p['pos'][1] <= ground + 0.1 or p['life'] <= 0:
                 isExplodingThisFrame = True
                 p['damage_dealt'] = False
 
@@ -1214,7 +1425,7 @@ def updateGameLogic():
                 p['state'] = 'exploding'
                 p['explosion_start_time'] = currentTime
                 p['explosion_pos'] = list(p['pos'])
-                if p['pos'][1] <= 0.1: p['explosion_pos'][1] = 0.1
+                if p['pos'][1] <= ground + 0.1: p['explosion_pos'][1] = ground + 0.1
         
         if p.get('state') == 'exploding':
             progress = (currentTime - p['explosion_start_time']) / FIREBALL_EXPLOSION_DURATION
@@ -1233,48 +1444,210 @@ def updateGameLogic():
 
     dragonFireballs = updatedFireballs
 
-    for p in embers:
-        for i in range(3): p['pos'][i] += p['vel'][i] * 0.016
-        p['vel'][1] -= gravity * 0.5
-        p['life'] -= 0.016
-    embers = [p for p in embers if p['life'] > 0]
+    if embers is not None:  # only simulated when there is a GL context to draw them
+        embers.emit(emberSpawns)
+        embers.update(0.016, 9.8 * 0.5)
 
 
-def compileDisplayLists():
-    glNewList(LIST_IDS['tree'], GL_COMPILE)
-    drawTreeGeometry()
-    glEndList()
-    glNewList(LIST_IDS['wall'], GL_COMPILE)
-    drawWallGeometry()
-    glEndList()
-    glNewList(LIST_IDS['rock'], GL_COMPILE)
-    drawCube(1, [(0.5, 0.5, 0.5)])
-    glEndList()
-    glNewList(LIST_IDS['shrub'], GL_COMPILE)
-    drawShrubGeometry()
+def compileDisplayList(name, draw):
+    """Records draw() as the display list LIST_IDS[name], noting how many vertices it draws."""
+    start = immediateVertices
+    glNewList(LIST_IDS[name], GL_COMPILE)
+    draw()
     glEndList()
+    LIST_VERTICES[LIST_IDS[name]] = immediateVertices - start
 
 
-def generateWorld():
-    global objectPositions
-    wallSpacing = WALL_BLOCK_SIZE
-    numWalls = int(WORLD_SIZE * 2 / wallSpacing)
-    objectPositions = {'trees': [(random.uniform(-WORLD_SIZE, WORLD_SIZE), 0, random.uniform(-WORLD_SIZE, WORLD_SIZE)) for _ in range(150)], 'rocks': [(random.uniform(-WORLD_SIZE, WORLD_SIZE), 0.5, random.uniform(-WORLD_SIZE, WORLD_SIZE)) for _ in range(70)], 'shrubs': [(random.uniform(-WORLD_SIZE, WORLD_SIZE), 1, random.uniform(-WORLD_SIZE, WORLD_SIZE)) for _ in range(800)], 'random_walls': [(
-        random.randint(-WORLD_SIZE, WORLD_SIZE), 0, random.randint(-WORLD_SIZE, WORLD_SIZE)) for _ in range(30)], 'boundary_walls': ([(i*wallSpacing-WORLD_SIZE, 0, -WORLD_SIZE) for i in range(numWalls+1)]+[(i*wallSpacing-WORLD_SIZE, 0, WORLD_SIZE) for i in range(numWalls+1)]+[(-WORLD_SIZE, 0, i*wallSpacing-WORLD_SIZE) for i in range(numWalls+1)]+[(WORLD_SIZE, 0, i*wallSpacing-WORLD_SIZE) for i in range(numWalls+1)]), 'temp_walls': []}
+def compileDisplayLists():
+    compileDisplayList('tree', drawTreeGeometry)
+    compileDisplayList('wall', drawWallGeometry)
+    compileDisplayList('rock', lambda: drawCube(1, [(0.5, 0.5, 0.5)]))
+    compileDisplayList('shrub', drawShrubGeometry)
+    compileDisplayList('tree_lod1', drawTreeLod1Geometry)
+    compileDisplayList('shrub_lod1', drawShrubLod1Geometry)
+    for name, draw, bounds, resolution in (('tree_impostor', drawTreeGeometry, TREE_IMPOSTOR_BOUNDS, (64, 128)),
+                                           ('shrub_impostor', drawShrubGeometry, SHRUB_IMPOSTOR_BOUNDS, (64, 64))):
+        impostor = Impostor(draw, bounds, resolution)
+        impostor.capture()
+        impostor.compile(LIST_IDS[name])
+        LIST_VERTICES[LIST_IDS[name]] = Impostor.VERTICES
+
+
+def generateWorld(seed=None):
+    global world, terrain, objectPositions
+    if world is not None:
+        world.shutdown()
+    if terrain is not None:
+        terrain.clear()
+    if seed is None:
+        seed = WORLD_SEED if WORLD_SEED is not None else random.randrange(2**32)
+    terrain = Terrain(HeightField(seed, amplitude=TERRAIN_AMPLITUDE, featureSize=TERRAIN_FEATURE_SIZE),
+                      resolution=TERRAIN_TILE_RESOLUTION, pixelError=TERRAIN_PIXEL_ERROR, viewDistance=CULLING_DISTANCE * 2,
+                      cacheTiles=TERRAIN_CACHE_TILES, buildsPerFrame=TERRAIN_BUILDS_PER_FRAME, color=GROUND_COLOR)
+    propLevels = {'trees': (LIST_IDS['tree'], LIST_IDS['tree_lod1'], LIST_IDS['tree_impostor']),
+                  'shrubs': (LIST_IDS['shrub'], LIST_IDS['shrub_lod1'], LIST_IDS['shrub_impostor']),
+                  'rocks': (LIST_IDS['rock'],) * 3, 'random_walls': (LIST_IDS['wall'],) * 3}
+    world = ChunkedWorld(seed, propLevels, PROP_LOD_SIZES, lodSelector, chunkSize=CHUNK_SIZE,
+                         cellsPerSide=CHUNK_CELLS_PER_SIDE, viewRadius=CHUNK_VIEW_RADIUS,
+                         memoryBudget=CHUNK_MEMORY_BUDGET, workers=CHUNK_WORKERS, pickBounds=PICK_BOUNDS,
+                         drawBounds=PROP_DRAW_BOUNDS, heightAt=terrain.heightAt, listVertices=LIST_VERTICES)
+    if occlusionCuller is not None:
+        occlusionCuller.clear()
+    # Props live in the world's chunks; only the walls spawned during play are kept here
+    objectPositions = {'temp_walls': []}
+
+
+def pickAtCrosshair():
+    """Returns the name stack of the nearest object under the screen center, or None."""
+    dragonScene = BVH([(('dragons', i), [p - DRAGON_PICK_SIZE for p in dragon.position], [p + DRAGON_PICK_SIZE for p in dragon.position])
+                       for i, dragon in enumerate(dragons) if dragon.isAlive])
+    if cameraMatrices is None:
+        return None
+    model, projection, viewport = cameraMatrices
+    records = pick(viewport[2] / 2, viewport[3] / 2, world.pickingScenes() + [dragonScene], model, projection, viewport)
+    return records[0].names if records else None
+
+
+def releaseGlResources():
+    """Deletes the session's GL buffers and render targets while the context and the OpenGL package are still intact."""
+    global textRenderer, meshCache
+    if textRenderer is not None:
+        textRenderer.delete()
+        textRenderer = None
+    if meshCache is not None:
+        meshCache.clear()
+        meshCache = None
+    if renderTargets is not None:
+        renderTargets.clear()
 
 
 def setupOpengl():
+    global stateCache, renderQueue, modelviewBuffer, frameStats, textRenderer, textSize, renderTargets, postChain
+    global gpuTimer, embers, occlusionCuller, shadowMap, sceneProgram, meshCache
+    stateCache = getStateCache()
+    meshCache = getMeshCache()
+    if frameStats is not None:
+        frameStats.close()
+    frameStats = FrameStats()
+    modelviewBuffer = GLfloatArray.zeros((4, 4))
+    stateCache.tracking = USE_STATE_CACHE
+    renderQueue = RenderQueue(stateCache)
     glClearColor(*SKY_COLOR)
-    glEnable(GL_DEPTH_TEST)
-    glEnable(GL_CULL_FACE)
+    stateCache.enable(GL_DEPTH_TEST)
+    stateCache.enable(GL_CULL_FACE)
     glShadeModel(GL_SMOOTH)
+    textRenderer = TextRenderer(TEXT_CACHE_SIZE)
+    if glutAvailable():
+        textRenderer.addFont(glutFont(GLUT_BITMAP_HELVETICA_18, 'helvetica18'))
+    else:
+        textRenderer.addFont(builtinFont())
+        textSize = BUILTIN_TEXT_SIZE
+    atexit.register(releaseGlResources)
+    if framebufferobjects.glGenFramebuffers:
+        renderTargets = getRenderTargetPool()
+        postChain = PostProcessChain(renderTargets, createPostPasses())
+    gpuTimer = GpuTimer()
+    embers = createParticleSystem(EMBER_CAPACITY)
+    occlusionCuller = OcclusionCuller(OCCLUSION_QUERY_INTERVAL)
+    if framebufferobjects.glGenFramebuffers:
+        try:
+            shadowMap = CascadedShadowMap(SUN_DIRECTION, SHADOW_CASCADES, SHADOW_MAP_SIZE)
+            sceneProgram = shadowMap.program
+        except (RuntimeError, GLError, NullFunctionError) as error:
+            print("Rendering without sun shadows: %s" % (error,))
+
+
+def createPostPasses():
+    """Passes applied while upscaling a reduced-resolution frame (a plain copy without GLSL)."""
+    try:
+        program = compileProgram(compileShader(PASS_VERTEX_SHADER, GL_VERTEX_SHADER),
+                                 compileShader(SHARPEN_SHADER, GL_FRAGMENT_SHADER))
+    except (RuntimeError, NullFunctionError) as error:
+        print("Upscaling without sharpening: %s" % (error,))
+        return []
+    return [PostPass(program, {'strength': SHARPEN_STRENGTH})]
+
+
+def drawStaticShadowCasters(cascade):
+    levels = (SHADOW_PROP_LEVEL,) * len(world.propKeys)
+    for cell in world.loadedCells():
+        if cascade.overlaps(cell.box):
+            listId = world.casterList(cell, levels, LOD_COMPILES_PER_FRAME)
+            if listId is None:
+                # out of compiles for this frame, draw the cascade again with the rest next frame
+                cascade.invalidate()
+            else:
+                glCallList(listId)
+                frameStats.add('vertices', cell.vertices.get(listId, 0))
 
 
-def restartGame():
-    global warrior, dragons, gameOver, playerProjectiles, dragonFireballs, embers, bombs, hearts, gameState
+def drawDynamicShadowCasters(cascade):
+    def near(pos, radius):
+        return cascade.overlaps((pos[0] - radius, pos[1] - radius, pos[2] - radius,
+                                 pos[0] + radius, pos[1] + radius, pos[2] + radius))
+    if near(warrior.position, 3.0):
+        warrior.draw()
+    for dragon in dragons:
+        if dragon.isAlive and near(dragon.position, DRAGON_LOD_SIZE):
+            dragon.draw(max(dragon.lodLevel or 0, SHADOW_PROP_LEVEL))
+    for wall in objectPositions.get('temp_walls', []):
+        if near(wall['pos'], 3.0):
+            drawPropAt(wall['pos'], LIST_IDS['wall'])
+    for p in playerProjectiles:
+        if near(p['pos'], 0.2):
+            drawSphereAt(p['pos'], 0.2, 8)
+    for bomb in bombs:
+        if bomb.get('state') in ['idle', 'triggered'] and near(bomb['position'], 0.5):
+            drawSphereAt(bomb['position'], 0.5, 8)
+
+
+def updateShadows():
+    """Re-renders the dynamic shadow casters (and the static ones of cascades that moved or gained or lost chunks)."""
+    if not sceneProgram:
+        return
+    for coords, chunk in list(shadowChunks.items()):
+        if world.chunks.get(coords) is not chunk:
+            del shadowChunks[coords]
+            if chunk.box is not None:
+                shadowMap.invalidate(chunk.box)
+    for coords, chunk in world.chunks.items():
+        if coords not in shadowChunks:
+            shadowChunks[coords] = chunk
+            if chunk.box is not None:
+                shadowMap.invalidate(chunk.box)
+    shadowMap.update(camera.position, drawStaticShadowCasters, drawDynamicShadowCasters)
+
+
+def updateRenderScale():
+    """Feeds the last frame's CPU and GPU times to the resolution controller and takes its render scale."""
+    global renderScale
+    gpuMs = gpuTimer.poll()
+    frameStats.count('gpuMs', gpuMs)
+    frameStats.count('renderScale', renderScale)
+    frame = frameStats.last
+    if renderTargets is None or not dynamicResolution or not frame['frameMs']:
+        return
+    # Software rasterizers and tiling GPUs do much of their work when the frame is flushed, where the timer
+    # query doesn't see it, so time blocked in the swap counts as GPU time too
+    if gpuMs is not None:
+        gpuMs = max(gpuMs, frame['swapMs'])
+    renderScale = resolutionController.update(frame['simMs'] + frame['renderMs'], gpuMs, frame['frameMs'])
+
+
+def restartGame(seed=None):
+    """Starts a new game around the warrior's position.
+
+    With a seed the game is reproducible: the simulation's random generator is
+    reseeded and everything spawns around the origin, as in the first game.
+    """
+    global warrior, dragons, gameOver, playerProjectiles, dragonFireballs, bombs, hearts, gameState
+    if seed is not None:
+        rng.seed(seed)
+        warrior = None
     gameOver = False
     safeSpawnPos = findSafeSpawnPoint()
     warrior = Warrior(position=safeSpawnPos)
+    world.preload(warrior.position)
     
     dragons = []
     blueDragonColor = {
@@ -1291,12 +1664,14 @@ def restartGame():
 
     playerProjectiles = []
     dragonFireballs = []
-    embers = []
+    if embers is not None:
+        embers.clear()
+    hudMessages.clear()
     bombs = []
     hearts = []
     for _ in range(NUM_HEARTS):
         spawnHeart()
-    gameState = {'lastWallCheck': time.time()}
+    gameState = {'lastWallCheck': simTime}
     for _ in range(NUM_BOMBS):
         spawnBomb()
     print("Game Restarted!")
@@ -1306,95 +1681,154 @@ def restartGame():
 # -----------------------------------------------------------------------------
 
 
-def display():
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    camera.look()
-    modelviewMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-    drawGround()
-    drawPlayerProjectiles()
-    if dragonFireballs or embers:
-        drawFireAndEmbers(modelviewMatrix)
+def drawPropAt(pos, listId):
+    glPushMatrix()
+    glTranslatef(pos[0], pos[1], pos[2])
+    glCallList(listId)
+    glPopMatrix()
+    frameStats.add('vertices', LIST_VERTICES.get(listId, 0))
 
-    cullingDistSq = CULLING_DISTANCE**2
+
+def sphereSlices(pos, radius, maxSlices, pixelScale):
+    """Tessellation for a sphere seen from the camera: about one slice per 8 pixels of its projected size."""
+    distance = math.sqrt(sum((pos[i] - camera.position[i])**2 for i in range(3)))
+    return max(6, min(maxSlices, int(projectedSize(radius * 2, distance, pixelScale) / 8)))
+
+
+def drawSphereAt(pos, radius, slices):
+    glPushMatrix()
+    glTranslatef(*pos)
+    solidSphere(radius, slices, slices)
+    glPopMatrix()
+
+
+def drawHeartAt(pos, bobbingOffset, spinAngle):
+    glPushMatrix()
+    glTranslatef(pos[0], pos[1] + bobbingOffset, pos[2])
+    glRotatef(spinAngle, 0, 1, 0)
+    glScalef(1.5, 1.5, 1.5)
+    drawHeartGeometry()
+    glPopMatrix()
+
+
+def submitScene(modelviewMatrix):
+    """Submits every world-space draw of the frame to the render queue."""
+    currentTime = simTime
     camPos = warrior.position
-    objectMap = [('trees', LIST_IDS['tree']), ('rocks', LIST_IDS['rock']), ('shrubs',
-                                                                             LIST_IDS['shrub']), ('random_walls', LIST_IDS['wall']), ('boundary_walls', LIST_IDS['wall'])]
-    for key, listId in objectMap:
-        for pos in objectPositions[key]:
-            if (pos[0]-camPos[0])**2+(pos[2]-camPos[2])**2 < cullingDistSq:
-                glPushMatrix()
-                glTranslatef(pos[0], pos[1], pos[2])
-                glCallList(listId)
-                glPopMatrix()
+    pixelScale = pixelsPerUnit(WINDOW_HEIGHT, FIELD_OF_VIEW)
+    for tile in terrain.visibleTiles(camera.position, WINDOW_HEIGHT, FIELD_OF_VIEW):
+        renderQueue.submit(lambda tile=tile: terrain.drawTile(tile), tile.center, program=sceneProgram)
+    frameStats.add('vertices', terrain.stats['vertices'])
+    for p in playerProjectiles:
+        slices = sphereSlices(p['pos'], 0.2, 10, pixelScale)
+        renderQueue.submit(lambda pos=p['pos'], slices=slices: drawSphereAt(pos, 0.2, slices), p['pos'], color=(0.2, 1.0, 0.8),
+                           program=sceneProgram)
+    if dragonFireballs or embers.alive:
+        renderQueue.submit(lambda: drawFireAndEmbers(modelviewMatrix), blend=(GL_SRC_ALPHA, GL_ONE), depthMask=False)
+
+    cullingDistSq = CULLING_DISTANCE**2
+    cells = world.visibleCells(camera.position, CULLING_DISTANCE, pixelScale, LOD_COMPILES_PER_FRAME)
+    for cell in occlusionCuller.filter(cells, camera.position):
+        renderQueue.submit(lambda cell=cell: world.drawCell(cell), cell.center, program=sceneProgram)
+        frameStats.add('vertices', cell.vertices.get(cell.listId, 0))
+    occluded, outside = occlusionCuller.stats['occluded'], occlusionCuller.stats['outside']
+    visible, culled = world.stats['visible'] - occluded - outside, world.stats['culled'] + outside
     for wall in objectPositions.get('temp_walls', []):
         pos = wall['pos']
         if (pos[0]-camPos[0])**2+(pos[2]-camPos[2])**2 < cullingDistSq:
-            glPushMatrix()
-            glTranslatef(pos[0], pos[1], pos[2])
-            glCallList(LIST_IDS['wall'])
-            glPopMatrix()
+            renderQueue.submit(lambda pos=pos: drawPropAt(pos, LIST_IDS['wall']), pos, program=sceneProgram)
+            visible += 1
+        else:
+            culled += 1
+    frameStats.count('visible', visible)
+    frameStats.count('culled', culled)
+    frameStats.count('occluded', occluded)
     for bomb in bombs:
         if bomb.get('state') in ['idle', 'triggered']:
-            glPushMatrix()
-            glTranslatef(*bomb['position'])
-            glColor3f(1, 0, 0) if bomb['state'] == 'triggered' and int(time.time()*10) % 2 == 0 else glColor3f(0.8, 0.8, 0)
-            glutSolidSphere(0.5, 16, 16)
-            glPopMatrix()
+            color = (1, 0, 0) if bomb['state'] == 'triggered' and int(currentTime*10) % 2 == 0 else (0.8, 0.8, 0)
+            slices = sphereSlices(bomb['position'], 0.5, 16, pixelScale)
+            renderQueue.submit(lambda pos=bomb['position'], slices=slices: drawSphereAt(pos, 0.5, slices), bomb['position'], color=color,
+                               program=sceneProgram)
         elif bomb.get('state') == 'exploding':
-            progress = (time.time()-bomb['explosion_start_time'])/BOMB_EXPLOSION_DURATION
+            progress = (currentTime-bomb['explosion_start_time'])/BOMB_EXPLOSION_DURATION
             radius = progress*BOMB_EXPLOSION_MAX_RADIUS
             alpha = 0.8*(1.0-progress)
-            glPushMatrix()
-            glTranslatef(*bomb['position'])
-            glEnable(GL_BLEND)
-            glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-            glColor4f(1.0, 0.5, 0.0, alpha)
-            glutSolidSphere(radius, 32, 32)
-            glDisable(GL_BLEND)
-            glPopMatrix()
+            slices = sphereSlices(bomb['position'], radius, 32, pixelScale)
+            renderQueue.submit(lambda pos=bomb['position'], radius=radius, slices=slices: drawSphereAt(pos, radius, slices), bomb['position'],
+                               blend=(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA), color=(1.0, 0.5, 0.0, alpha))
 
     for heart in hearts:
-        glPushMatrix()
-        bobbingOffset = math.sin(time.time() * 2.0 + heart['position'][0]) * 0.25
-        pos = heart['position']
-        glTranslatef(pos[0], pos[1] + bobbingOffset, pos[2])
-        glRotatef(time.time() * 30, 0, 1, 0)
-        glScalef(1.5, 1.5, 1.5)
-        drawHeartGeometry()
-        glPopMatrix()
+        bobbingOffset = math.sin(currentTime * 2.0 + heart['position'][0]) * 0.25
+        renderQueue.submit(lambda pos=heart['position'], bobbingOffset=bobbingOffset: drawHeartAt(pos, bobbingOffset, currentTime * 30),
+                           heart['position'], program=sceneProgram)
 
     for fireball in dragonFireballs:
         if fireball.get('state') == 'exploding':
-            progress = (time.time() - fireball['explosion_start_time']) / FIREBALL_EXPLOSION_DURATION
+            progress = (currentTime - fireball['explosion_start_time']) / FIREBALL_EXPLOSION_DURATION
             if 0 < progress < 1.0:
                 radius = progress * FIREBALL_EXPLOSION_MAX_RADIUS
                 alpha = 0.8 * (1.0 - progress)
-                glPushMatrix()
-                glTranslatef(*fireball['explosion_pos'])
-                glEnable(GL_BLEND)
-                glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-                glColor4f(1.0, 0.6, 0.1, alpha)
-                glutSolidSphere(radius, 32, 32)
-                glDisable(GL_BLEND)
-                glPopMatrix()
+                slices = sphereSlices(fireball['explosion_pos'], radius, 32, pixelScale)
+                renderQueue.submit(lambda pos=fireball['explosion_pos'], radius=radius, slices=slices: drawSphereAt(pos, radius, slices),
+                                   fireball['explosion_pos'],
+                                   blend=(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA), color=(1.0, 0.6, 0.1, alpha))
 
     if camera.isThirdPerson:
-        warrior.draw()
-    
+        renderQueue.submit(warrior.draw, warrior.position, program=sceneProgram)
+
     for dragon in dragons:
-        dragon.draw()
+        if dragon.isAlive:
+            distance = math.sqrt(sum((dragon.position[i] - camera.position[i])**2 for i in range(3)))
+            dragon.lodLevel = lodSelector.select(projectedSize(DRAGON_LOD_SIZE, distance, pixelScale), dragon.lodLevel)
+            renderQueue.submit(lambda dragon=dragon: dragon.draw(dragon.lodLevel), dragon.position, program=sceneProgram)
+
+
+def display():
+    global cameraMatrices
+    frameStats.beginFrame()
+    startVertices = immediateVertices + Mesh.submitted
+    updateRenderScale()
+    frameStats.beginSection('render')
+    gpuTimer.begin()
+    updateShadows()
+    sceneTarget = None
+    if renderTargets is not None and renderScale < 1.0:
+        sceneTarget = renderTargets.target('scene', renderScale)
+        sceneTarget.bind()
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    camera.look()
+    world.sync()
+    modelviewMatrix = glGetFloatv(GL_MODELVIEW_MATRIX, modelviewBuffer)
+    # input callbacks run between frames, when the matrices left behind are the HUD's
+    cameraMatrices = ([list(row) for row in modelviewMatrix], [list(row) for row in glGetDoublev(GL_PROJECTION_MATRIX)],
+                      (0, 0, WINDOW_WIDTH, WINDOW_HEIGHT))
+    if sceneProgram:
+        shadowMap.prepare(modelviewMatrix)
+    renderQueue.begin(camera.position)
+    submitScene(modelviewMatrix)
+    flushStats = renderQueue.flush()
+    occlusionCuller.issueQueries()
+    frameStats.count('queries', occlusionCuller.stats['queries'])
+    frameStats.count('queryLatencyFrames', occlusionCuller.stats['latencyFrames'])
+    frameStats.count('queryLatencyMs', occlusionCuller.stats['latencyMs'])
+    frameStats.count('drawCalls', flushStats['opaque'] + flushStats['transparent'])
+    frameStats.count('stateChanges', flushStats['stateChanges'])
+    flyingFireballs = sum(1 for p in dragonFireballs if p.get('state', 'flying') == 'flying')
+    frameStats.count('particles', flyingFireballs * 30 + embers.alive)
+    frameStats.count('entities', 1 + sum(1 for d in dragons if d.isAlive) + len(playerProjectiles) +
+                     len(dragonFireballs) + len(bombs) + len(hearts))
 
     if not camera.isThirdPerson and warrior.isShieldActive:
-        glMatrixMode(GL_PROJECTION)
+        stateCache.matrixMode(GL_PROJECTION)
         glPushMatrix()
         glLoadIdentity()
         gluOrtho2D(0, WINDOW_WIDTH, 0, WINDOW_HEIGHT)
-        glMatrixMode(GL_MODELVIEW)
+        stateCache.matrixMode(GL_MODELVIEW)
         glPushMatrix()
         glLoadIdentity()
-        glDisable(GL_DEPTH_TEST)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        stateCache.disable(GL_DEPTH_TEST)
+        stateCache.enable(GL_BLEND)
+        stateCache.blendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         glColor4f(0.3, 0.7, 1.0, warrior.shieldAlpha * 0.7)
         glBegin(GL_QUADS)
         glVertex2f(0, 0)
@@ -1402,21 +1836,100 @@ def display():
         glVertex2f(WINDOW_WIDTH, WINDOW_HEIGHT)
         glVertex2f(0, WINDOW_HEIGHT)
         glEnd()
-        glDisable(GL_BLEND)
-        glEnable(GL_DEPTH_TEST)
-        glMatrixMode(GL_PROJECTION)
+        stateCache.disable(GL_BLEND)
+        stateCache.enable(GL_DEPTH_TEST)
+        stateCache.matrixMode(GL_PROJECTION)
         glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
+        stateCache.matrixMode(GL_MODELVIEW)
         glPopMatrix()
 
+    if sceneTarget is not None:
+        postChain.run(sceneTarget, WINDOW_WIDTH, WINDOW_HEIGHT)
     drawUi()
+    # cubes and meshes drawn outside display lists; those replayed from lists are counted where the lists are called
+    frameStats.add('vertices', immediateVertices + Mesh.submitted - startVertices)
+    gpuTimer.end()
+    stateCache.endFrame()
+    frameStats.endSection('render')
+    frameStats.beginSection('swap')
     glutSwapBuffers()
+    frameStats.endSection('swap')
+    frameStats.endFrame()
 
 
 def keyboard(key, x, y):
-    global keys, isControlsLocked, gameOver
     if key == b'\x1b':
+        stopRecording()
         sys.exit()
+    if key == b'n':
+        saveSnapshot(SNAPSHOT_FILE)
+        return
+    if key == b'm':
+        if inputRecorder is not None or inputPlayer is not None:
+            print("Snapshots cannot be restored while recording or replaying input")
+        else:
+            loadSnapshot(SNAPSHOT_FILE)
+        return
+    submitInput(KEY_DOWN, key)
+
+
+def keyboardUp(key, x, y):
+    submitInput(KEY_UP, key)
+
+
+def mouse(button, state, x, y):
+    submitInput(MOUSE_BUTTON, button, state)
+
+
+def mouseMotion(x, y):
+    """Turns pointer positions into movements, re-centering the pointer before it leaves the window."""
+    global isMouseWarping, lastMousePos
+    if isMouseWarping:
+        isMouseWarping = False
+        lastMousePos['x'], lastMousePos['y'] = x, y
+        return
+    submitInput(MOUSE_LOOK, x - lastMousePos['x'], y - lastMousePos['y'])
+    centerX, centerY = WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2
+    if abs(x - centerX) > 200 or abs(y - centerY) > 200:
+        isMouseWarping = True
+        glutWarpPointer(centerX, centerY)
+    else:
+        lastMousePos['x'], lastMousePos['y'] = x, y
+
+
+def submitInput(kind, *args):
+    """Applies an input event from the window system, recording it if a session is being recorded.
+
+    Live input is ignored while a recorded session is being replayed.
+    """
+    if inputPlayer is not None:
+        return
+    if inputRecorder is not None:
+        inputRecorder.record(kind, *args)
+    INPUT_HANDLERS[kind](*args)
+
+
+def pressKey(key):
+    global keys, isControlsLocked, gameOver, showFrameStats, dynamicResolution, renderScale, sceneProgram
+    if key == b'f':
+        showFrameStats = not showFrameStats
+    if key == b'v':
+        dynamicResolution = not dynamicResolution
+        renderScale = RENDER_SCALE_MAX
+        resolutionController.reset(renderScale)
+        print(f"Dynamic resolution {'ON' if dynamicResolution else 'OFF'}")
+    if key == b'o':
+        occlusionCuller.enabled = not occlusionCuller.enabled
+        print(f"Occlusion culling {'ON' if occlusionCuller.enabled else 'OFF'}")
+    if key == b'h' and shadowMap is not None:
+        sceneProgram = 0 if sceneProgram else shadowMap.program
+        print(f"Sun shadows {'ON' if sceneProgram else 'OFF'}")
+    if key == b'k':
+        if frameStats.csvWriter is None:
+            print("Recording frame stats to " + frameStats.startCsv(time.strftime("frameStats_%Y%m%d_%H%M%S.csv")))
+        else:
+            frameStats.stopCsv()
+            print("Frame stats recording stopped")
     if key.lower() in keys:
         keys[key.lower()] = True
     if gameOver:
@@ -1433,12 +1946,12 @@ def keyboard(key, x, y):
         print(f"Controls {'LOCKED' if isControlsLocked else 'UNLOCKED'}")
 
 
-def keyboardUp(key, x, y):
+def releaseKey(key):
     if key.lower() in keys:
         keys[key.lower()] = False
 
 
-def mouse(button, state, x, y):
+def pressMouseButton(button, state):
     global camera
     if gameOver:
         return
@@ -1450,18 +1963,164 @@ def mouse(button, state, x, y):
         fwdVec = camera.getCameraForwardVector()
         startPos = [camera.position[i] + fwdVec[i] * 1.5 for i in range(3)]
         warrior.fireBlast(startPos, fwdVec)
+    elif button == GLUT_MIDDLE_BUTTON and state == GLUT_DOWN:
+        target = pickAtCrosshair()
+        print(f"Targeting: {target[0]} #{target[1]}" if target else "Targeting: nothing")
 
 
-def mouseMotion(x, y): camera.handleMouse(x, y)
+def lookAround(dx, dy):
+    camera.turn(dx, dy)
 
 
-def idle():
+INPUT_HANDLERS = {KEY_DOWN: pressKey, KEY_UP: releaseKey, MOUSE_BUTTON: pressMouseButton, MOUSE_LOOK: lookAround}
+
+
+def simulationChecksum():
+    """CRC of everything the simulation depends on, compared tick by tick when replaying."""
+    dragonStates = [sorted((name, value) for name, value in vars(dragon).items() if name not in DRAGON_RENDER_STATE)
+                    for dragon in dragons]
+    state = (sorted(vars(warrior).items()), camera.position, camera.rotation, camera.isThirdPerson, dragonStates,
+             playerProjectiles, dragonFireballs, bombs, hearts, objectPositions['temp_walls'], gameState, gameOver,
+             isControlsLocked, sorted(keys.items()), rng.getstate())
+    return zlib.crc32(repr(state).encode())
+
+
+def captureState():
+    """The whole simulation state as plain values (the world's props are saved separately)."""
+    return {'worldSeed': world.seed, 'simTime': simTime, 'rng': rng.getstate(), 'warrior': vars(warrior),
+            'camera': vars(camera), 'gameOver': gameOver, 'isControlsLocked': isControlsLocked, 'keys': keys,
+            'dragons': [dict((name, value) for name, value in vars(dragon).items() if name not in DRAGON_RENDER_STATE)
+                        for dragon in dragons],
+            'playerProjectiles': playerProjectiles, 'dragonFireballs': dragonFireballs, 'bombs': bombs,
+            'hearts': hearts, 'tempWalls': objectPositions['temp_walls'], 'gameState': gameState}
+
+
+def restoreState(state):
+    """Replaces the simulation state with one returned by captureState()."""
+    global warrior, camera, dragons, gameOver, isControlsLocked, playerProjectiles, dragonFireballs, bombs, hearts, \
+        gameState, simTime, clockOffset
+    if world.seed != state['worldSeed']:
+        generateWorld(state['worldSeed'])
+    warrior = Warrior()
+    vars(warrior).update(state['warrior'])
+    camera = Camera()
+    vars(camera).update(state['camera'])
+    dragons = []
+    for dragonState in state['dragons']:
+        dragon = Dragon()
+        vars(dragon).update(dragonState)
+        dragons.append(dragon)
+    # after creating the dragons, which draw from the generator
+    rng.setstate(state['rng'])
+    gameOver, isControlsLocked = state['gameOver'], state['isControlsLocked']
+    keys.update(state['keys'])
+    playerProjectiles, dragonFireballs = state['playerProjectiles'], state['dragonFireballs']
+    bombs, hearts, gameState = state['bombs'], state['hearts'], state['gameState']
+    objectPositions['temp_walls'] = state['tempWalls']
+    simTime = state['simTime']
+    clockOffset = simTime - time.time()
+    if embers is not None:
+        embers.clear()
+    hudMessages.clear()
+    eventBus.clear()
+
+
+def saveSnapshot(path):
+    """Writes the simulation state and the props of every chunk generated so far to path."""
+    start = time.perf_counter()
+    size = writeSnapshot(path, captureState(), world.propArrays())
+    print("Saved snapshot to %s (%d KB in %.1f ms)" % (path, size // 1024, (time.perf_counter() - start) * 1000.0))
+
+
+def loadSnapshot(path):
+    """Restores a snapshot written by saveSnapshot(); its chunks are built from the saved props."""
+    start = time.perf_counter()
+    state, propArrays = readSnapshot(path)
+    restoreState(state)
+    world.stored = propArrays
+    world.preload(warrior.position)
+    print("Restored snapshot from %s in %.1f ms" % (path, (time.perf_counter() - start) * 1000.0))
+
+
+def startRecording(path):
+    """Restarts the game with a fresh seed and records the session's input to path."""
+    global inputRecorder
+    stopRecording()
+    seed = random.randrange(2**32)
+    inputRecorder = InputRecorder(path, world.seed, seed, simTime)
+    restartGame(seed)
+    print("Recording input to " + path)
+
+
+def stopRecording():
+    global inputRecorder
+    if inputRecorder is not None:
+        inputRecorder.close()
+        print("Recorded %d input events over %d ticks" % (inputRecorder.events, inputRecorder.ticks))
+        inputRecorder = None
+
+
+def startReplay(path):
+    """Recreates the initial state of the session recorded in path and replays its input."""
+    global inputPlayer, simTime
+    stopRecording()
+    inputPlayer = InputPlayer(path)
+    if world.seed != inputPlayer.worldSeed:
+        generateWorld(inputPlayer.worldSeed)
+    simTime = inputPlayer.startTime
+    restartGame(inputPlayer.simulationSeed)
+    print("Replaying input from " + path)
+
+
+def stopReplay():
+    global inputPlayer, clockOffset
+    print("Replayed %d ticks, %s" % (inputPlayer.ticks, "state matched the recording" if not inputPlayer.mismatches else
+                                    "state diverged from tick %d on" % inputPlayer.firstMismatch))
+    # live play continues from the replayed state, without a jump in the clock
+    clockOffset = simTime - time.time()
+    inputPlayer = None
+
+
+def beginTick():
+    """Sets the simulation time of this tick; records it, or applies the replayed input for it."""
+    global simTime
+    if inputPlayer is not None:
+        tick = inputPlayer.readTick()
+        if tick is not None:
+            tickTime, checksum, events = tick
+            for kind, args in events:
+                INPUT_HANDLERS[kind](*args)
+            inputPlayer.check(simulationChecksum(), checksum)
+            simTime = tickTime
+            return
+        stopReplay()
+    simTime = time.time() + clockOffset
+    if inputRecorder is not None:
+        inputRecorder.tick(simTime, simulationChecksum())
+
+
+def simulationStep():
+    """Advances the game by one tick and dispatches its events, returns how many there were.
+
+    Makes no GL calls, so games can also be simulated without a window (see batchRunner.py).
+    """
     if not gameOver:
         updateGameLogic()
         camera.update()
         warrior.update()
+        world.update(warrior.position)
         for dragon in dragons:
             dragon.update(warrior.position, playerProjectiles)
+        camera.place()
+    return eventBus.dispatch()
+
+
+def idle():
+    frameStats.beginFrame()
+    frameStats.beginSection('sim')
+    beginTick()
+    frameStats.count('events', simulationStep())
+    frameStats.endSection('sim')
     glutPostRedisplay()
 
 
@@ -1469,14 +2128,16 @@ def reshape(w, h):
     global WINDOW_WIDTH, WINDOW_HEIGHT
     WINDOW_WIDTH, WINDOW_HEIGHT = w, h
     glViewport(0, 0, w, h)
-    glMatrixMode(GL_PROJECTION)
+    if renderTargets is not None:
+        renderTargets.reshape(w, h)
+    stateCache.matrixMode(GL_PROJECTION)
     glLoadIdentity()
-    gluPerspective(55, (w/max(1, h)), 0.1, 500.0)
-    glMatrixMode(GL_MODELVIEW)
+    gluPerspective(FIELD_OF_VIEW, (w/max(1, h)), 0.1, 500.0)
+    stateCache.matrixMode(GL_MODELVIEW)
 
 
 def main():
-    global camera, warrior, dragons, lastMousePos
+    global camera, warrior, dragons, lastMousePos, simTime
     glutInit(sys.argv)
     glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
     glutInitWindowSize(WINDOW_WIDTH, WINDOW_HEIGHT)
@@ -1496,7 +2157,15 @@ def main():
     glutWarpPointer(centerX, centerY)
     camera = Camera()
     lastMousePos = {'x': centerX, 'y': centerY}
-    restartGame()
+    simTime = time.time()
+    if '--snapshot' in sys.argv[:-1]:
+        loadSnapshot(sys.argv[sys.argv.index('--snapshot') + 1])
+    elif '--replay' in sys.argv[:-1]:
+        startReplay(sys.argv[sys.argv.index('--replay') + 1])
+    elif '--record' in sys.argv[:-1]:
+        startRecording(sys.argv[sys.argv.index('--record') + 1])
+    else:
+        restartGame()
     print("Game Loaded. Controls: W,A,S,D, Mouse, Space, E, L, R")
     glutMainLoop()
 
@@ -0,0 +1,123 @@
+import math
+
+from OpenGL.GL import (glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery, glGetQueryObjectuiv, GL_TIME_ELAPSED,
+                       GL_QUERY_RESULT, GL_QUERY_RESULT_AVAILABLE)
+from OpenGL.GL.ARB.timer_query import glInitTimerQueryARB
+
+
+class GpuTimer:
+    """Measures GPU time per frame with a ring of GL_TIME_ELAPSED queries.
+
+    Results arrive a few frames late; poll() never waits for the GPU, it just
+    collects whichever queries have finished. When a frame's begin() finds
+    every query still pending, that frame is not timed. available is False
+    when the implementation has no timer queries, in which case begin()/end()
+    do nothing and poll() always returns None.
+    """
+
+    # Readings above this are driver glitches (some report garbage for the first query)
+    MAX_PLAUSIBLE_MS = 1000.0
+
+    def __init__(self, queries=4):
+        self.available = bool(glInitTimerQueryARB())
+        self.free = [int(query) for query in glGenQueries(queries)] if self.available else []
+        self.pending = []
+        self.active = None
+        self.lastMs = None
+
+    def begin(self):
+        if not self.free:
+            return
+        self.active = self.free.pop()
+        glBeginQuery(GL_TIME_ELAPSED, self.active)
+
+    def end(self):
+        if self.active is None:
+            return
+        glEndQuery(GL_TIME_ELAPSED)
+        self.pending.append(self.active)
+        self.active = None
+
+    def poll(self):
+        """GPU milliseconds of the most recently finished frame (None before the first one)."""
+        while self.pending and glGetQueryObjectuiv(self.pending[0], GL_QUERY_RESULT_AVAILABLE):
+            query = self.pending.pop(0)
+            elapsedMs = glGetQueryObjectuiv(query, GL_QUERY_RESULT) / 1.0e6
+            if elapsedMs < self.MAX_PLAUSIBLE_MS:
+                self.lastMs = elapsedMs
+            self.free.append(query)
+        return self.lastMs
+
+    def delete(self):
+        queries = self.free + self.pending
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self.free, self.pending = [], []
+
+
+class ResolutionController:
+    """Adjusts the render scale so frames fit a time budget.
+
+    Each update() takes the CPU time of the frame (simulation plus command
+    submission) and its GPU time; both are smoothed with an exponential
+    moving average. Because fill cost grows with the pixel count, i.e. with
+    the square of the scale, the scale that fits the GPU time into
+    targetMs * headroom is scale * sqrt(budget / gpuMs). The controller moves
+    towards that, but:
+
+    - only when the GPU is the bottleneck: when the CPU alone is over
+      budget, lowering the resolution would cost quality without helping,
+      so the scale is held (or raised if the GPU has room to spare);
+    - in multiples of quantum, so the pooled render targets of the few
+      sizes in use are reused rather than re-created every frame;
+    - at most once per cooldownFrames frames, as GPU timings arrive a few
+      frames late and need time to reflect a change;
+    - not at all while the GPU time is inside the deadband around the
+      budget, so the scale settles instead of oscillating.
+
+    Without GPU timings (no timer queries), the whole frame time stands in
+    for the GPU time, which degrades to "scale down while over budget".
+    """
+
+    def __init__(self, targetMs, minScale=0.5, maxScale=1.0, headroom=0.9, deadband=0.15, smoothing=0.2,
+                 quantum=0.05, cooldownFrames=10):
+        self.targetMs = targetMs
+        self.minScale = minScale
+        self.maxScale = maxScale
+        self.headroom = headroom
+        self.deadband = deadband
+        self.smoothing = smoothing
+        self.quantum = quantum
+        self.cooldownFrames = cooldownFrames
+        self.reset()
+
+    def reset(self, scale=None):
+        self.scale = self.maxScale if scale is None else scale
+        self.cpuMs = self.gpuMs = None
+        self.framesSinceChange = 0
+
+    def _smooth(self, average, value):
+        return value if average is None else average + (value - average) * self.smoothing
+
+    def update(self, cpuMs, gpuMs=None, frameMs=None):
+        """Feeds one frame's timings, returns the render scale for the next frame."""
+        self.cpuMs = self._smooth(self.cpuMs, cpuMs)
+        measured = gpuMs if gpuMs is not None else frameMs
+        if measured is None:
+            return self.scale
+        self.gpuMs = self._smooth(self.gpuMs, measured)
+        self.framesSinceChange += 1
+        if self.framesSinceChange < self.cooldownFrames:
+            return self.scale
+        budget = self.targetMs * self.headroom
+        if abs(self.gpuMs - budget) <= budget * self.deadband:
+            return self.scale
+        desired = self.scale * math.sqrt(budget / max(self.gpuMs, 1e-3))
+        if desired < self.scale and self.cpuMs >= self.targetMs:
+            return self.scale
+        desired = round(desired / self.quantum) * self.quantum
+        desired = min(self.maxScale, max(self.minScale, desired))
+        if abs(desired - self.scale) >= self.quantum / 2:
+            self.scale = desired
+            self.framesSinceChange = 0
+        return self.scale
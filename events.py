@@ -0,0 +1,127 @@
+import atexit
+import queue
+import sys
+import threading
+
+
+class Event:
+    """A queued event; kind says what happened, value and data carry the details.
+
+    Event objects are slots of the bus' ring and are reused once dispatched,
+    so handlers must copy what they want to keep.
+    """
+    __slots__ = ('kind', 'tick', 'value', 'data')
+
+    def __init__(self):
+        self.kind = self.tick = self.value = self.data = None
+
+
+class EventBus:
+    """Queues gameplay events and hands them to subscribers in one batch per tick.
+
+    publish() only fills the next slot of a ring of capacity preallocated
+    Event objects, so raising events in the middle of the simulation costs
+    next to nothing. dispatch(), called once per tick, calls the handlers
+    subscribed to each event's kind (and those subscribed to every kind) in
+    publication order. Events published by handlers during a dispatch are
+    delivered by the next one. When the ring is full, new events are dropped
+    and counted in stats['dropped'].
+    """
+
+    def __init__(self, capacity=1024):
+        self.ring = [Event() for _ in range(capacity)]
+        self.head = 0
+        self.count = 0
+        self.tick = 0
+        self.handlers = {}  # kind (None for every kind) -> list of handlers
+        self.stats = {'published': 0, 'dispatched': 0, 'dropped': 0}
+
+    def subscribe(self, handler, kinds=None):
+        """Calls handler(event) for events of the given kinds, or of every kind when kinds is None."""
+        for kind in (None,) if kinds is None else kinds:
+            self.handlers.setdefault(kind, []).append(handler)
+
+    def unsubscribe(self, handler):
+        for handlers in self.handlers.values():
+            while handler in handlers:
+                handlers.remove(handler)
+
+    def publish(self, kind, value=None, data=None):
+        """Queues an event for the next dispatch(); returns False if it was dropped."""
+        ring = self.ring
+        if self.count == len(ring):
+            self.stats['dropped'] += 1
+            return False
+        event = ring[(self.head + self.count) % len(ring)]
+        event.kind, event.tick, event.value, event.data = kind, self.tick, value, data
+        self.count += 1
+        self.stats['published'] += 1
+        return True
+
+    def dispatch(self):
+        """Delivers the events queued before this call, returns how many there were."""
+        ring, handlers = self.ring, self.handlers
+        everything = handlers.get(None, ())
+        pending = self.count
+        for _ in range(pending):
+            event = ring[self.head]
+            for handler in handlers.get(event.kind, ()):
+                handler(event)
+            for handler in everything:
+                handler(event)
+            event.data = None
+            self.head = (self.head + 1) % len(ring)
+            self.count -= 1
+        self.tick += 1
+        self.stats['dispatched'] += pending
+        return pending
+
+    def clear(self):
+        """Drops the queued events without delivering them."""
+        for _ in range(self.count):
+            self.ring[self.head].data = None
+            self.head = (self.head + 1) % len(self.ring)
+        self.count = 0
+
+
+class EventLogger:
+    """Event handler writing one line per event from a background thread.
+
+    messages maps event kinds to str.format templates, which can use the
+    event's {value} (kinds without a template are not logged). Calling the
+    logger only queues (kind, value); formatting and the actual writes happen
+    on a daemon thread started with the first event, so console I/O never
+    stalls the frame. close() (also run at exit) writes what is still queued.
+    """
+
+    def __init__(self, messages, stream=None):
+        self.messages = messages
+        self.stream = stream
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def __call__(self, event):
+        if event.kind not in self.messages:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='event-logger', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        self.queue.put((event.kind, event.value))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, value = item
+            stream = self.stream or sys.stdout
+            stream.write(self.messages[kind].format(value=value) + '\n')
+            if self.queue.empty():
+                stream.flush()
+
+    def close(self, timeout=1.0):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
@@ -0,0 +1,149 @@
+import csv
+import gc
+import time
+from collections import deque
+
+try:
+    from OpenGL import _configflags
+    from OpenGL import profiler
+except ImportError:
+    profiler = None
+
+
+class FrameStats:
+    """Collects per-frame timings and counters for the HUD overlay and CSV export.
+
+    beginFrame() opens a frame record and endFrame() closes it, so the
+    simulation tick and the render that follows it land in the same record;
+    frameMs runs from the end of the previous frame. Inside a frame, time is
+    split into named sections ('sim', 'render', 'swap') with beginSection()/
+    endSection(). Plain counters (draw calls, visible objects, particles, ...)
+    are set with count() or accumulated with add(), e.g. the vertices each
+    draw submits. GL call counts come from OpenGL.profiler, so they are only
+    available when PYOPENGL_PROFILING is set. close() stops the collection.
+    """
+
+    SECTIONS = ('sim', 'render', 'swap')
+    GRAPH_LENGTH = 120
+
+    def __init__(self):
+        self.history = deque(maxlen=self.GRAPH_LENGTH)
+        self.current = self._emptyFrame()
+        self.last = self._emptyFrame()
+        self.frameStart = None
+        self.sectionStart = {}
+        self.frameNumber = 0
+        self.csvFile = None
+        self.csvWriter = None
+        self.gcStart = None
+        self.gcPause = 0.0
+        self.gcCollections = 0
+        gc.callbacks.append(self._gcCallback)
+        self.profiling = profiler is not None and _configflags.PROFILING
+        if self.profiling:
+            profiler.start()
+        self.lastCalls = 0
+
+    def _emptyFrame(self):
+        frame = {'frame': 0, 'frameMs': 0.0}
+        for section in self.SECTIONS:
+            frame[section + 'Ms'] = 0.0
+        return frame
+
+    def _gcCallback(self, phase, info):
+        if phase == 'start':
+            self.gcStart = time.perf_counter()
+        elif self.gcStart is not None:
+            self.gcPause += time.perf_counter() - self.gcStart
+            self.gcCollections += 1
+            self.gcStart = None
+
+    def beginSection(self, name):
+        self.sectionStart[name] = time.perf_counter()
+
+    def endSection(self, name):
+        start = self.sectionStart.pop(name, None)
+        if start is not None:
+            key = name + 'Ms'
+            self.current[key] = self.current.get(key, 0.0) + (time.perf_counter() - start) * 1000.0
+
+    def count(self, name, value):
+        self.current[name] = value
+
+    def add(self, name, value):
+        self.current[name] = self.current.get(name, 0) + value
+
+    def _glCalls(self):
+        """GL calls recorded by the profiler since the previous frame."""
+        calls = sum(stats.count for stats in profiler.PROFILER.stats())
+        result = calls - self.lastCalls
+        self.lastCalls = calls
+        return result
+
+    def beginFrame(self):
+        """Starts timing the first frame; later frames start where the previous one ended."""
+        if self.frameStart is None:
+            self.frameStart = time.perf_counter()
+
+    def endFrame(self):
+        """Closes the current frame record and starts the next one."""
+        now = time.perf_counter()
+        frame = self.current
+        frame['frame'] = self.frameNumber
+        frame['frameMs'] = (now - (self.frameStart or now)) * 1000.0
+        frame['gcPauseMs'] = self.gcPause * 1000.0
+        frame['gcCollections'] = self.gcCollections
+        if self.profiling:
+            frame['glCalls'] = self._glCalls()
+        self.last = frame
+        self.history.append(frame['frameMs'])
+        if self.csvWriter is not None:
+            self.csvWriter.writerow(frame)
+        self.frameNumber += 1
+        self.current = self._emptyFrame()
+        self.gcPause = 0.0
+        self.gcCollections = 0
+        self.frameStart = now
+
+    def startCsv(self, path):
+        """Starts writing one row per frame to path for the rest of the session."""
+        self.stopCsv()
+        self.csvFile = open(path, 'w', newline='')
+        fields = (['frame', 'frameMs'] + [section + 'Ms' for section in self.SECTIONS] +
+                  ['gcPauseMs', 'gcCollections', 'glCalls', 'vertices', 'drawCalls', 'stateChanges',
+                   'visible', 'culled', 'occluded', 'queries', 'queryLatencyFrames', 'queryLatencyMs', 'particles',
+                   'entities', 'events', 'gpuMs', 'renderScale'])
+        self.csvWriter = csv.DictWriter(self.csvFile, fields, extrasaction='ignore', restval='')
+        self.csvWriter.writeheader()
+        return path
+
+    def stopCsv(self):
+        if self.csvFile is not None:
+            self.csvFile.close()
+        self.csvFile = self.csvWriter = None
+
+    def close(self):
+        """Stops the CSV export and removes the garbage collector callback."""
+        self.stopCsv()
+        if self._gcCallback in gc.callbacks:
+            gc.callbacks.remove(self._gcCallback)
+
+    def lines(self):
+        """Text lines describing the last completed frame."""
+        frame = self.last
+        fps = 1000.0 / frame['frameMs'] if frame['frameMs'] else 0.0
+        glCalls = '%d' % frame['glCalls'] if 'glCalls' in frame else 'n/a'
+        gpu = '%.2f ms' % frame['gpuMs'] if frame.get('gpuMs') is not None else 'n/a'
+        latency = '%.1f frames' % frame['queryLatencyFrames'] if frame.get('queryLatencyFrames') is not None else 'n/a'
+        return [
+            'Frame %.2f ms (%.0f fps)' % (frame['frameMs'], fps),
+            'Sim %.2f  Render %.2f  Swap %.2f ms' % (frame['simMs'], frame['renderMs'], frame['swapMs']),
+            'Draws %s  State changes %s  GL calls %s' % (frame.get('drawCalls', 0), frame.get('stateChanges', 0), glCalls),
+            'Vertices %s  Visible %s  Culled %s  Occluded %s' % (frame.get('vertices', 0), frame.get('visible', 0),
+                                                               frame.get('culled', 0), frame.get('occluded', 0)),
+            'Particles %s  Entities %s  Queries %s (%s)' % (frame.get('particles', 0), frame.get('entities', 0),
+                                                           frame.get('queries', 0), latency),
+            'GC %.2f ms (%d)  GPU %s  Scale %d%%%s' % (
+                frame.get('gcPauseMs', 0.0), frame.get('gcCollections', 0), gpu,
+                frame.get('renderScale', 1.0) * 100, '  [CSV]' if self.csvWriter is not None else ''),
+        ]
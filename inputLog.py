@@ -0,0 +1,97 @@
+import atexit
+import struct
+
+MAGIC = b'INPT'
+VERSION = 1
+HEADER = struct.Struct('<4sHQQd')  # magic, version, world seed, simulation seed, start time
+
+# Record kinds; every record is one kind byte followed by the kind's payload
+TICK, KEY_DOWN, KEY_UP, MOUSE_BUTTON, MOUSE_LOOK = range(5)
+RECORDS = {
+    TICK: struct.Struct('<dI'),  # simulation time, state checksum
+    KEY_DOWN: struct.Struct('<c'),  # key
+    KEY_UP: struct.Struct('<c'),
+    MOUSE_BUTTON: struct.Struct('<BB'),  # button, state
+    MOUSE_LOOK: struct.Struct('<hh'),  # pointer movement in pixels
+}
+
+
+class InputRecorder:
+    """Writes the input of a session to a compact binary log.
+
+    The log starts with the seeds and clock needed to recreate the initial
+    simulation state. Input events are recorded as they arrive; tick()
+    closes the events of one simulation tick, so an event belongs to the
+    tick recorded after it. Each tick stores the simulation time the tick
+    ran with and a checksum of the state the tick started from, which lets
+    a replay detect exactly where it diverged.
+    """
+
+    def __init__(self, path, worldSeed, simulationSeed, startTime):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, worldSeed, simulationSeed, startTime))
+        self.ticks = 0
+        self.events = 0
+        atexit.register(self.close)
+
+    def record(self, kind, *args):
+        self.file.write(bytes((kind,)) + RECORDS[kind].pack(*args))
+        self.events += 1
+
+    def tick(self, simulationTime, checksum=0):
+        self.file.write(bytes((TICK,)) + RECORDS[TICK].pack(simulationTime, checksum))
+        self.ticks += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class InputPlayer:
+    """Reads back a log written by InputRecorder, one tick at a time.
+
+    The whole log is loaded up front, so replaying does no I/O.
+    worldSeed, simulationSeed and startTime come from the header.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self.data = handle.read()
+        magic, version, self.worldSeed, self.simulationSeed, self.startTime = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d input log' % (path, VERSION))
+        self.offset = HEADER.size
+        self.ticks = 0
+        self.mismatches = 0
+        self.firstMismatch = None  # index of the first tick whose checksum differed
+
+    @property
+    def finished(self):
+        return self.offset >= len(self.data)
+
+    def readTick(self):
+        """(simulation time, checksum, [(kind, args), ...]) of the next tick, or None at the end of the log."""
+        data, offset = self.data, self.offset
+        events = []
+        while offset < len(data):
+            kind = data[offset]
+            record = RECORDS.get(kind)
+            if record is None:
+                raise ValueError('Corrupt input log: unknown record %d at byte %d' % (kind, offset))
+            args = record.unpack_from(data, offset + 1)
+            offset += 1 + record.size
+            if kind == TICK:
+                self.offset = offset
+                self.ticks += 1
+                return args[0], args[1], events
+            events.append((kind, args))
+        # events after the last tick never ran (the session ended before the next tick)
+        self.offset = offset
+        return None
+
+    def check(self, checksum, expected):
+        if checksum != expected:
+            if self.firstMismatch is None:
+                self.firstMismatch = self.ticks - 1
+            self.mismatches += 1
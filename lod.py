@@ -0,0 +1,145 @@
+import math
+
+from OpenGL.GL import (glPushAttrib, glPopAttrib, glPushMatrix, glPopMatrix, glLoadIdentity, glOrtho, glViewport,
+                       glClearColor, glClear, glEnable, glDisable, glReadPixels, glGetIntegerv, glGenTextures,
+                       glBindTexture, glTexImage2D, glTexParameteri, glNewList, glEndList,
+                       glAlphaFunc, glColor3f, glBegin, glEnd, glTexCoord2f, glVertex3f, glNormal3f,
+                       GL_ALL_ATTRIB_BITS, GL_PROJECTION, GL_MODELVIEW, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT,
+                       GL_DEPTH_TEST, GL_CULL_FACE, GL_BLEND, GL_RGBA, GL_UNSIGNED_BYTE, GL_VIEWPORT, GL_TEXTURE_2D,
+                       GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_LINEAR,
+                       GL_CLAMP_TO_EDGE, GL_COMPILE, GL_ALPHA_TEST, GL_GREATER, GL_QUADS, GL_ENABLE_BIT,
+                       GL_TEXTURE_BIT)
+from OpenGL.GL.statecache import getStateCache
+
+
+def pixelsPerUnit(viewportHeight, fovY):
+    """Screen pixels covered by one world unit at distance 1 for a perspective projection."""
+    return viewportHeight / (2.0 * math.tan(math.radians(fovY) / 2.0))
+
+
+def projectedSize(size, distance, pixelsPerUnit):
+    """Approximate on-screen size in pixels of an object size units across at distance."""
+    return size * pixelsPerUnit / max(distance, size * 0.5, 1e-6)
+
+
+class LodSelector:
+    """Chooses a level of detail from an object's projected size, with hysteresis.
+
+    thresholds are projected sizes in pixels, largest first: an object at least
+    thresholds[0] pixels big is drawn at level 0, one at least thresholds[1] at
+    level 1 and so on, anything smaller at level len(thresholds). To avoid
+    popping back and forth at a boundary, an object only changes level once its
+    size is past the boundary by the hysteresis fraction.
+    """
+
+    def __init__(self, thresholds, hysteresis=0.2):
+        self.thresholds = tuple(thresholds)
+        self.hysteresis = hysteresis
+        self.levels = len(self.thresholds) + 1
+
+    def _level(self, pixels, scale):
+        level = 0
+        for threshold in self.thresholds:
+            if pixels >= threshold * scale:
+                break
+            level += 1
+        return level
+
+    def select(self, pixels, previous=None):
+        level = self._level(pixels, 1.0)
+        if previous is None or level == previous:
+            return level
+        if level > previous:
+            return max(previous, self._level(pixels, 1.0 - self.hysteresis))
+        return min(previous, self._level(pixels, 1.0 + self.hysteresis))
+
+
+class Impostor:
+    """Billboard stand-in for a far-away mesh.
+
+    capture() renders draw() once from the side with an orthographic camera
+    into the back buffer and turns it into an RGBA texture, keying out the
+    background color. compile() records two crossed textured quads (so the
+    billboard needs no per-frame orientation and can live in static display
+    lists) drawn with alpha testing, so impostors stay in the opaque pass.
+
+    bounds -- (halfWidth, bottom, top) of the mesh in its local coordinates
+    """
+
+    KEY_COLOR = (255, 0, 255)
+    VERTICES = 8  # of the two crossed quads compile() records
+
+    def __init__(self, draw, bounds, resolution=(64, 128)):
+        self.draw = draw
+        self.bounds = bounds
+        self.resolution = resolution
+        self.texture = None
+
+    def capture(self):
+        halfWidth, bottom, top = self.bounds
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        width, height = min(self.resolution[0], viewport[2]), min(self.resolution[1], viewport[3])
+        state = getStateCache()
+        state.pushAttrib(GL_ALL_ATTRIB_BITS)
+        state.matrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(-halfWidth, halfWidth, bottom, top, -100.0, 100.0)
+        state.matrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glViewport(0, 0, width, height)
+        glClearColor(*[c / 255.0 for c in self.KEY_COLOR] + [1.0])
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        state.enable(GL_DEPTH_TEST)
+        state.disable(GL_CULL_FACE)
+        state.disable(GL_BLEND)
+        self.draw()
+        pixels = bytearray(glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE))
+        glPopMatrix()
+        state.matrixMode(GL_PROJECTION)
+        glPopMatrix()
+        state.matrixMode(GL_MODELVIEW)
+        state.popAttrib()
+        key = bytes(self.KEY_COLOR)
+        for offset in range(0, len(pixels), 4):
+            pixels[offset + 3] = 0 if pixels[offset:offset + 3] == key else 255
+        self.texture = glGenTextures(1)
+        state.bindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, bytes(pixels))
+        state.bindTexture(GL_TEXTURE_2D, 0)
+        return self.texture
+
+    def compile(self, listId):
+        """Records the crossed quads as display list listId (capture() must have run).
+
+        The state changes are recorded, not executed, so they bypass the state cache; the
+        list restores what it changes with glPushAttrib/glPopAttrib.
+        """
+        halfWidth, bottom, top = self.bounds
+        glNewList(listId, GL_COMPILE)
+        glPushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_TEXTURE_BIT)
+        glEnable(GL_TEXTURE_2D)
+        glEnable(GL_ALPHA_TEST)
+        glAlphaFunc(GL_GREATER, 0.5)
+        glDisable(GL_CULL_FACE)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glColor3f(1.0, 1.0, 1.0)
+        glBegin(GL_QUADS)
+        glNormal3f(0.0, 0.0, 1.0)
+        glTexCoord2f(0, 0); glVertex3f(-halfWidth, bottom, 0)
+        glTexCoord2f(1, 0); glVertex3f(halfWidth, bottom, 0)
+        glTexCoord2f(1, 1); glVertex3f(halfWidth, top, 0)
+        glTexCoord2f(0, 1); glVertex3f(-halfWidth, top, 0)
+        glNormal3f(1.0, 0.0, 0.0)
+        glTexCoord2f(0, 0); glVertex3f(0, bottom, halfWidth)
+        glTexCoord2f(1, 0); glVertex3f(0, bottom, -halfWidth)
+        glTexCoord2f(1, 1); glVertex3f(0, top, -halfWidth)
+        glTexCoord2f(0, 1); glVertex3f(0, top, halfWidth)
+        glEnd()
+        glPopAttrib()
+        glEndList()
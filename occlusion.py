@@ -0,0 +1,220 @@
+import time
+from array import array
+
+from OpenGL.GL import (glGetFloatv, glGenQueries, glDeleteQueries, glBeginQuery, glEndQuery, glGetQueryObjectuiv, glPushAttrib,
+                       glPopAttrib, glPushClientAttrib, glPopClientAttrib, glColorMask, glDepthMask, glDisable,
+                       glGenBuffers, glDeleteBuffers, glBindBuffer, glBufferData, glVertexPointer,
+                       glEnableClientState, glDrawArrays, GL_SAMPLES_PASSED, GL_ANY_SAMPLES_PASSED, GL_QUERY_RESULT,
+                       GL_QUERY_RESULT_AVAILABLE, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_ENABLE_BIT,
+                       GL_LIGHTING, GL_TEXTURE_2D, GL_BLEND, GL_CLIENT_VERTEX_ARRAY_BIT, GL_ARRAY_BUFFER,
+                       GL_STREAM_DRAW, GL_VERTEX_ARRAY, GL_FLOAT, GL_QUADS, GL_MODELVIEW_MATRIX,
+                       GL_PROJECTION_MATRIX)
+from OpenGL.GL.ARB.occlusion_query2 import glInitOcclusionQuery2ARB
+from OpenGL.GL.primitives import CUBE_FACES
+
+BOX_VERTICES = 24  # GL_QUADS, 4 per face
+
+
+def boxVertices(box):
+    """Outward-facing GL_QUADS of the box (minX, minY, minZ, maxX, maxY, maxZ) as flat floats."""
+    low, high = box[:3], box[3:]
+    vertices = array('f')
+    for normal, corners in CUBE_FACES:
+        for corner in corners:
+            vertices.extend(high[axis] if corner[axis] > 0 else low[axis] for axis in range(3))
+    return vertices
+
+
+def frustumPlanes(modelview, projection):
+    """(a, b, c, d) of the left, right, bottom, top and near planes, a*x + b*y + c*z + d >= 0 inside.
+
+    modelview and projection are 4x4 matrices as returned by glGetFloatv
+    (column-major, i.e. m[column][row]).
+    """
+    rows = [[sum(projection[k][row] * modelview[column][k] for k in range(4)) for column in range(4)]
+            for row in range(4)]
+    planes = []
+    for row, sign in ((0, 1), (0, -1), (1, 1), (1, -1), (2, 1)):
+        planes.append(tuple(rows[3][i] + sign * rows[row][i] for i in range(4)))
+    return planes
+
+
+def boxOutside(box, planes):
+    """True when the box is entirely on the outer side of one of the planes."""
+    minX, minY, minZ, maxX, maxY, maxZ = box
+    for a, b, c, d in planes:
+        # the corner furthest along the plane normal
+        if (a * (maxX if a > 0 else minX) + b * (maxY if b > 0 else minY) + c * (maxZ if c > 0 else minZ) + d) < 0:
+            return True
+    return False
+
+
+class _CellState:
+    __slots__ = ('visible', 'query', 'issuedFrame', 'issuedTime', 'lastQueried', 'lastSeen', 'vertices')
+
+    def __init__(self, cell, frame):
+        self.vertices = boxVertices(cell.box)
+        self.visible = True  # never tested: assume visible
+        self.query = None  # pending query, if any
+        self.issuedFrame = self.issuedTime = None
+        self.lastQueried = None
+        self.lastSeen = frame
+
+
+class OcclusionCuller:
+    """Skips world cells that were hidden behind other geometry in an earlier frame.
+
+    Each frame, filter() takes the cells that passed distance culling and
+    returns those to draw. Cells outside the view frustum of the current
+    matrices are dropped first, without a query (a query would only report
+    them hidden), and are treated as untested when they come back. After the opaque scene has been drawn,
+    issueQueries() draws the bounding box (Cell.box) of cells that need a new
+    test inside an occlusion query, with color and depth writes off; the
+    boxes are streamed into one buffer so each test is a single draw. The
+    results are only read once the GPU reports them available, so nothing
+    ever waits: a cell's visibility is whatever its latest finished query
+    said, typically from one or two frames earlier. Hidden cells are
+    re-tested every frame so they reappear as soon as they come into view;
+    visible cells are only re-tested every queryInterval frames. Cells whose
+    box contains the eye (within nearMargin, so the near plane does not clip
+    the box) are always drawn.
+
+    available is False when the implementation has no occlusion queries, in
+    which case filter() returns its input unchanged; so does a culler with
+    enabled set to False.
+    """
+
+    # Cells not passed to filter() for this many frames are forgotten
+    FORGET_FRAMES = 60
+
+    def __init__(self, queryInterval=4, nearMargin=1.0):
+        self.available = bool(glGenQueries)
+        self.target = GL_ANY_SAMPLES_PASSED if self.available and glInitOcclusionQuery2ARB() else GL_SAMPLES_PASSED
+        self.enabled = True
+        self.queryInterval = queryInterval
+        self.nearMargin = nearMargin
+        self.states = {}  # Cell -> _CellState
+        self.pending = []  # cells with a query in flight, oldest first
+        self.free = []
+        self.toQuery = []
+        self.buffer = None
+        self.frame = 0
+        self.stats = {'queries': 0, 'occluded': 0, 'outside': 0, 'latencyFrames': None, 'latencyMs': None}
+
+    def _eyeInside(self, box, eye):
+        margin = self.nearMargin
+        minX, minY, minZ, maxX, maxY, maxZ = box
+        return (minX - margin <= eye[0] <= maxX + margin and minY - margin <= eye[1] <= maxY + margin and
+                minZ - margin <= eye[2] <= maxZ + margin)
+
+    def _collect(self):
+        """Reads every finished query without waiting for the unfinished ones."""
+        now = time.perf_counter()
+        frames = seconds = results = 0
+        stillPending = []
+        for cell in self.pending:
+            state = self.states[cell]
+            if not glGetQueryObjectuiv(state.query, GL_QUERY_RESULT_AVAILABLE):
+                stillPending.append(cell)
+                continue
+            state.visible = glGetQueryObjectuiv(state.query, GL_QUERY_RESULT) > 0
+            self.free.append(state.query)
+            state.query = None
+            frames += self.frame - state.issuedFrame
+            seconds += now - state.issuedTime
+            results += 1
+        self.pending = stillPending
+        if results:
+            self.stats['latencyFrames'] = frames / float(results)
+            self.stats['latencyMs'] = seconds * 1000.0 / results
+
+    def filter(self, cells, eye):
+        """The cells to draw this frame; also decides which cells issueQueries() tests."""
+        self.frame += 1
+        del self.toQuery[:]
+        self.stats['queries'] = self.stats['occluded'] = self.stats['outside'] = 0
+        if not (self.available and self.enabled):
+            return cells
+        self._collect()
+        planes = frustumPlanes(glGetFloatv(GL_MODELVIEW_MATRIX), glGetFloatv(GL_PROJECTION_MATRIX))
+        frame = self.frame
+        drawn = []
+        occluded = outside = 0
+        for cell in cells:
+            state = self.states.get(cell)
+            if state is None:
+                state = self.states[cell] = _CellState(cell, frame)
+            state.lastSeen = frame
+            if boxOutside(cell.box, planes):
+                state.visible, state.lastQueried = True, None
+                outside += cell.count
+                continue
+            if self._eyeInside(cell.box, eye):
+                state.visible = True
+            elif state.query is None and (not state.visible or state.lastQueried is None or
+                                          frame - state.lastQueried >= self.queryInterval):
+                self.toQuery.append(cell)
+            if state.visible:
+                drawn.append(cell)
+            else:
+                occluded += cell.count
+        self.stats['occluded'], self.stats['outside'] = occluded, outside
+        if frame % self.FORGET_FRAMES == 0:
+            self.states = dict((cell, state) for cell, state in self.states.items()
+                               if state.query is not None or frame - state.lastSeen < self.FORGET_FRAMES)
+        return drawn
+
+    def issueQueries(self):
+        """Tests the bounding boxes chosen by filter() against the depth buffer drawn so far."""
+        if not self.toQuery:
+            return
+        if self.buffer is None:
+            self.buffer = int(glGenBuffers(1))
+        vertices = array('f')
+        for cell in self.toQuery:
+            vertices.extend(self.states[cell].vertices)
+        now = time.perf_counter()
+        glPushAttrib(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_ENABLE_BIT)
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glColorMask(False, False, False, False)
+        glDepthMask(False)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glDisable(GL_BLEND)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        glBufferData(GL_ARRAY_BUFFER, len(vertices) * 4, vertices.tobytes(), GL_STREAM_DRAW)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        for index, cell in enumerate(self.toQuery):
+            if not self.free:
+                self.free.extend(int(query) for query in glGenQueries(16))
+            state = self.states[cell]
+            state.query = self.free.pop()
+            state.issuedFrame = state.lastQueried = self.frame
+            state.issuedTime = now
+            glBeginQuery(self.target, state.query)
+            glDrawArrays(GL_QUADS, index * BOX_VERTICES, BOX_VERTICES)
+            glEndQuery(self.target)
+            self.pending.append(cell)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glPopClientAttrib()
+        glPopAttrib()
+        self.stats['queries'] = len(self.toQuery)
+        del self.toQuery[:]
+
+    def clear(self):
+        """Forgets every cell, e.g. after the world was regenerated; queries in flight are recycled."""
+        for cell in self.pending:
+            self.free.append(self.states[cell].query)
+        del self.pending[:]
+        del self.toQuery[:]
+        self.states.clear()
+
+    def delete(self):
+        self.clear()
+        if self.free:
+            glDeleteQueries(len(self.free), self.free)
+        self.free = []
+        if self.buffer is not None:
+            glDeleteBuffers(1, [self.buffer])
+            self.buffer = None
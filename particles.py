@@ -0,0 +1,383 @@
+import ctypes
+from array import array
+from collections import deque
+
+from OpenGL.GL import (glCreateProgram, glAttachShader, glBindAttribLocation, glTransformFeedbackVaryings,
+                       glLinkProgram, glGetProgramiv, glGetProgramInfoLog, glUseProgram, glGetUniformLocation,
+                       glUniform1f, glUniform3f, glGenBuffers, glBindBuffer, glBufferData, glBufferSubData,
+                       glBindBufferRange, glBindBufferBase, glEnableVertexAttribArray, glDisableVertexAttribArray, glVertexAttribPointer,
+                       glDrawArrays, glBeginTransformFeedback, glEndTransformFeedback, glEnable, glDisable,
+                       glDeleteBuffers, glDeleteProgram, glPushAttrib, glPopAttrib, glPushClientAttrib,
+                       glPopClientAttrib, glEnableClientState, glVertexPointer, glColorPointer, glPointSize,
+                       glPointParameterfv, GL_VERTEX_SHADER, GL_FRAGMENT_SHADER, GL_LINK_STATUS,
+                       GL_INTERLEAVED_ATTRIBS, GL_ARRAY_BUFFER, GL_TRANSFORM_FEEDBACK_BUFFER, GL_DYNAMIC_COPY,
+                       GL_STREAM_DRAW, GL_FLOAT, GL_POINTS, GL_RASTERIZER_DISCARD, GL_VERTEX_PROGRAM_POINT_SIZE,
+                       GL_POINT_SPRITE, GL_ENABLE_BIT, GL_POINT_BIT, GL_CLIENT_VERTEX_ARRAY_BIT, GL_VERTEX_ARRAY,
+                       GL_COLOR_ARRAY, GL_LIGHTING, GL_TEXTURE_2D, GL_POINT_SMOOTH, GL_POINT_DISTANCE_ATTENUATION)
+from OpenGL.GL.shaders import compileShader
+from OpenGL.arrays import GLfloatArray
+from OpenGL.error import NullFunctionError, GLError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Every particle is 8 floats: position xyz, velocity xyz, remaining life, total life
+RECORD_FLOATS = 8
+RECORD_BYTES = RECORD_FLOATS * 4
+ATTRIBUTES = ('position', 'velocity', 'life')
+ATTRIBUTE_LAYOUT = ((3, 0), (3, 12), (2, 24))  # (components, byte offset) per attribute
+
+UPDATE_SHADER = '''#version 120
+attribute vec3 position;
+attribute vec3 velocity;
+attribute vec2 life;
+uniform float dt;
+uniform float gravity;
+varying vec3 outPosition;
+varying vec3 outVelocity;
+varying vec2 outLife;
+void main() {
+    outPosition = position + velocity * dt;
+    outVelocity = velocity - vec3(0.0, gravity * dt, 0.0);
+    outLife = vec2(life.x - dt, life.y);
+    gl_Position = vec4(0.0);
+}
+'''
+UPDATE_VARYINGS = (b'outPosition', b'outVelocity', b'outLife')
+
+DRAW_VERTEX_SHADER = '''#version 120
+attribute vec3 position;
+attribute vec2 life;
+uniform float pixelScale;
+uniform float size;
+uniform vec3 color;
+varying vec4 particleColor;
+void main() {
+    if (life.x <= 0.0) {
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);  // dead: outside the clip volume
+        gl_PointSize = 0.0;
+        particleColor = vec4(0.0);
+        return;
+    }
+    float ratio = min(life.x / life.y, 1.0);
+    vec4 eye = gl_ModelViewMatrix * vec4(position, 1.0);
+    gl_Position = gl_ProjectionMatrix * eye;
+    gl_PointSize = 2.0 * size * ratio * pixelScale / max(-eye.z, 0.001);
+    particleColor = vec4(color, ratio);
+}
+'''
+DRAW_FRAGMENT_SHADER = '''#version 120
+varying vec4 particleColor;
+void main() {
+    vec2 offset = gl_PointCoord * 2.0 - 1.0;
+    float falloff = 1.0 - smoothstep(0.6, 1.0, dot(offset, offset));
+    gl_FragColor = vec4(particleColor.rgb, particleColor.a * falloff);
+}
+'''
+
+
+def _linkProgram(vertexSource, fragmentSource=None, varyings=()):
+    """Links a program with ATTRIBUTES at fixed locations, capturing varyings for transform feedback."""
+    program = glCreateProgram()
+    glAttachShader(program, compileShader(vertexSource, GL_VERTEX_SHADER))
+    if fragmentSource is not None:
+        glAttachShader(program, compileShader(fragmentSource, GL_FRAGMENT_SHADER))
+    for location, name in enumerate(ATTRIBUTES):
+        glBindAttribLocation(program, location, name)
+    if varyings:
+        # The wrapper has no converter for a list of names, so pass the char** ourselves
+        names = (ctypes.c_char_p * len(varyings))(*varyings)
+        glTransformFeedbackVaryings(program, len(varyings),
+                                    ctypes.cast(names, ctypes.POINTER(ctypes.POINTER(ctypes.c_char))),
+                                    GL_INTERLEAVED_ATTRIBS)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError('Particle program link failure: %s' % (glGetProgramInfoLog(program),))
+    return program
+
+
+def _bindAttributes(buffer, locations):
+    glBindBuffer(GL_ARRAY_BUFFER, buffer)
+    for location in locations:
+        components, offset = ATTRIBUTE_LAYOUT[location]
+        glEnableVertexAttribArray(location)
+        glVertexAttribPointer(location, components, GL_FLOAT, False, RECORD_BYTES, ctypes.c_void_p(offset))
+
+
+def _unbindAttributes(locations):
+    for location in locations:
+        glDisableVertexAttribArray(location)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+class ParticleSystem:
+    """Fixed-capacity ring of simple ballistic particles drawn as point sprites.
+
+    emit() appends particles at the ring's cursor, overwriting the oldest ones
+    once the ring is full. Particles are assumed to die roughly in the order
+    they were emitted, so the live ones are the most recent `alive` records
+    before the cursor; update() and draw() only touch that window, keeping the
+    cost proportional to the live particles rather than the capacity.
+
+    Subclasses keep the particle state in different places (on the GPU,
+    updated by transform feedback, or in host memory) but share the emission
+    bookkeeping, the record layout and the point-sprite rendering.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.cursor = 0
+        self.alive = 0
+        self.time = 0.0
+        self.batches = deque()  # (expiry time, count) per emit() call, oldest first
+        self.drawProgram = self._linkDrawProgram()
+        self.drawUniforms = dict((name, glGetUniformLocation(self.drawProgram, name))
+                                 for name in ('pixelScale', 'size', 'color')) if self.drawProgram else {}
+
+    def _linkDrawProgram(self):
+        return _linkProgram(DRAW_VERTEX_SHADER, DRAW_FRAGMENT_SHADER)
+
+    def emit(self, spawns):
+        """Adds particles from (position, velocity, life) tuples."""
+        spawns = spawns[-self.capacity:]
+        if not spawns:
+            return
+        records = array('f')
+        longest = 0.0
+        for position, velocity, life in spawns:
+            records.extend(position)
+            records.extend(velocity)
+            records.extend((life, life))
+            longest = max(longest, life)
+        count = len(spawns)
+        first = min(count, self.capacity - self.cursor)
+        self._write(self.cursor, records[:first * RECORD_FLOATS])
+        if first < count:
+            self._write(0, records[first * RECORD_FLOATS:])
+        self.cursor = (self.cursor + count) % self.capacity
+        self.batches.append((self.time + longest, count))
+        self.alive = min(self.capacity, self.alive + count)
+
+    def ranges(self):
+        """(first, count) slices of the ring holding the live window."""
+        if not self.alive:
+            return []
+        start = (self.cursor - self.alive) % self.capacity
+        if start + self.alive <= self.capacity:
+            return [(start, self.alive)]
+        return [(start, self.capacity - start), (0, self.alive - (self.capacity - start))]
+
+    def update(self, dt, gravity):
+        """Advances all live particles by dt seconds under downward acceleration gravity."""
+        self.time += dt
+        while self.batches and self.batches[0][0] <= self.time:
+            self.batches.popleft()
+        self.alive = min(self.capacity, sum(count for expiry, count in self.batches))
+        if self.alive:
+            self._simulate(dt, gravity)
+
+    def draw(self, pixelScale, size, color):
+        """Draws the live particles; blending and depth-mask state are left to the caller.
+
+        pixelScale -- pixels per world unit at distance 1 (see lod.pixelsPerUnit)
+        size -- half-width in world units of a particle at the start of its life
+        """
+        if not self.alive:
+            return
+        glPushAttrib(GL_ENABLE_BIT)
+        glEnable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        glEnable(GL_POINT_SPRITE)
+        glUseProgram(self.drawProgram)
+        glUniform1f(self.drawUniforms['pixelScale'], pixelScale)
+        glUniform1f(self.drawUniforms['size'], size)
+        glUniform3f(self.drawUniforms['color'], *color)
+        _bindAttributes(self._drawBuffer(), (0, 2))
+        for first, count in self.ranges():
+            glDrawArrays(GL_POINTS, first, count)
+        _unbindAttributes((0, 2))
+        glUseProgram(0)
+        glPopAttrib()
+
+    def clear(self):
+        self.cursor = self.alive = 0
+        self.batches.clear()
+
+    def delete(self):
+        if self.drawProgram:
+            glDeleteProgram(self.drawProgram)
+
+
+class TransformFeedbackParticles(ParticleSystem):
+    """Particles simulated on the GPU, ping-ponging between two buffers.
+
+    Each update() runs the live window through UPDATE_SHADER with rasterization
+    disabled, capturing the results into the same slots of the other buffer,
+    which then becomes the current one. The CPU only uploads new particles.
+    Needs OpenGL 3.0; raises RuntimeError (or NullFunctionError) otherwise.
+    """
+
+    def __init__(self, capacity):
+        if not (glBeginTransformFeedback and glTransformFeedbackVaryings):
+            raise NullFunctionError('Transform feedback is not available')
+        ParticleSystem.__init__(self, capacity)
+        self.updateProgram = _linkProgram(UPDATE_SHADER, varyings=UPDATE_VARYINGS)
+        self.updateUniforms = dict((name, glGetUniformLocation(self.updateProgram, name))
+                                   for name in ('dt', 'gravity'))
+        self.buffers = [int(buffer) for buffer in glGenBuffers(2)]
+        for buffer in self.buffers:
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, capacity * RECORD_BYTES, None, GL_DYNAMIC_COPY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.current = 0
+
+    def _write(self, first, records):
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffers[self.current])
+        glBufferSubData(GL_ARRAY_BUFFER, first * RECORD_BYTES, len(records) * 4, records.tobytes())
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _simulate(self, dt, gravity):
+        source, target = self.buffers[self.current], self.buffers[1 - self.current]
+        glUseProgram(self.updateProgram)
+        glUniform1f(self.updateUniforms['dt'], dt)
+        glUniform1f(self.updateUniforms['gravity'], gravity)
+        glEnable(GL_RASTERIZER_DISCARD)
+        _bindAttributes(source, (0, 1, 2))
+        for first, count in self.ranges():
+            glBindBufferRange(GL_TRANSFORM_FEEDBACK_BUFFER, 0, target, first * RECORD_BYTES, count * RECORD_BYTES)
+            glBeginTransformFeedback(GL_POINTS)
+            glDrawArrays(GL_POINTS, first, count)
+            glEndTransformFeedback()
+        glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, 0)
+        _unbindAttributes((0, 1, 2))
+        glDisable(GL_RASTERIZER_DISCARD)
+        glUseProgram(0)
+        self.current = 1 - self.current
+
+    def _drawBuffer(self):
+        return self.buffers[self.current]
+
+    def delete(self):
+        ParticleSystem.delete(self)
+        glDeleteProgram(self.updateProgram)
+        glDeleteBuffers(2, self.buffers)
+
+
+class CpuParticles(ParticleSystem):
+    """Particles simulated in host memory (vectorized with numpy when it is installed).
+
+    The live window is uploaded to a streaming buffer before drawing, so the
+    rendering matches TransformFeedbackParticles. Without GLSL the particles
+    are drawn as fixed-function round points from client-side arrays, sized
+    with distance attenuation and faded (but not shrunk) over their life.
+    """
+
+    def __init__(self, capacity):
+        ParticleSystem.__init__(self, capacity)
+        self.data = bytearray(capacity * RECORD_BYTES)
+        self.floats = memoryview(self.data).cast('f')
+        self.records = numpy.frombuffer(self.data, numpy.float32).reshape(capacity, RECORD_FLOATS) \
+            if numpy is not None else None
+        self.buffer = None
+        if self.drawProgram:
+            self.buffer = int(glGenBuffers(1))
+            glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+            glBufferData(GL_ARRAY_BUFFER, capacity * RECORD_BYTES, None, GL_STREAM_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _linkDrawProgram(self):
+        try:
+            return ParticleSystem._linkDrawProgram(self)
+        except (RuntimeError, GLError, NullFunctionError) as error:
+            print("Particles drawn without shaders: %s" % (error,))
+            return None
+
+    def _write(self, first, records):
+        self.data[first * RECORD_BYTES:first * RECORD_BYTES + len(records) * 4] = records.tobytes()
+
+    def _simulate(self, dt, gravity):
+        for first, count in self.ranges():
+            if self.records is not None:
+                block = self.records[first:first + count]
+                block[:, 0:3] += block[:, 3:6] * dt
+                block[:, 4] -= gravity * dt
+                block[:, 6] -= dt
+                continue
+            floats = self.floats
+            for offset in range(first * RECORD_FLOATS, (first + count) * RECORD_FLOATS, RECORD_FLOATS):
+                floats[offset] += floats[offset + 3] * dt
+                floats[offset + 1] += floats[offset + 4] * dt
+                floats[offset + 2] += floats[offset + 5] * dt
+                floats[offset + 4] -= gravity * dt
+                floats[offset + 6] -= dt
+
+    def _drawBuffer(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        for first, count in self.ranges():
+            start, end = first * RECORD_BYTES, (first + count) * RECORD_BYTES
+            glBufferSubData(GL_ARRAY_BUFFER, start, end - start, bytes(self.data[start:end]))
+        return self.buffer
+
+    def _livePoints(self, color):
+        """Positions and RGBA colors (alpha fading with remaining life) of the live particles."""
+        if self.records is not None:
+            block = numpy.concatenate([self.records[first:first + count] for first, count in self.ranges()])
+            block = block[block[:, 6] > 0.0]
+            colors = numpy.empty((len(block), 4), numpy.float32)
+            colors[:, 0:3] = color
+            colors[:, 3] = numpy.minimum(block[:, 6] / block[:, 7], 1.0)
+            return numpy.ascontiguousarray(block[:, 0:3]), colors
+        positions, colors = [], []
+        floats = self.floats
+        for first, count in self.ranges():
+            for offset in range(first * RECORD_FLOATS, (first + count) * RECORD_FLOATS, RECORD_FLOATS):
+                life, total = floats[offset + 6], floats[offset + 7]
+                if life > 0.0:
+                    positions.append(floats[offset:offset + 3].tolist())
+                    colors.append(tuple(color) + (min(life / total, 1.0),))
+        return GLfloatArray.asArray(positions), GLfloatArray.asArray(colors)
+
+    def draw(self, pixelScale, size, color):
+        if self.drawProgram:
+            return ParticleSystem.draw(self, pixelScale, size, color)
+        if not self.alive:
+            return
+        positions, colors = self._livePoints(color)
+        if not len(positions):
+            return
+        glPushAttrib(GL_ENABLE_BIT | GL_POINT_BIT)
+        glPushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glEnable(GL_POINT_SMOOTH)
+        # the size in pixels at distance 1, divided by the eye distance as the shader does
+        glPointSize(2.0 * size * pixelScale)
+        if glPointParameterfv:
+            glPointParameterfv(GL_POINT_DISTANCE_ATTENUATION, (0.0, 0.0, 1.0))
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, positions)
+        glColorPointer(4, GL_FLOAT, 0, colors)
+        glDrawArrays(GL_POINTS, 0, len(positions))
+        glPopClientAttrib()
+        glPopAttrib()
+
+    def delete(self):
+        ParticleSystem.delete(self)
+        if self.buffer is not None:
+            glDeleteBuffers(1, [self.buffer])
+
+
+def createParticleSystem(capacity, gpu=True):
+    """TransformFeedbackParticles when gpu is set and supported, otherwise CpuParticles.
+
+    CpuParticles falls back to fixed-function points when the point-sprite
+    shaders cannot be linked either, so this works on any context.
+    """
+    if gpu:
+        try:
+            return TransformFeedbackParticles(capacity)
+        except (RuntimeError, GLError, NullFunctionError) as error:
+            print("Particles simulated on the CPU: %s" % (error,))
+    return CpuParticles(capacity)
@@ -0,0 +1,99 @@
+from OpenGL.GL import GL_BLEND
+
+
+class RenderItem:
+    __slots__ = ('stateKey', 'depth', 'draw', 'program', 'texture', 'blend', 'depthMask', 'color')
+
+    def __init__(self, draw, depth, program, texture, blend, depthMask, color):
+        self.draw = draw
+        self.depth = depth
+        self.program = program
+        self.texture = texture
+        self.blend = blend
+        self.depthMask = depthMask
+        self.color = color
+        # Colors are cheap to change, so they only break ties within a state group
+        self.stateKey = (program, texture, blend or (), depthMask)
+
+
+class RenderQueue:
+    """Collects draw closures for a frame and issues them sorted by GL state.
+
+    Opaque items are grouped by (program, texture, blend, depth mask) and drawn
+    front-to-back inside each group; transparent items (those with a blend
+    function) are drawn back-to-front after all opaque items. State is applied
+    through a StateCache so transitions between consecutive items that share
+    state are merged away.
+    """
+
+    def __init__(self, stateCache, textureTarget=None):
+        self.stateCache = stateCache
+        self.textureTarget = textureTarget
+        self.opaque = []
+        self.transparent = []
+        self.eye = (0.0, 0.0, 0.0)
+        self.lastFlush = {'opaque': 0, 'transparent': 0, 'stateChanges': 0}
+
+    def begin(self, eye):
+        """Starts a new frame; depths are measured from eye."""
+        self.eye = tuple(eye)
+        del self.opaque[:]
+        del self.transparent[:]
+
+    def submit(self, draw, position=None, program=0, texture=0, blend=None, depthMask=True, color=None):
+        """Queues draw() to be called at flush time.
+
+        position -- world position used for depth sorting, None sorts as nearest
+        blend -- (sfactor, dfactor) to draw with blending enabled, None for opaque
+        color -- RGB(A) color applied before drawing; when None the draw call is
+                 assumed to set its own colors
+        """
+        if position is None:
+            depth = 0.0
+        else:
+            eye = self.eye
+            depth = (position[0] - eye[0])**2 + (position[1] - eye[1])**2 + (position[2] - eye[2])**2
+        item = RenderItem(draw, depth, program, texture, blend, depthMask, color)
+        if blend is None:
+            self.opaque.append(item)
+        else:
+            self.transparent.append(item)
+        return item
+
+    def flush(self):
+        """Sorts and draws everything submitted since begin()."""
+        self.opaque.sort(key=lambda item: (item.stateKey, item.depth))
+        self.transparent.sort(key=lambda item: (-item.depth, item.stateKey))
+        stateChanges = 0
+        previousKey = None
+        activeProgram = 0
+        state = self.stateCache
+        for item in self.opaque + self.transparent:
+            if item.stateKey != previousKey:
+                stateChanges += 1
+                previousKey = item.stateKey
+                if item.program != activeProgram:
+                    state.useProgram(item.program)
+                    activeProgram = item.program
+                if self.textureTarget is not None:
+                    state.bindTexture(self.textureTarget, item.texture)
+                if item.blend is None:
+                    state.disable(GL_BLEND)
+                else:
+                    state.enable(GL_BLEND)
+                    state.blendFunc(*item.blend)
+                state.depthMask(item.depthMask)
+            if item.color is not None:
+                state.color(*item.color)
+            item.draw()
+            if item.color is None:
+                state.invalidate('color')
+        if activeProgram:
+            state.useProgram(0)
+        state.disable(GL_BLEND)
+        state.depthMask(True)
+        self.lastFlush = {'opaque': len(self.opaque), 'transparent': len(self.transparent),
+                          'stateChanges': stateChanges}
+        del self.opaque[:]
+        del self.transparent[:]
+        return self.lastFlush
@@ -0,0 +1,158 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'SNAP'
+VERSION = 1
+HEADER = struct.Struct('<4sH2xQQ')  # magic, version, length of the encoded state, offset of the prop arrays
+
+# Type tags of the value encoding
+_NONE, _TRUE, _FALSE, _INT, _BIGINT, _FLOAT, _STR, _BYTES, _LIST, _TUPLE, _DICT = b'NTFiIdsbltm'
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+_LENGTH = struct.Struct('<I')
+
+
+def encodeValue(value, out):
+    """Appends value (None, bool, int, float, str, bytes, or lists, tuples and dicts of those) to the bytearray out."""
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        if -2**63 <= value < 2**63:
+            out.append(_INT)
+            out += _INT64.pack(value)
+        else:
+            data = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed=True)
+            out.append(_BIGINT)
+            out += _LENGTH.pack(len(data)) + data
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _FLOAT64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out.append(_STR)
+        out += _LENGTH.pack(len(data)) + data
+    elif isinstance(value, bytes):
+        out.append(_BYTES)
+        out += _LENGTH.pack(len(value)) + value
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST if isinstance(value, list) else _TUPLE)
+        out += _LENGTH.pack(len(value))
+        for item in value:
+            encodeValue(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        out += _LENGTH.pack(len(value))
+        for key, item in value.items():
+            encodeValue(key, out)
+            encodeValue(item, out)
+    else:
+        raise TypeError('Cannot store %r in a snapshot' % (value,))
+    return out
+
+
+def decodeValue(data, offset=0):
+    """(value, offset after it) of the value encoded at offset in data."""
+    tag = data[offset]
+    offset += 1
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT:
+        return _INT64.unpack_from(data, offset)[0], offset + _INT64.size
+    if tag == _FLOAT:
+        return _FLOAT64.unpack_from(data, offset)[0], offset + _FLOAT64.size
+    length, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    if tag == _BIGINT:
+        return int.from_bytes(data[offset:offset + length], 'little', signed=True), offset + length
+    if tag == _STR:
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+    if tag == _BYTES:
+        return bytes(data[offset:offset + length]), offset + length
+    if tag in (_LIST, _TUPLE):
+        items = []
+        for _ in range(length):
+            item, offset = decodeValue(data, offset)
+            items.append(item)
+        return (items if tag == _LIST else tuple(items)), offset
+    if tag == _DICT:
+        result = {}
+        for _ in range(length):
+            key, offset = decodeValue(data, offset)
+            result[key], offset = decodeValue(data, offset)
+        return result, offset
+    raise ValueError('Corrupt snapshot: unknown value tag %r at byte %d' % (bytes((tag,)), offset - 1))
+
+
+def writeSnapshot(path, state, propArrays):
+    """Saves state (plain values, see encodeValue) and a world's prop arrays to path.
+
+    propArrays maps chunk coordinates to {type: flat x, y, z doubles}, as
+    returned by ChunkedWorld.propArrays(). The arrays follow the encoded state
+    as one block of little-endian doubles, 8-byte aligned, so readSnapshot()
+    can copy them straight out of a map of the file. The file is written
+    next to path and renamed over it, so a snapshot being replaced is never
+    seen half written. Returns the size of the file.
+    """
+    index = []
+    block = array('d')
+    for (cx, cz), objects in sorted(propArrays.items()):
+        entry = {}
+        for key, flat in objects.items():
+            entry[key] = (len(block), len(flat))
+            block.extend(flat)
+        index.append((cx, cz, entry))
+    if sys.byteorder != 'little':
+        block.byteswap()
+    encoded = encodeValue((state, index), bytearray())
+    arraysOffset = (HEADER.size + len(encoded) + 7) // 8 * 8
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temporary, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, VERSION, len(encoded), arraysOffset))
+            handle.write(encoded)
+            handle.write(b'\0' * (arraysOffset - HEADER.size - len(encoded)))
+            handle.write(block.tobytes())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return arraysOffset + len(block) * block.itemsize
+
+
+def readSnapshot(path):
+    """(state, propArrays) saved in path by writeSnapshot().
+
+    The prop arrays are memoryviews of the memory-mapped file: a chunk's
+    positions are only paged in (and copied) when the chunk is built, so
+    loading does not depend on the size of the saved world. The views keep
+    the map open; writeSnapshot() replaces the file instead of rewriting it,
+    so saving to the same path leaves them valid.
+    """
+    with open(path, 'rb') as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, stateLength, arraysOffset = HEADER.unpack_from(mapped)
+    if magic != MAGIC or version != VERSION:
+        mapped.close()
+        raise ValueError('%s is not a version %d snapshot' % (path, VERSION))
+    (state, index), _ = decodeValue(memoryview(mapped)[HEADER.size:HEADER.size + stateLength])
+    block = memoryview(mapped)[arraysOffset:].cast('d')
+    if sys.byteorder != 'little':
+        swapped = array('d', block)
+        swapped.byteswap()
+        block = memoryview(swapped)
+    propArrays = {}
+    for cx, cz, entry in index:
+        propArrays[(cx, cz)] = dict((key, block[start:start + count]) for key, (start, count) in entry.items())
+    return state, propArrays
@@ -0,0 +1,301 @@
+import math
+from collections import OrderedDict
+
+from OpenGL.GL import (glGenLists, glNewList, glEndList, glDeleteLists, glCallList, glEnableClientState,
+                       glDisableClientState, glVertexPointer, glNormalPointer, glColorPointer, glDrawElements,
+                       GL_COMPILE, GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_COLOR_ARRAY, GL_FLOAT, GL_TRIANGLES,
+                       GL_UNSIGNED_INT)
+from OpenGL.arrays import GLfloatArray, GLuintArray
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MASK = 0xffffffff
+
+
+def _normalize(vector):
+    length = math.sqrt(sum(v * v for v in vector))
+    return tuple(v / length for v in vector)
+
+
+# Used to bake diffuse shading into the vertex colors
+SUN_DIRECTION = _normalize((0.4, 0.8, 0.45))
+
+
+def _hash(ix, iz, salt):
+    """Lattice value in [-1, 1) for integer coordinates (works on ints and uint64 numpy arrays)."""
+    h = ((ix * 0x27d4eb2d) ^ (iz * 0x165667b1) ^ salt) & MASK
+    h = ((h ^ (h >> 15)) * 0x2c1b3c6d) & MASK
+    h = ((h ^ (h >> 12)) * 0x297a2d39) & MASK
+    h = h ^ (h >> 15)
+    return h / 2147483648.0 - 1.0
+
+
+class HeightField:
+    """Deterministic fractal value noise: height of the ground at any (x, z).
+
+    heightAt() evaluates a single point and is what gameplay code uses;
+    heightGrid() evaluates a whole regular grid at once (vectorized with numpy
+    when it is installed) and gives exactly the same values at the same points.
+    """
+
+    def __init__(self, seed, amplitude=8.0, featureSize=80.0, octaves=4):
+        self.seed = seed & MASK
+        self.amplitude = amplitude
+        self.octaves = []
+        weight, total = 1.0, 0.0
+        for octave in range(octaves):
+            self.octaves.append(((2 ** octave) / featureSize, weight, (self.seed + octave * 0x9e3779b9) & MASK))
+            total += weight
+            weight *= 0.5
+        self.octaves = [(frequency, amplitude * weight / total, salt) for frequency, weight, salt in self.octaves]
+        # Bounds from value differences of up to 2 and smoothstep's peak derivatives (1.5 and 6)
+        self.maxSlope = sum(3.0 * frequency * weight for frequency, weight, salt in self.octaves)
+        self.maxCurvature = sum(12.0 * frequency * frequency * weight for frequency, weight, salt in self.octaves)
+
+    def interpolationError(self, spacing):
+        """Upper bound of the height error of a grid with this spacing (curvature * spacing**2 / 8)."""
+        return self.maxCurvature * spacing * spacing / 8.0
+
+    def heightAt(self, x, z):
+        height = 0.0
+        for frequency, weight, salt in self.octaves:
+            fx, fz = x * frequency, z * frequency
+            ix, iz = math.floor(fx), math.floor(fz)
+            tx, tz = fx - ix, fz - iz
+            tx, tz = tx * tx * (3.0 - 2.0 * tx), tz * tz * (3.0 - 2.0 * tz)
+            a, b = _hash(ix, iz, salt), _hash(ix + 1, iz, salt)
+            c, d = _hash(ix, iz + 1, salt), _hash(ix + 1, iz + 1, salt)
+            top = a + (b - a) * tx
+            bottom = c + (d - c) * tx
+            height += (top + (bottom - top) * tz) * weight
+        return height
+
+    def heightGrid(self, x0, z0, spacing, count):
+        """count x count heights starting at (x0, z0), indexed [row along z][column along x]."""
+        if numpy is None:
+            return [[self.heightAt(x0 + i * spacing, z0 + j * spacing) for i in range(count)] for j in range(count)]
+        steps = numpy.arange(count)
+        xs = (x0 + steps * spacing)[numpy.newaxis, :]
+        zs = (z0 + steps * spacing)[:, numpy.newaxis]
+        height = numpy.zeros((count, count))
+        for frequency, weight, salt in self.octaves:
+            fx, fz = xs * frequency, zs * frequency
+            ix, iz = numpy.floor(fx), numpy.floor(fz)
+            tx, tz = fx - ix, fz - iz
+            tx, tz = tx * tx * (3.0 - 2.0 * tx), tz * tz * (3.0 - 2.0 * tz)
+            # int64 -> uint64 keeps the low 32 bits of negative coordinates like Python's & MASK does
+            ix, iz = ix.astype(numpy.int64).astype(numpy.uint64), iz.astype(numpy.int64).astype(numpy.uint64)
+            one, salt = numpy.uint64(1), numpy.uint64(salt)
+            a, b = _hash(ix, iz, salt), _hash(ix + one, iz, salt)
+            c, d = _hash(ix, iz + one, salt), _hash(ix + one, iz + one, salt)
+            top = a + (b - a) * tx
+            bottom = c + (d - c) * tx
+            height += (top + (bottom - top) * tz) * weight
+        return height
+
+
+class Tile:
+    __slots__ = ('key', 'center', 'listId')
+
+    def __init__(self, key, center, listId):
+        self.key = key  # (x0, z0, size)
+        self.center = center
+        self.listId = listId
+
+
+class Terrain:
+    """Quadtree-LOD renderer for a HeightField.
+
+    Every node of the quadtree is a square tile drawn as the same resolution x
+    resolution grid, so a node's vertex spacing halves with each level. A node
+    is split while the height field's interpolation error at its spacing
+    projects to more than pixelError pixels at its distance from the eye,
+    which makes the vertex count depend on the screen-space error and not on
+    how far the terrain extends. Gaps between neighbouring tiles of different
+    levels are hidden with skirts hanging below the tile edges.
+
+    Only tiles within viewDistance of the eye are drawn. Tiles are compiled into display lists on demand (at most buildsPerFrame
+    per frame, falling back to an already built ancestor) and kept in an LRU
+    cache of cacheTiles entries.
+    """
+
+    def __init__(self, heightField, rootSize=128.0, minTileSize=8.0, resolution=16, pixelError=2.0,
+                 viewDistance=200.0, cacheTiles=256, buildsPerFrame=4, color=(0.1, 0.6, 0.1)):
+        self.heightField = heightField
+        self.rootSize = rootSize
+        self.minTileSize = minTileSize
+        self.resolution = resolution
+        self.pixelError = pixelError
+        self.viewDistance = viewDistance
+        self.cacheTiles = cacheTiles
+        self.buildsPerFrame = buildsPerFrame
+        self.color = color
+        self.tiles = OrderedDict()  # key -> Tile, least recently used first
+        indices = self._indices()
+        self.indices = GLuintArray.asArray(indices)
+        self.indexCount = len(indices)
+        self.stats = {'tiles': 0, 'vertices': 0, 'built': 0}
+
+    def heightAt(self, x, z):
+        return self.heightField.heightAt(x, z)
+
+    def _edges(self):
+        """Grid vertex indices along the four tile edges, each edge in order."""
+        n = self.resolution + 1
+        return ([i for i in range(n)] + [(n - 1) * n + i for i in range(n)] +
+                [j * n for j in range(n)] + [j * n + n - 1 for j in range(n)])
+
+    def _indices(self):
+        n = self.resolution + 1
+        indices = []
+        for j in range(self.resolution):
+            for i in range(self.resolution):
+                a, b, c, d = j * n + i, (j + 1) * n + i, (j + 1) * n + i + 1, j * n + i + 1
+                indices += [a, b, c, a, c, d]
+        skirtStart = n * n
+        edges = self._edges()
+        for edge in range(4):
+            for k in range(self.resolution):
+                top0, top1 = edges[edge * n + k], edges[edge * n + k + 1]
+                low0, low1 = skirtStart + edge * n + k, skirtStart + edge * n + k + 1
+                # Both windings, so the skirt shows whichever side faces the camera
+                indices += [top0, low0, low1, top0, low1, top1, top0, low1, low0, top0, top1, low1]
+        return indices
+
+    def _vertexArrays(self, x0, z0, size):
+        """Positions, normals and colors (flat, float32-able) of the tile with its skirts."""
+        n = self.resolution
+        spacing = size / n
+        # One extra sample on each side for the central-difference normals
+        heights = self.heightField.heightGrid(x0 - spacing, z0 - spacing, spacing, n + 3)
+        skirtDepth = self.heightField.maxSlope * spacing + 0.5
+        edges = self._edges()
+        sun, color = SUN_DIRECTION, self.color
+        if numpy is not None:
+            inner = heights[1:-1, 1:-1]
+            steps = numpy.arange(n + 1) * spacing
+            positions = numpy.empty((n + 1, n + 1, 3), 'f')
+            positions[..., 0] = x0 + steps[numpy.newaxis, :]
+            positions[..., 1] = inner
+            positions[..., 2] = z0 + steps[:, numpy.newaxis]
+            normals = numpy.empty((n + 1, n + 1, 3), 'f')
+            normals[..., 0] = heights[1:-1, :-2] - heights[1:-1, 2:]
+            normals[..., 1] = 2.0 * spacing
+            normals[..., 2] = heights[:-2, 1:-1] - heights[2:, 1:-1]
+            normals /= numpy.sqrt((normals * normals).sum(axis=-1))[..., numpy.newaxis]
+            shade = numpy.clip(normals @ numpy.array(sun, 'f'), 0.0, 1.0) * 0.6 + 0.4
+            colors = shade[..., numpy.newaxis] * numpy.array(color, 'f')
+            positions, normals, colors = positions.reshape(-1, 3), normals.reshape(-1, 3), colors.reshape(-1, 3)
+            skirt = positions[edges]
+            skirt[:, 1] -= skirtDepth
+            return (numpy.concatenate((positions, skirt)), numpy.concatenate((normals, normals[edges])),
+                    numpy.concatenate((colors, colors[edges])))
+        positions, normals, colors = [], [], []
+        for j in range(n + 1):
+            for i in range(n + 1):
+                positions.append((x0 + i * spacing, heights[j + 1][i + 1], z0 + j * spacing))
+                normal = _normalize((heights[j + 1][i] - heights[j + 1][i + 2], 2.0 * spacing,
+                                     heights[j][i + 1] - heights[j + 2][i + 1]))
+                normals.append(normal)
+                shade = min(max(sum(a * b for a, b in zip(normal, sun)), 0.0), 1.0) * 0.6 + 0.4
+                colors.append(tuple(shade * c for c in color))
+        positions += [(positions[k][0], positions[k][1] - skirtDepth, positions[k][2]) for k in edges]
+        normals += [normals[k] for k in edges]
+        colors += [colors[k] for k in edges]
+        flatten = lambda rows: [value for row in rows for value in row]
+        return flatten(positions), flatten(normals), flatten(colors)
+
+    def buildTile(self, key):
+        x0, z0, size = key
+        positions, normals, colors = [GLfloatArray.asArray(array) for array in self._vertexArrays(x0, z0, size)]
+        listId = glGenLists(1)
+        glNewList(listId, GL_COMPILE)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, positions)
+        glNormalPointer(GL_FLOAT, 0, normals)
+        glColorPointer(3, GL_FLOAT, 0, colors)
+        glDrawElements(GL_TRIANGLES, self.indexCount, GL_UNSIGNED_INT, self.indices)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glEndList()
+        self.stats['built'] += 1
+        tile = self.tiles[key] = Tile(key, (x0 + size / 2.0, 0.0, z0 + size / 2.0), listId)
+        return tile
+
+    def select(self, eye, viewportHeight, fovY):
+        """Keys of the quadtree leaves to draw for eye, at most pixelError pixels off on screen."""
+        pixelsPerUnit = viewportHeight / (2.0 * math.tan(math.radians(fovY) / 2.0))
+        amplitude = self.heightField.amplitude
+        root = self.rootSize
+        reach = int(math.ceil(self.viewDistance / root))
+        rootX, rootZ = math.floor(eye[0] / root) * root, math.floor(eye[2] / root) * root
+        stack = [(rootX + i * root, rootZ + j * root, root) for i in range(-reach, reach + 1) for j in range(-reach, reach + 1)]
+        viewDistanceSq = self.viewDistance ** 2
+        leaves = []
+        while stack:
+            x0, z0, size = stack.pop()
+            dx = max(x0 - eye[0], 0.0, eye[0] - x0 - size)
+            dz = max(z0 - eye[2], 0.0, eye[2] - z0 - size)
+            if dx * dx + dz * dz > viewDistanceSq:
+                continue
+            if size > self.minTileSize:
+                dy = max(-amplitude - eye[1], 0.0, eye[1] - amplitude)
+                distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+                error = self.heightField.interpolationError(size / self.resolution)
+                if error * pixelsPerUnit > self.pixelError * max(distance, 1e-6):
+                    half = size / 2.0
+                    stack += [(x0, z0, half), (x0 + half, z0, half), (x0, z0 + half, half), (x0 + half, z0 + half, half)]
+                    continue
+            leaves.append((x0, z0, size))
+        return leaves
+
+    def _cachedAncestor(self, key):
+        x0, z0, size = key
+        while size < self.rootSize:
+            size *= 2.0
+            x0, z0 = math.floor(x0 / size) * size, math.floor(z0 / size) * size
+            if (x0, z0, size) in self.tiles:
+                return self.tiles[(x0, z0, size)]
+        return None
+
+    def visibleTiles(self, eye, viewportHeight, fovY):
+        """Tiles to draw this frame, building missing ones within the per-frame budget."""
+        tiles, seen, builds = [], set(), 0
+        for key in self.select(eye, viewportHeight, fovY):
+            tile = self.tiles.get(key)
+            if tile is None:
+                tile = self._cachedAncestor(key) if builds >= self.buildsPerFrame else None
+                if tile is None:
+                    tile = self.buildTile(key)
+                    builds += 1
+            if tile.key not in seen:
+                seen.add(tile.key)
+                self.tiles.move_to_end(tile.key)
+                tiles.append(tile)
+        self.evict(seen)
+        verticesPerTile = (self.resolution + 1) ** 2 + 4 * (self.resolution + 1)
+        self.stats['tiles'] = len(tiles)
+        self.stats['vertices'] = len(tiles) * verticesPerTile
+        return tiles
+
+    def evict(self, keep=()):
+        """Deletes least recently used tiles (except those in keep) beyond cacheTiles."""
+        for key in list(self.tiles):
+            if len(self.tiles) <= self.cacheTiles:
+                break
+            if key not in keep:
+                glDeleteLists(self.tiles.pop(key).listId, 1)
+
+    def drawTile(self, tile):
+        glCallList(tile.listId)
+
+    def clear(self):
+        for tile in self.tiles.values():
+            glDeleteLists(tile.listId, 1)
+        self.tiles.clear()
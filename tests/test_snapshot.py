@@ -0,0 +1,42 @@
+"""Snapshot files written and read back, including over a loaded snapshot."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot import writeSnapshot, readSnapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'game.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testRoundTrip(self):
+        state = {'health': 80, 'seed': 2**70, 'name': 'warrior', 'dragons': [(1.5, None, True)]}
+        props = {(0, -1): {'trees': array('d', [1, 2, 3, 4, 5, 6])}, (2, 2): {'rocks': array('d', [7, 8, 9])}}
+        writeSnapshot(self.path, state, props)
+        loaded, propArrays = readSnapshot(self.path)
+        self.assertEqual(loaded, state)
+        self.assertEqual(sorted(propArrays), sorted(props))
+        self.assertEqual(propArrays[(0, -1)]['trees'].tolist(), props[(0, -1)]['trees'].tolist())
+
+    def testSaveOverLoadedSnapshot(self):
+        writeSnapshot(self.path, {'tick': 1}, {(0, 0): {'trees': array('d', [1, 2, 3])}})
+        _, propArrays = readSnapshot(self.path)
+        writeSnapshot(self.path, {'tick': 2}, propArrays)
+        writeSnapshot(self.path, {'tick': 3}, {(5, 5): {'rocks': array('d', range(3000))}})
+        self.assertEqual(propArrays[(0, 0)]['trees'].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(os.listdir(self.directory), ['game.snapshot'])
+
+
+if __name__ == '__main__':
+    unittest.main()
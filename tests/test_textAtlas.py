@@ -0,0 +1,63 @@
+"""TextRenderer string cache, drawn into an offscreen EGL context."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, ROOT)
+
+import headless
+
+context = None
+
+
+def setUpModule():
+    global context
+    if 'OpenGL' not in sys.modules:
+        headless.configureEnvironment('egl')
+    try:
+        context = headless.CONTEXTS['egl'](64, 64)
+    except Exception as error:
+        raise unittest.SkipTest('No offscreen EGL context: %s' % (error,))
+
+
+def tearDownModule():
+    if context is not None:
+        context.destroy()
+
+
+class TextRendererCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        from textAtlas import TextRenderer, builtinFont
+        self.renderer = TextRenderer(cacheSize=4)
+        self.renderer.addFont(builtinFont())
+
+    def tearDown(self):
+        self.renderer.delete()
+
+    def testEvictsLeastRecentlyUsed(self):
+        renderer = self.renderer
+        for i in range(4):
+            renderer.draw('label %d' % i, 0, 0)
+        renderer.draw('label 0', 0, 0)
+        evicted = renderer.strings[('label 1', renderer.defaultFont, 1)][0]
+        renderer.draw('label 4', 0, 0)
+        self.assertEqual(renderer.stats, {'built': 5, 'evicted': 1})
+        self.assertEqual(len(renderer.strings), 4)
+        self.assertNotIn(('label 1', renderer.defaultFont, 1), renderer.strings)
+        self.assertIn(('label 0', renderer.defaultFont, 1), renderer.strings)
+        self.assertEqual(evicted.buffers, [])
+
+    def testDynamicTextIsNotCached(self):
+        renderer = self.renderer
+        for i in range(10):
+            renderer.draw('frame %d' % i, 0, 0, dynamic=True)
+        self.assertEqual(renderer.stats, {'built': 0, 'evicted': 0})
+        self.assertEqual(len(renderer.strings), 0)
+        self.assertEqual(len(renderer.stream.buffers), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+from collections import OrderedDict
+
+from OpenGL.GL import (glPixelStorei, glGetIntegerv, glClearColor, glClear, glColor3f, glWindowPos2i, glReadPixels,
+                       glGenTextures, glTexParameteri, glTexImage2D, glBindBuffer, glPushMatrix, glPopMatrix,
+                       glTranslatef, glInterleavedArrays, glDrawArrays, glDeleteTextures,
+                       GL_ALL_ATTRIB_BITS, GL_ENABLE_BIT, GL_COLOR_BUFFER_BIT, GL_TEXTURE_BIT, GL_DEPTH_BUFFER_BIT,
+                       GL_CLIENT_PIXEL_STORE_BIT, GL_CLIENT_VERTEX_ARRAY_BIT, GL_PACK_ALIGNMENT, GL_UNPACK_ALIGNMENT,
+                       GL_VIEWPORT, GL_DEPTH_TEST, GL_LIGHTING, GL_TEXTURE_2D, GL_BLEND, GL_CULL_FACE, GL_RGBA,
+                       GL_ALPHA, GL_UNSIGNED_BYTE, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_WRAP_S,
+                       GL_TEXTURE_WRAP_T, GL_NEAREST, GL_CLAMP_TO_EDGE, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA,
+                       GL_ARRAY_BUFFER, GL_T2F_V3F, GL_QUADS)
+from OpenGL.GL.statecache import getStateCache
+from OpenGL.GLUT import glutGet, glutBitmapCharacter, glutBitmapWidth, glutBitmapHeight, GLUT_INIT_STATE
+from OpenGL.arrays import vbo, GLfloatArray
+from OpenGL.error import NullFunctionError
+
+FIRST_CHARACTER, LAST_CHARACTER = 32, 126
+
+# Classic 5x7 font for FIRST_CHARACTER..LAST_CHARACTER, five columns per
+# character, least significant bit at the top
+BUILTIN_COLUMNS = bytes.fromhex(
+    '0000000000' '00005f0000' '0007000700' '147f147f14' '242a7f2a12' '2313086462' '3649552250' '0005030000'  # space - '
+    '001c224100' '0041221c00' '142a7f2a14' '08083e0808' '0050300000' '0808080808' '0060600000' '2010080402'  # ( - /
+    '3e5149453e' '00427f4000' '4261514946' '2141454b31' '1814127f10' '2745454539' '3c4a494930' '0171090503'  # 0 - 7
+    '3649494936' '064949291e' '0036360000' '0056360000' '0814224100' '1414141414' '0041221408' '0201510906'  # 8 - ?
+    '3249794136' '7e1111117e' '7f49494936' '3e41414122' '7f4141221c' '7f49494941' '7f09090101' '3e41415132'  # @ - G
+    '7f0808087f' '00417f4100' '2040413f01' '7f08142241' '7f40404040' '7f0204027f' '7f0408107f' '3e4141413e'  # H - O
+    '7f09090906' '3e4151215e' '7f09192946' '4649494931' '01017f0101' '3f4040403f' '1f2040201f' '7f2018207f'  # P - W
+    '6314081463' '0304780403' '6151494543' '007f414100' '0204081020' '0041417f00' '0402010204' '4040404040'  # X - _
+    '0001020400' '2054545478' '7f48444438' '3844444420' '384444487f' '3854545418' '087e090102' '0c5252523e'  # ` - g
+    '7f08040478' '00447d4000' '2040443d00' '007f102844' '00417f4000' '7c04180478' '7c08040478' '3844444438'  # h - o
+    '7c14141408' '081414187c' '7c08040408' '4854545420' '043f444020' '3c4040207c' '1c2040201c' '3c4030403c'  # p - w
+    '4428102844' '0c5050503c' '4464544c44' '0008364100' '00007f0000' '0041360800' '0201020402'  # x - ~
+)
+
+
+class BitmapFont:
+    """Glyph bitmaps of a fixed-height font.
+
+    Every glyph covers the full cellHeight, with the baseline descent pixels
+    above the bottom of the cell; glyphs maps a character to (advance, width,
+    pixels) with pixels holding width * cellHeight coverage bytes, bottom row
+    first.
+    """
+
+    def __init__(self, name, cellHeight, descent, glyphs):
+        self.name = name
+        self.cellHeight = cellHeight
+        self.descent = descent
+        self.glyphs = glyphs
+
+
+def builtinFont():
+    """The built-in 5x7 font, usable without GLUT (e.g. in headless contexts)."""
+    cellHeight, descent = 8, 1
+    glyphs = {}
+    for code in range(FIRST_CHARACTER, LAST_CHARACTER + 1):
+        columns = BUILTIN_COLUMNS[(code - FIRST_CHARACTER) * 5:(code - FIRST_CHARACTER + 1) * 5]
+        pixels = bytearray(5 * cellHeight)
+        for x, column in enumerate(columns):
+            for row in range(7):
+                if column & (1 << row):
+                    pixels[(cellHeight - 1 - row) * 5 + x] = 255
+        glyphs[chr(code)] = (6, 5, bytes(pixels))
+    return BitmapFont('builtin5x7', cellHeight, descent, glyphs)
+
+
+def glutAvailable():
+    """True when glutInit() has run, so GLUT bitmap fonts can be rasterized."""
+    try:
+        return bool(glutGet(GLUT_INIT_STATE))
+    except NullFunctionError:
+        return False
+
+
+def glutFont(font, name):
+    """Rasterizes GLUT bitmap font (e.g. GLUT_BITMAP_HELVETICA_18) into a BitmapFont.
+
+    The glyphs are drawn once with glutBitmapCharacter into the back buffer and
+    read back, so this needs GLUT initialised and a current context.
+    """
+    cellHeight = glutBitmapHeight(font)
+    descent = max(1, cellHeight // 4)
+    viewport = glGetIntegerv(GL_VIEWPORT)
+    widths = dict((chr(code), glutBitmapWidth(font, code)) for code in range(FIRST_CHARACTER, LAST_CHARACTER + 1))
+    # Lay the glyphs out in rows fitting the viewport, one pixel apart
+    places, x, y = {}, 0, 0
+    for character, width in widths.items():
+        if x + width > viewport[2]:
+            x, y = 0, y + cellHeight
+        places[character] = (x, y)
+        x += width + 1
+    height = y + cellHeight
+    state = getStateCache()
+    state.pushAttrib(GL_ALL_ATTRIB_BITS)
+    state.pushClientAttrib(GL_CLIENT_PIXEL_STORE_BIT)
+    state.disable(GL_DEPTH_TEST)
+    state.disable(GL_LIGHTING)
+    state.disable(GL_TEXTURE_2D)
+    state.disable(GL_BLEND)
+    glClearColor(0.0, 0.0, 0.0, 1.0)
+    glClear(GL_COLOR_BUFFER_BIT)
+    glColor3f(1.0, 1.0, 1.0)
+    for character, (x, y) in places.items():
+        glWindowPos2i(x, y + descent)
+        glutBitmapCharacter(font, ord(character))
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, viewport[2], height, GL_RGBA, GL_UNSIGNED_BYTE)
+    state.popClientAttrib()
+    state.popAttrib()
+    stride = viewport[2] * 4
+    glyphs = {}
+    for character, (x, y) in places.items():
+        width = widths[character]
+        coverage = bytearray()
+        for row in range(y, y + cellHeight):
+            coverage += pixels[row * stride + x * 4:row * stride + (x + width) * 4:4]
+        glyphs[character] = (width, width, bytes(coverage))
+    return BitmapFont(name, cellHeight, descent, glyphs)
+
+
+def _powerOfTwo(value):
+    size = 1
+    while size < value:
+        size *= 2
+    return size
+
+
+class GlyphAtlas:
+    """All of a font's glyphs packed into one alpha texture.
+
+    regions maps a character to its (u0, v0, u1, v1) texture rectangle.
+    The texture is nearest-filtered, so text is drawn at integer scales.
+    """
+
+    def __init__(self, font, width=256):
+        self.font = font
+        self.regions = {}
+        places, x, y = {}, 0, 0
+        for character, (advance, glyphWidth, pixels) in font.glyphs.items():
+            if x + glyphWidth > width:
+                x, y = 0, y + font.cellHeight + 1
+            places[character] = (x, y)
+            x += glyphWidth + 1
+        height = _powerOfTwo(y + font.cellHeight)
+        image = bytearray(width * height)
+        for character, (x, y) in places.items():
+            advance, glyphWidth, pixels = font.glyphs[character]
+            for row in range(font.cellHeight):
+                offset = (y + row) * width + x
+                image[offset:offset + glyphWidth] = pixels[row * glyphWidth:(row + 1) * glyphWidth]
+            self.regions[character] = (
+                float(x) / width, float(y) / height,
+                float(x + glyphWidth) / width, float(y + font.cellHeight) / height,
+            )
+        self.texture = glGenTextures(1)
+        state = getStateCache()
+        state.pushClientAttrib(GL_CLIENT_PIXEL_STORE_BIT)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        state.bindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_ALPHA, width, height, 0, GL_ALPHA, GL_UNSIGNED_BYTE, bytes(image))
+        state.bindTexture(GL_TEXTURE_2D, 0)
+        state.popClientAttrib()
+
+    def layout(self, text, size=1):
+        """T2F_V3F quad vertices for text with its baseline origin at (0, 0).
+
+        Newlines start a new line below; characters missing from the font are
+        drawn as '?'.
+        """
+        font = self.font
+        vertices = []
+        penX, penY = 0.0, 0.0
+        bottom, top = -font.descent * size, (font.cellHeight - font.descent) * size
+        for character in text:
+            if character == '\n':
+                penX, penY = 0.0, penY - font.cellHeight * size
+                continue
+            if character not in font.glyphs:
+                character = '?'
+            advance, width, pixels = font.glyphs[character]
+            if character != ' ':
+                u0, v0, u1, v1 = self.regions[character]
+                x0, x1 = penX, penX + width * size
+                y0, y1 = penY + bottom, penY + top
+                vertices.extend((
+                    u0, v0, x0, y0, 0.0,
+                    u1, v0, x1, y0, 0.0,
+                    u1, v1, x1, y1, 0.0,
+                    u0, v1, x0, y1, 0.0,
+                ))
+            penX += advance * size
+        return vertices
+
+    def measure(self, text, size=1):
+        """(width, height) in pixels of the widest line and all lines of text."""
+        lines = text.split('\n')
+        width = max(sum(self.font.glyphs.get(c, self.font.glyphs['?'])[0] for c in line) for line in lines)
+        return width * size, len(lines) * self.font.cellHeight * size
+
+    def delete(self):
+        glDeleteTextures([self.texture])
+
+
+class TextRenderer:
+    """Draws strings from glyph atlases, one draw call per string.
+
+    Each distinct (text, font, size) is laid out once into a vertex buffer
+    which is kept in a least-recently-used cache of cacheSize strings, so
+    HUD labels, damage numbers and debug overlays that repeat from frame to
+    frame cost a translate and a glDrawArrays each. Text is drawn in window
+    coordinates (an orthographic projection matching the viewport), tinted
+    with the current color.
+
+    Text that changes every frame (counters, timings) would only churn the
+    cache, draw(dynamic=True) lays it out into a single streaming buffer
+    that is refilled on each call instead.
+
+    Drawing many strings between begin() and end() sets up the texture and
+    blending state once for all of them; draw() outside of begin()/end()
+    does so for the single string.
+    """
+
+    def __init__(self, cacheSize=512):
+        self.cacheSize = cacheSize
+        self.atlases = {}  # font name -> GlyphAtlas
+        self.defaultFont = None
+        self.state = getStateCache()
+        self.strings = OrderedDict()  # (text, font, size) -> (VBO, vertex count), least recently used first
+        self.stream = None  # VBO refilled by every dynamic draw()
+        self.active = False
+        self.boundTexture = None
+        self.stats = {'built': 0, 'evicted': 0}
+
+    def addFont(self, font, default=False):
+        """Builds the atlas for BitmapFont font, returns its name for draw()."""
+        if font.name in self.atlases:
+            self.atlases[font.name].delete()
+        self.atlases[font.name] = GlyphAtlas(font)
+        if default or self.defaultFont is None:
+            self.defaultFont = font.name
+        return font.name
+
+    def measure(self, text, font=None, size=1):
+        return self.atlases[font or self.defaultFont].measure(text, size)
+
+    def _string(self, text, font, size):
+        key = (text, font, size)
+        entry = self.strings.get(key)
+        if entry is not None:
+            self.strings.move_to_end(key)
+            return entry
+        vertices = self.atlases[font].layout(text, size)
+        entry = (vbo.VBO(GLfloatArray.asArray(vertices)) if vertices else None, len(vertices) // 5)
+        self.strings[key] = entry
+        self.stats['built'] += 1
+        while len(self.strings) > self.cacheSize:
+            _, (old, _count) = self.strings.popitem(last=False)
+            if old is not None:
+                old.delete()
+            self.stats['evicted'] += 1
+        return entry
+
+    def _streamed(self, text, font, size):
+        vertices = self.atlases[font].layout(text, size)
+        if not vertices:
+            return None, 0
+        data = GLfloatArray.asArray(vertices)
+        if self.stream is None:
+            self.stream = vbo.VBO(data, usage='GL_STREAM_DRAW')
+        else:
+            self.stream.set_array(data)
+        return self.stream, len(vertices) // 5
+
+    def begin(self):
+        state = self.state
+        state.pushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_TEXTURE_BIT | GL_DEPTH_BUFFER_BIT)
+        state.pushClientAttrib(GL_CLIENT_VERTEX_ARRAY_BIT)
+        state.disable(GL_DEPTH_TEST)
+        state.disable(GL_LIGHTING)
+        state.disable(GL_CULL_FACE)
+        state.enable(GL_TEXTURE_2D)
+        state.enable(GL_BLEND)
+        state.blendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        self.active = True
+        self.boundTexture = None
+
+    def end(self):
+        # the string buffers are bound directly; popClientAttrib() restores the cached binding
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.state.popClientAttrib()
+        self.state.popAttrib()
+        self.active = False
+
+    def draw(self, text, x, y, font=None, size=1, dynamic=False):
+        """Draws text with its first baseline starting at window position (x, y).
+
+        dynamic -- text is unlikely to be drawn again, stream it instead of caching it
+        """
+        font = font or self.defaultFont
+        if dynamic:
+            buffer, count = self._streamed(text, font, size)
+        else:
+            buffer, count = self._string(text, font, size)
+        if buffer is None:
+            return
+        standalone = not self.active
+        if standalone:
+            self.begin()
+        texture = self.atlases[font].texture
+        if texture != self.boundTexture:
+            self.state.bindTexture(GL_TEXTURE_2D, texture)
+            self.boundTexture = texture
+        glPushMatrix()
+        # Whole pixels keep the nearest-filtered glyphs crisp
+        glTranslatef(round(x), round(y), 0.0)
+        buffer.bind()
+        glInterleavedArrays(GL_T2F_V3F, 0, buffer)
+        glDrawArrays(GL_QUADS, 0, count)
+        glPopMatrix()
+        if standalone:
+            self.end()
+
+    def clear(self):
+        """Deletes the cached string buffers (the atlases are kept)."""
+        for buffer, count in self.strings.values():
+            if buffer is not None:
+                buffer.delete()
+        self.strings.clear()
+
+    def delete(self):
+        """Deletes the string buffers, the streaming buffer and the atlases."""
+        self.clear()
+        if self.stream is not None:
+            self.stream.delete()
+            self.stream = None
+        for atlas in self.atlases.values():
+            atlas.delete()
+        self.atlases.clear()
+        self.defaultFont = None